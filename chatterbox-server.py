@@ -3,13 +3,18 @@ Chatterbox TTS Server
 A simple Flask server for self-hosted text-to-speech using Chatterbox TTS
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import torchaudio as ta
 from chatterbox.tts import ChatterboxTTS, ChatterboxMultilingualTTS
 import io
 import os
+import re
 import sys
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 
 app = Flask(__name__)
 CORS(app)
@@ -18,35 +23,221 @@ CORS(app)
 english_model = None
 multilingual_model = None
 
-def get_english_model():
-    global english_model
-    if english_model is None:
-        print("Loading Chatterbox English model...")
-        # Auto-detect: Use CUDA if available, otherwise CPU
-        import torch
-        device = "cuda" if torch.cuda.is_available() and os.environ.get("USE_CPU") != "true" else "cpu"
+# Models load once: concurrent first requests wait for the same load instead of
+# each calling from_pretrained. PRELOAD_MODELS ("en", "multilingual" or both,
+# comma-separated) loads them in the background at startup; /ready answers 503
+# until those are resident.
+PRELOAD_MODELS = [m.strip() for m in os.environ.get('PRELOAD_MODELS', '').split(',') if m.strip()]
+_load_locks = {'en': threading.Lock(), 'multilingual': threading.Lock()}
+load_errors = {}
+
+# generate() reads model.conds, so requests on one model take turns setting it
+_generate_locks = {'en': threading.Lock(), 'multilingual': threading.Lock()}
+default_conds = {}  # kind -> the built-in voice from from_pretrained
+conditioning_signatures = {}  # kind -> signature of the weights that produce its conditionals
+
+# Speaker conditionals cache
+# prepare_conditionals runs once per reference audio (keyed by content hash) and
+# its result is reused; least recently used entries go past CONDITIONALS_CACHE_MB
+CONDITIONALS_CACHE_MAX_BYTES = int(float(os.environ.get('CONDITIONALS_CACHE_MB', 256)) * 1024 * 1024)
+
+# Streaming output (/generate/stream)
+# output_format -> (FFmpeg container, encoder, encoder sample format, mimetype, file extension)
+STREAM_FORMATS = {
+    'mp3': ('mp3', 'libmp3lame', 'fltp', 'audio/mpeg', 'mp3'),
+    'opus': ('ogg', 'libopus', 'flt', 'audio/ogg', 'opus'),
+}
+OUTPUT_BITRATE_KBPS = int(os.environ.get('OUTPUT_BITRATE', 64))
+MIN_BITRATE_KBPS, MAX_BITRATE_KBPS = 8, 320  # Accepted range for the bitrate parameter
+SENTENCE_PAUSE_MS = int(os.environ.get('SENTENCE_PAUSE_MS', 150))  # Silence between streamed sentences
+SENTENCE_FADE_MS = 5  # Fade at each sentence edge, so joins don't click
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|(?<=[。！？])')
+
+def get_device():
+    # Auto-detect: Use CUDA if available, otherwise CPU
+    import torch
+    return "cuda" if torch.cuda.is_available() and os.environ.get("USE_CPU") != "true" else "cpu"
+
+def loaded_model(kind):
+    return english_model if kind == 'en' else multilingual_model
+
+def load_model(kind):
+    """Return the English ('en') or 'multilingual' model, loading it on first use"""
+    global english_model, multilingual_model
+    model = loaded_model(kind)
+    if model is not None:
+        return model
+    
+    with _load_locks[kind]:
+        # Another request may have finished loading while this one waited
+        model = loaded_model(kind)
+        if model is not None:
+            return model
+        
+        name = "English" if kind == 'en' else "Multilingual"
+        print(f"Loading Chatterbox {name} model...")
+        device = get_device()
         print(f"🔧 Using device: {device}")
         if device == "cpu":
             print("⚠️  WARNING: Running on CPU - generation will be VERY slow!")
             print("   For production, use an NVIDIA GPU (cloud or local)")
-        english_model = ChatterboxTTS.from_pretrained(device=device)
-        print(f"✅ English model loaded on {device}")
-    return english_model
+        try:
+            if kind == 'en':
+                model = english_model = ChatterboxTTS.from_pretrained(device=device)
+            else:
+                model = multilingual_model = ChatterboxMultilingualTTS.from_pretrained(device=device)
+        except Exception as e:
+            load_errors[kind] = str(e)
+            raise
+        load_errors.pop(kind, None)
+        default_conds[kind] = model.conds
+        conditioning_signatures[kind] = conditioning_signature(model)
+        print(f"✅ {name} model loaded on {device}")
+    return model
+
+def conditioning_signature(model):
+    """
+    Fingerprint of everything prepare_conditionals depends on: the reference
+    lengths and the voice encoder and S3Gen weights. Models with the same
+    signature produce the same conditionals and share cache entries.
+    """
+    import torch
+    sha = hashlib.sha256()
+    sha.update(repr((model.ENC_COND_LEN, model.DEC_COND_LEN, model.t3.hp.speech_cond_prompt_len)).encode())
+    with torch.inference_mode():
+        for module in (model.ve, model.s3gen):
+            for name, tensor in module.state_dict().items():
+                sha.update(f"{name}:{tuple(tensor.shape)}:{float(tensor.double().sum()):.10e}".encode())
+    return sha.hexdigest()
+
+def get_english_model():
+    return load_model('en')
 
 def get_multilingual_model():
-    global multilingual_model
-    if multilingual_model is None:
-        print("Loading Chatterbox Multilingual model...")
-        # Auto-detect: Use CUDA if available, otherwise CPU
-        import torch
-        device = "cuda" if torch.cuda.is_available() and os.environ.get("USE_CPU") != "true" else "cpu"
-        print(f"🔧 Using device: {device}")
-        if device == "cpu":
-            print("⚠️  WARNING: Running on CPU - generation will be VERY slow!")
-            print("   For production, use an NVIDIA GPU (cloud or local)")
-        multilingual_model = ChatterboxMultilingualTTS.from_pretrained(device=device)
-        print(f"✅ Multilingual model loaded on {device}")
-    return multilingual_model
+    return load_model('multilingual')
+
+def preload_models():
+    """Load PRELOAD_MODELS one after another (runs on a background thread)"""
+    for kind in PRELOAD_MODELS:
+        try:
+            load_model(kind)
+        except Exception as e:
+            print(f"❌ Preloading {kind} model failed: {e}", file=sys.stderr)
+
+def start_preload():
+    unknown = [kind for kind in PRELOAD_MODELS if kind not in _load_locks]
+    if unknown:
+        print(f"⚠️  Ignoring unknown PRELOAD_MODELS: {', '.join(unknown)} (use en, multilingual)")
+        PRELOAD_MODELS[:] = [kind for kind in PRELOAD_MODELS if kind in _load_locks]
+    if PRELOAD_MODELS:
+        threading.Thread(target=preload_models, name="model-preload", daemon=True).start()
+
+def model_states():
+    states = {}
+    for kind, lock in _load_locks.items():
+        if loaded_model(kind) is not None:
+            states[kind] = "loaded"
+        elif lock.locked():
+            states[kind] = "loading"
+        else:
+            states[kind] = "failed" if kind in load_errors else "not_loaded"
+    return states
+
+def tensor_bytes(value):
+    """Bytes held by the tensors in a Conditionals object (dataclasses and dicts of tensors)"""
+    if hasattr(value, 'element_size'):
+        return value.element_size() * value.nelement()
+    if isinstance(value, dict):
+        return sum(tensor_bytes(v) for v in value.values())
+    if hasattr(value, '__dict__'):
+        return sum(tensor_bytes(v) for v in vars(value).values())
+    return 0
+
+class ConditionalsCache:
+    """
+    Bounded LRU cache of Chatterbox speaker conditionals
+    Keyed by (voice content hash, conditioning signature), evicts by total tensor bytes
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            conds = self.entries.get(key)
+            if conds is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return conds
+
+    def put(self, key, conds):
+        size = tensor_bytes(conds)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= tensor_bytes(self.entries.pop(key))
+            self.entries[key] = conds
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= tensor_bytes(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "shared_between_models": len(set(conditioning_signatures.values())) == 1 and len(conditioning_signatures) > 1
+            }
+
+conditionals_cache = ConditionalsCache(CONDITIONALS_CACHE_MAX_BYTES)
+
+# (path, mtime, size) -> sha256, so unchanged voice files are only hashed once
+_voice_hashes = {}
+
+def hash_voice_file(voice_path):
+    """Return the SHA-256 of a voice file's contents"""
+    stat = os.stat(voice_path)
+    stamp = (voice_path, stat.st_mtime_ns, stat.st_size)
+    digest = _voice_hashes.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(voice_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        _voice_hashes[stamp] = digest
+    return digest
+
+def voice_conditionals(kind, model, audio_prompt_path, exaggeration):
+    """
+    Conditionals for a reference voice, from the cache or prepare_conditionals
+    Call with the model's generate lock held (prepare_conditionals sets model.conds)
+    """
+    key = (hash_voice_file(audio_prompt_path), conditioning_signatures[kind])
+    conds = conditionals_cache.get(key)
+    if conds is None:
+        model.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
+        conds = model.conds
+        conditionals_cache.put(key, conds)
+    # generate() swaps in a new conds.t3 when exaggeration changes; the copy keeps the cached entry intact
+    return copy.copy(conds)
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -57,6 +248,20 @@ def health():
         "version": "1.0.0"
     }), 200
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness check for the load balancer
+    200 once every model in PRELOAD_MODELS is resident, 503 while loading (or if a load failed)
+    """
+    states = model_states()
+    is_ready = all(states[kind] == "loaded" for kind in PRELOAD_MODELS)
+    body = {"ready": is_ready, "models": states}
+    errors = {kind: load_errors[kind] for kind in PRELOAD_MODELS if kind in load_errors}
+    if errors:
+        body["errors"] = errors
+    return jsonify(body), 200 if is_ready else 503
+
 @app.route('/info', methods=['GET'])
 def info():
     """Get server information"""
@@ -72,9 +277,71 @@ def info():
             "Emotion/exaggeration control",
             "Multilingual support (23 languages)",
             "High-quality speech synthesis"
-        ]
+        ],
+        "models": model_states(),
+        "conditionals_cache": conditionals_cache.stats()
     }), 200
 
+def parse_generate_request(data):
+    """
+    Validate a /generate body
+    Returns (params, None), or (None, error response) for a bad request
+    """
+    if not data:
+        return None, (jsonify({"error": "Request body is required"}), 400)
+    
+    text = data.get('text')
+    if not text:
+        return None, (jsonify({"error": "Text is required"}), 400)
+    
+    params = {
+        "text": text,
+        "audio_prompt_path": data.get('audio_prompt_path'),
+        "exaggeration": float(data.get('exaggeration', 0.5)),
+        "cfg_weight": float(data.get('cfg_weight', 0.5)),
+        "language_id": data.get('language_id', 'en')
+    }
+    
+    # Validate parameters
+    if not 0.0 <= params["exaggeration"] <= 1.0:
+        return None, (jsonify({"error": "exaggeration must be between 0.0 and 1.0"}), 400)
+    if not 0.0 <= params["cfg_weight"] <= 1.0:
+        return None, (jsonify({"error": "cfg_weight must be between 0.0 and 1.0"}), 400)
+    return params, None
+
+def parse_bitrate(bitrate):
+    """
+    Validate a bitrate in kbit/s ("64", 64 or 64.0)
+    Returns (int, None), or (None, error response) for a bad value
+    """
+    if bitrate is None or bitrate == '':
+        return OUTPUT_BITRATE_KBPS, None
+    try:
+        value = float(bitrate)
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": f"bitrate must be a number of kbit/s, got '{bitrate}'"}), 400)
+    if not value.is_integer() or not MIN_BITRATE_KBPS <= value <= MAX_BITRATE_KBPS:
+        return None, (jsonify({"error": f"bitrate must be a whole number between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbit/s"}), 400)
+    return int(value), None
+
+def synthesize(kind, model, text, params):
+    """Run generate() for one text with the request's voice, returns a (1, samples) tensor"""
+    generate_kwargs = {
+        "exaggeration": params["exaggeration"],
+        "cfg_weight": params["cfg_weight"]
+    }
+    if kind == 'multilingual':
+        generate_kwargs["language_id"] = params["language_id"]
+    
+    audio_prompt_path = params["audio_prompt_path"]
+    with _generate_locks[kind]:
+        # Cached conditionals instead of audio_prompt_path, so repeat voices skip extraction
+        if audio_prompt_path and os.path.exists(audio_prompt_path):
+            model.conds = voice_conditionals(kind, model, audio_prompt_path, params["exaggeration"])
+        else:
+            model.conds = copy.copy(default_conds[kind])
+        return model.generate(text, **generate_kwargs)
+
 @app.route('/generate', methods=['POST'])
 def generate():
     """
@@ -90,45 +357,20 @@ def generate():
     }
     """
     try:
-        data = request.json
-        
-        if not data:
-            return jsonify({"error": "Request body is required"}), 400
-        
-        text = data.get('text')
-        if not text:
-            return jsonify({"error": "Text is required"}), 400
+        params, error = parse_generate_request(request.json)
+        if error:
+            return error
         
-        audio_prompt_path = data.get('audio_prompt_path')
-        exaggeration = float(data.get('exaggeration', 0.5))
-        cfg_weight = float(data.get('cfg_weight', 0.5))
-        language_id = data.get('language_id', 'en')
-        
-        # Validate parameters
-        if not 0.0 <= exaggeration <= 1.0:
-            return jsonify({"error": "exaggeration must be between 0.0 and 1.0"}), 400
-        if not 0.0 <= cfg_weight <= 1.0:
-            return jsonify({"error": "cfg_weight must be between 0.0 and 1.0"}), 400
-        
-        print(f"🎙️ Generating speech: {len(text)} chars, lang={language_id}")
+        print(f"🎙️ Generating speech: {len(params['text'])} chars, lang={params['language_id']}")
+        if params["audio_prompt_path"] and os.path.exists(params["audio_prompt_path"]):
+            print(f"📢 Using voice sample: {params['audio_prompt_path']}")
         
         # Choose model based on language
-        if language_id == 'en':
-            model = get_english_model()
-        else:
-            model = get_multilingual_model()
+        kind = 'en' if params["language_id"] == 'en' else 'multilingual'
+        model = load_model(kind)
         
         # Generate audio
-        generate_kwargs = {
-            "exaggeration": exaggeration,
-            "cfg_weight": cfg_weight
-        }
-        
-        if audio_prompt_path and os.path.exists(audio_prompt_path):
-            print(f"📢 Using voice sample: {audio_prompt_path}")
-            generate_kwargs["audio_prompt_path"] = audio_prompt_path
-        
-        wav = model.generate(text, **generate_kwargs)
+        wav = synthesize(kind, model, params["text"], params)
         
         # Convert to MP3 bytes
         buffer = io.BytesIO()
@@ -148,6 +390,145 @@ def generate():
         print(f"❌ Error generating speech: {e}", file=sys.stderr)
         return jsonify({"error": str(e)}), 500
 
+def split_sentences(text):
+    """Split text after sentence-ending punctuation (Latin and CJK), dropping empty pieces"""
+    return [sentence.strip() for sentence in SENTENCE_END.split(text.strip()) if sentence.strip()]
+
+class EncodedChunks:
+    """File-like write target that hands encoded bytes over as soon as they are written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class StreamingEncoder:
+    """
+    Incremental in-process encoder (FFmpeg via torchaudio StreamWriter)
+    One encoder runs for the whole response, so its frame buffer and state carry
+    across sentences; write() returns the encoded bytes ready so far, close() flushes
+    """
+
+    def __init__(self, output_format, sample_rate, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+        from torchaudio.io import StreamWriter
+
+        container, encoder, encoder_format, self.mimetype, self.extension = STREAM_FORMATS[output_format]
+        self.sink = EncodedChunks()
+        self.writer = StreamWriter(self.sink, format=container)
+        self.writer.add_audio_stream(
+            sample_rate, 1,
+            format='flt',
+            encoder=encoder,
+            encoder_format=encoder_format,
+            encoder_option={'b': str(int(float(bitrate_kbps) * 1000))}
+        )
+        self.writer.open()
+
+    def write(self, audio):
+        self.writer.write_audio_chunk(0, audio.float().clamp(-1.0, 1.0).reshape(-1, 1).cpu())
+        return self.sink.take()
+
+    def close(self):
+        self.writer.flush()
+        self.writer.close()
+        return self.sink.take()
+
+def stream_sentences(kind, model, sentences, params, encoder):
+    """
+    Generator for /generate/stream: synthesizes one sentence at a time and yields
+    its encoded bytes. Sentence edges get a short fade and a pause between them,
+    so joins stay click-free
+
+    If synthesis fails after the headers are out, the exception is re-raised so the
+    server aborts the connection and the client sees a failed transfer, not a short file
+    """
+    import torch
+    
+    fade = int(model.sr * SENTENCE_FADE_MS / 1000)
+    ramp = torch.linspace(0.0, 1.0, fade) if fade else None
+    pause = torch.zeros(int(model.sr * SENTENCE_PAUSE_MS / 1000))
+    
+    done = 0
+    try:
+        for index, sentence in enumerate(sentences):
+            wav = synthesize(kind, model, sentence, params).squeeze(0).float().cpu()
+            if ramp is not None and wav.shape[0] > 2 * fade:
+                wav[:fade] *= ramp
+                wav[-fade:] *= ramp.flip(0)
+            if index > 0:
+                wav = torch.cat([pause, wav])
+            data = encoder.write(wav)
+            done += 1
+            if data:
+                yield data
+        data = encoder.close()
+        encoder = None
+        yield data
+        print(f"✅ Streamed {done} sentence(s)")
+    except Exception as e:
+        # Headers are already sent; re-raising aborts the connection instead of ending it cleanly
+        print(f"❌ Streaming failed after {done} sentence(s): {e}", file=sys.stderr)
+        raise
+    finally:
+        # Also reached when the client disconnects (GeneratorExit)
+        if encoder:
+            try:
+                encoder.close()
+            except Exception:
+                pass
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """
+    Generate speech sentence by sentence and stream it as it is encoded
+    
+    Same body as /generate, plus:
+    {
+        "output_format": "mp3" (default) or "opus",
+        "bitrate": 64 (kbit/s, 8-320, default OUTPUT_BITRATE)
+    }
+    The first audio arrives after the first sentence instead of the whole text
+    """
+    try:
+        data = request.json
+        params, error = parse_generate_request(data)
+        if error:
+            return error
+        
+        output_format = str(data.get('output_format', 'mp3')).lower()
+        if output_format not in STREAM_FORMATS:
+            return jsonify({"error": f"Unsupported output_format '{output_format}' (use {', '.join(STREAM_FORMATS)})"}), 400
+        bitrate, error = parse_bitrate(data.get('bitrate'))
+        if error:
+            return error
+        
+        sentences = split_sentences(params["text"])
+        if not sentences:
+            return jsonify({"error": "Text is required"}), 400
+        print(f"🎙️ Streaming speech: {len(sentences)} sentence(s), lang={params['language_id']}, {output_format}")
+        
+        # Load the model and open the encoder before any bytes are sent, so failures are still JSON errors
+        kind = 'en' if params["language_id"] == 'en' else 'multilingual'
+        model = load_model(kind)
+        encoder = StreamingEncoder(output_format, model.sr, bitrate)
+        
+        return Response(
+            stream_with_context(stream_sentences(kind, model, sentences, params, encoder)),
+            mimetype=encoder.mimetype,
+            headers={"X-Sample-Rate": str(model.sr)}
+        )
+        
+    except Exception as e:
+        print(f"❌ Error generating speech: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/voices/upload', methods=['POST'])
 def upload_voice():
     """
@@ -198,15 +579,21 @@ if __name__ == '__main__':
     print(f"Port: {port}")
     print(f"Debug: {debug}")
     print(f"Device: {'CPU' if os.environ.get('USE_CPU') == 'true' else 'CUDA/GPU'}")
+    print(f"Preload: {', '.join(PRELOAD_MODELS) or 'none (load on first request)'}")
     print("=" * 60)
     print()
     print("Endpoints:")
     print(f"  GET  http://localhost:{port}/health")
+    print(f"  GET  http://localhost:{port}/ready")
     print(f"  GET  http://localhost:{port}/info")
     print(f"  POST http://localhost:{port}/generate")
+    print(f"  POST http://localhost:{port}/generate/stream")
     print(f"  POST http://localhost:{port}/voices/upload")
     print()
     print("Starting server...")
     print("=" * 60)
     
+    # With debug on, the reloader runs this twice; only its child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_preload()
     app.run(host='0.0.0.0', port=port, debug=debug)
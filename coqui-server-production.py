@@ -4,13 +4,26 @@ Optimized for RTX 3090/4090 with XTTS-v2 model
 """
 
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import torch
 import torchaudio
 from TTS.api import TTS
 import os
+import io
+import json
+import asyncio
+import functools
+import itertools
+import contextlib
+import gc
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import zipfile
 import tempfile
 import logging
 from pathlib import Path
@@ -37,15 +50,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global TTS model (loaded once at startup)
-tts_model = None
+# Device, detected at startup; models live in model_registry
 device = None
 
 # Model configuration
 MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+DEFAULT_ENGINE = "xtts"
 OUTPUT_DIR = Path("/tmp/tts-output")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Batch generation configuration
+# BATCH_MAX_SIZE caps sentences per micro-batch, BATCH_ITEM_VRAM_MB is the
+# estimated VRAM each sequence in a batch needs during GPT decoding
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_ITEM_VRAM_MB = int(os.environ.get("BATCH_ITEM_VRAM_MB", 300))
+
+# Dynamic batching of concurrent requests
+# Requests with the same language and speaker that arrive within
+# BATCH_WINDOW_MS of each other share one batched pass (up to BATCH_MAX_REQUESTS)
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 30))
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", 8))
+
+# Persistent sentence audio cache
+# Synthesized sentences are kept as 16-bit WAV files under SENTENCE_CACHE_DIR and
+# reused for identical (sentence, voice, language, settings); least recently used
+# files are deleted past SENTENCE_CACHE_MB (0 disables the cache)
+SENTENCE_CACHE_DIR = Path(os.environ.get("SENTENCE_CACHE_DIR", "/tmp/tts-sentence-cache"))
+SENTENCE_CACHE_MAX_BYTES = int(float(os.environ.get("SENTENCE_CACHE_MB", 1024)) * 1024 * 1024)
+
+# Inference mode
+# PRECISION: fp32, or fp16/bf16 autocast (fp16 needs CUDA, bf16 also runs on CPU)
+# TORCH_COMPILE: torch.compile the GPT decoder and the HiFiGAN vocoder at startup
+# (the first requests are slower while kernels compile)
+PRECISION = os.environ.get("PRECISION", "fp32").lower()
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+AUTOCAST_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+# Output formats
+# output_format -> (FFmpeg container, encoder, encoder sample format, media type, file extension)
+# Compressed formats are encoded in process, OUTPUT_BITRATE is the default in kbit/s
+OUTPUT_FORMATS = {
+    "wav": (None, None, None, "audio/wav", "wav"),
+    "mp3": ("mp3", "libmp3lame", "fltp", "audio/mpeg", "mp3"),
+    "opus": ("ogg", "libopus", "flt", "audio/ogg", "opus"),
+    "aac": ("adts", "aac", "fltp", "audio/aac", "aac"),
+}
+OUTPUT_BITRATE_KBPS = int(os.environ.get("OUTPUT_BITRATE", 64))
+MIN_BITRATE_KBPS, MAX_BITRATE_KBPS = 8, 320  # Accepted range for the bitrate parameter
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+ENCODE_BLOCK_SIZE = 65536  # Samples handed to the encoder per write
+
+# Model registry
+# Every engine in MODEL_SPECS can be resident at once. MODEL_VRAM_BUDGET_MB caps
+# the weights kept on the GPU (default: MODEL_VRAM_FRACTION of total VRAM, the
+# rest is left for activations); idle models are evicted least recently used
+# first to make room. PRELOAD_MODELS load at startup, PINNED_MODELS are never
+# evicted. Requests wait up to MODEL_LOAD_TIMEOUT seconds for a model to load.
+MODEL_VRAM_BUDGET_MB = float(os.environ.get("MODEL_VRAM_BUDGET_MB", 0))
+MODEL_VRAM_FRACTION = float(os.environ.get("MODEL_VRAM_FRACTION", 0.6))
+PRELOAD_MODELS = [m.strip() for m in os.environ.get("PRELOAD_MODELS", DEFAULT_ENGINE).split(",") if m.strip()]
+PINNED_MODELS = [m.strip() for m in os.environ.get("PINNED_MODELS", DEFAULT_ENGINE).split(",") if m.strip()]
+MODEL_LOAD_TIMEOUT = float(os.environ.get("MODEL_LOAD_TIMEOUT", 300))
+
+# Inference executor configuration
+# Blocking model calls run on INFERENCE_WORKERS threads so the event loop
+# (and /health) stays responsive. At most INFERENCE_QUEUE_SIZE requests wait
+# for a worker; anything beyond that gets 429 with Retry-After.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 1))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", 8))
+INFERENCE_RETRY_AFTER = int(os.environ.get("INFERENCE_RETRY_AFTER", 10))
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="tts-inference")
+inference_in_flight = 0  # Admitted requests, only touched from the event loop thread
+inference_active = 0     # Requests whose model work is running on a worker thread
+inference_rejected = 0
+_active_lock = threading.Lock()
+
+def admit_inference():
+    """Admit one request or raise 429 if the worker pool and queue are full"""
+    global inference_in_flight, inference_rejected
+    
+    if inference_in_flight >= INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE:
+        inference_rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Inference queue is full, retry later",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)}
+        )
+    inference_in_flight += 1
+
+def release_inference():
+    global inference_in_flight
+    inference_in_flight -= 1
+
+def run_counted(requests, fn, *args, **kwargs):
+    """Run fn on a worker thread, counting the requests it serves as active"""
+    global inference_active
+    with _active_lock:
+        inference_active += requests
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        with _active_lock:
+            inference_active -= requests
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run a blocking inference call on the executor
+    Raises 429 straight away if the worker pool and queue are full
+    """
+    admit_inference()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            inference_executor, functools.partial(run_counted, 1, fn, *args, **kwargs)
+        )
+    finally:
+        release_inference()
+
+def inference_queue_stats():
+    """Executor occupancy for /health"""
+    return {
+        "workers": INFERENCE_WORKERS,
+        "active": inference_active,
+        "queued": max(0, inference_in_flight - inference_active),
+        "max_queue": INFERENCE_QUEUE_SIZE,
+        "rejected": inference_rejected
+    }
+
 # Request models
 class GenerateRequest(BaseModel):
     text: str
@@ -55,11 +187,332 @@ class GenerateRequest(BaseModel):
     speed: float = 0.92
     speaker: str = "Claribel Dervla"
     denoiser_strength: float = 0.02
+    output_format: str = "wav"
+    bitrate: int = OUTPUT_BITRATE_KBPS
+    engine: str = DEFAULT_ENGINE
+
+def check_output_format(output_format):
+    """Normalize an output_format parameter, 400 for anything not in OUTPUT_FORMATS"""
+    output_format = (output_format or "wav").lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported output_format '{output_format}' (use {', '.join(OUTPUT_FORMATS)})"
+        )
+    return output_format
+
+def autocast_dtype():
+    """Autocast dtype for PRECISION on this device, None for fp32"""
+    dtype = AUTOCAST_DTYPES.get(PRECISION)
+    if device == "cuda" or (device == "cpu" and dtype == torch.bfloat16):
+        return dtype
+    return None
+
+def inference_context():
+    """torch.inference_mode(), plus autocast when PRECISION asks for it"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    dtype = autocast_dtype()
+    if dtype is not None:
+        stack.enter_context(torch.autocast(device_type=device, dtype=dtype))
+    return stack
+
+def configure_inference(tts):
+    """
+    Apply PRECISION and TORCH_COMPILE to the loaded model
+    Weights stay fp32 (autocast picks the precision per op) and the vocoder's output
+    is cast back to float32; torch.compile patches forward in place
+    """
+    xtts = tts.synthesizer.tts_model
+    if PRECISION not in ("fp32", *AUTOCAST_DTYPES):
+        logger.warning(f"⚠️  Unknown PRECISION '{PRECISION}', using fp32")
+    elif PRECISION != "fp32" and autocast_dtype() is None:
+        logger.warning(f"⚠️  {PRECISION} autocast is not available on {device}, using fp32")
+    
+    if autocast_dtype() is not None:
+        vocoder_forward = xtts.hifigan_decoder.forward
+        xtts.hifigan_decoder.forward = lambda *args, **kwargs: vocoder_forward(*args, **kwargs).float()
+    
+    if TORCH_COMPILE:
+        import torch._dynamo
+        # Anything that fails to compile runs eagerly instead of failing the request
+        torch._dynamo.config.suppress_errors = True
+        # The GPT transformer runs once per generated audio token, the vocoder once per sentence
+        xtts.gpt.gpt.forward = torch.compile(xtts.gpt.gpt.forward, dynamic=True)
+        xtts.hifigan_decoder.forward = torch.compile(xtts.hifigan_decoder.forward, dynamic=True)
+    
+    logger.info(f"   Inference mode: {PRECISION if autocast_dtype() else 'fp32'}"
+                f"{' + torch.compile' if TORCH_COMPILE else ''}")
+
+def load_xtts():
+    tts = TTS(MODEL_NAME).to(device)
+    configure_inference(tts)
+    return tts
+
+def load_coqui(model_name):
+    return TTS(model_name).to(device)
+
+def load_chatterbox(multilingual=False):
+    # Optional dependency, only needed when a Chatterbox engine is requested
+    from chatterbox.tts import ChatterboxTTS, ChatterboxMultilingualTTS
+    cls = ChatterboxMultilingualTTS if multilingual else ChatterboxTTS
+    return cls.from_pretrained(device=device)
+
+# engine -> loader and the VRAM (MB) to make room for before loading;
+# the size actually kept against the budget is measured after loading
+MODEL_SPECS = {
+    "xtts": {"load": load_xtts, "vram_mb": 2500, "model": MODEL_NAME},
+    "vits": {"load": functools.partial(load_coqui, "tts_models/en/vctk/vits"), "vram_mb": 500,
+             "model": "tts_models/en/vctk/vits"},
+    "tacotron2": {"load": functools.partial(load_coqui, "tts_models/en/ljspeech/tacotron2-DDC"), "vram_mb": 700,
+                  "model": "tts_models/en/ljspeech/tacotron2-DDC"},
+    "chatterbox": {"load": load_chatterbox, "vram_mb": 4000, "model": "ResembleAI/chatterbox"},
+    "chatterbox-multilingual": {"load": functools.partial(load_chatterbox, True), "vram_mb": 5000,
+                                "model": "ResembleAI/chatterbox (multilingual)"},
+}
+
+def model_bytes(model):
+    """Bytes of parameters and buffers held by model (or by its nn.Module attributes)"""
+    if isinstance(model, torch.nn.Module):
+        modules = [model]
+    else:
+        modules = [value for value in vars(model).values() if isinstance(value, torch.nn.Module)]
+    seen = set()
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) not in seen:
+                seen.add(id(tensor))
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+class ModelUnavailable(Exception):
+    """A model could not be loaded in time (or does not fit the VRAM budget)"""
+
+class ResidentModel:
+    def __init__(self, name, model, size, pinned):
+        self.name = name
+        self.model = model
+        self.size = size
+        self.pinned = pinned
+        self.leases = 0
+        self.loaded_at = time.time()
+        self.last_used = time.time()
+
+class ModelRegistry:
+    """
+    Every engine this server can run, loaded on demand and kept under a VRAM budget
+    
+    lease(name) hands out the current instance and counts it as in use. Loads run
+    one at a time on a background thread; when a load needs room, resident models
+    with no leases are evicted least recently used first (pinned ones never).
+    reload(name) builds a new instance next to the old one and swaps it in under
+    the lock: requests already holding the old instance finish on it, new ones get
+    the new one, and the old weights are freed when its last lease is released.
+    """
+    
+    def __init__(self, specs, pinned=()):
+        self.specs = specs
+        self.pinned = set(pinned)
+        self.budget = 0  # Bytes, 0 is unlimited; set by configure() once the device is known
+        self.resident = OrderedDict()  # name -> ResidentModel, least recently used first
+        self.retired = []  # Replaced or unloaded instances still leased
+        self.loading = {}  # name -> Future of the running load
+        self.errors = {}  # name -> last load error
+        self.evictions = 0
+        self.condition = threading.Condition()
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+    
+    def configure(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+    
+    def check(self, name):
+        if name not in self.specs:
+            raise KeyError(f"Unknown engine '{name}' (use {', '.join(self.specs)})")
+    
+    def is_resident(self, name):
+        with self.condition:
+            return name in self.resident
+    
+    def used_bytes(self):
+        return sum(r.size for r in self.resident.values()) + sum(r.size for r in self.retired)
+    
+    def load(self, name, reload=False):
+        """
+        Start loading name in the background, returns a Future for the load
+        A resident model is only loaded again (and hot-swapped) with reload=True
+        """
+        self.check(name)
+        with self.condition:
+            future = self.loading.get(name)
+            if future is None:
+                if name in self.resident and not reload:
+                    future = Future()
+                    future.set_result(None)
+                    return future
+                future = self.loader.submit(self._load, name)
+                self.loading[name] = future
+            return future
+    
+    def reload(self, name):
+        return self.load(name, reload=True)
+    
+    def _load(self, name):
+        spec = self.specs[name]
+        try:
+            self.make_room(spec["vram_mb"] * 1024 * 1024, keep=name)
+            logger.info(f"📦 Loading {name}: {spec['model']}...")
+            start = time.time()
+            model = spec["load"]()
+            size = model_bytes(model)
+            
+            with self.condition:
+                old = self.resident.pop(name, None)
+                self.resident[name] = ResidentModel(name, model, size, name in self.pinned)
+                self.errors.pop(name, None)
+                if old is not None and old.leases > 0:
+                    self.retired.append(old)
+                self.condition.notify_all()
+            
+            logger.info(f"✅ {name} loaded in {time.time() - start:.2f}s ({size / 1e6:.0f} MB)"
+                        f"{', swapped in for the previous instance' if old is not None else ''}")
+            if old is not None:
+                del old
+                free_device_memory()
+        except Exception as e:
+            logger.error(f"❌ Failed to load {name}: {e}")
+            with self.condition:
+                self.errors[name] = str(e)
+            raise
+        finally:
+            with self.condition:
+                self.loading.pop(name, None)
+                self.condition.notify_all()
+    
+    def make_room(self, needed, keep):
+        """Evict idle models until needed more bytes fit the budget, waiting for leases to end if necessary"""
+        if not self.budget:
+            return
+        evicted = False
+        deadline = time.time() + MODEL_LOAD_TIMEOUT
+        with self.condition:
+            while self.used_bytes() + needed > self.budget:
+                victim = next(
+                    (r for r in self.resident.values() if r.leases == 0 and not r.pinned and r.name != keep),
+                    None
+                )
+                if victim is not None:
+                    del self.resident[victim.name]
+                    self.evictions += 1
+                    evicted = True
+                    logger.info(f"♻️  Evicted {victim.name} ({victim.size / 1e6:.0f} MB) to make room")
+                    continue
+                # Nothing idle to evict: wait for a lease to end, unless nothing could ever free
+                if not any(r.leases for r in self.resident.values()) and not self.retired:
+                    raise ModelUnavailable(
+                        f"{needed / 1e6:.0f} MB does not fit the {self.budget / 1e6:.0f} MB model budget"
+                    )
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ModelUnavailable("Timed out waiting for VRAM held by models in use")
+                self.condition.wait(remaining)
+        if evicted:
+            free_device_memory()
+    
+    def acquire(self, name, timeout=MODEL_LOAD_TIMEOUT):
+        """Lease the current instance of name, loading it first if needed"""
+        self.check(name)
+        deadline = time.time() + timeout
+        while True:
+            with self.condition:
+                resident = self.resident.get(name)
+                if resident is not None:
+                    resident.leases += 1
+                    resident.last_used = time.time()
+                    self.resident.move_to_end(name)
+                    return resident
+            future = self.load(name)
+            try:
+                future.result(max(0, deadline - time.time()))
+            except TimeoutError:
+                raise ModelUnavailable(f"{name} is still loading")
+            except Exception as e:
+                raise ModelUnavailable(f"{name} failed to load: {e}")
+    
+    def release(self, resident):
+        freed = False
+        with self.condition:
+            resident.leases -= 1
+            if resident.leases == 0 and resident in self.retired:
+                self.retired.remove(resident)
+                freed = True
+            self.condition.notify_all()
+        if freed:
+            logger.info(f"   Released replaced {resident.name} instance")
+            del resident
+            free_device_memory()
+    
+    @contextlib.contextmanager
+    def lease(self, name, timeout=MODEL_LOAD_TIMEOUT):
+        """with model_registry.lease(name) as model: ... (the instance can't be evicted meanwhile)"""
+        resident = self.acquire(name, timeout)
+        try:
+            yield resident.model
+        finally:
+            self.release(resident)
+    
+    def unload(self, name):
+        """Drop name from the registry; a leased instance is freed once its last lease ends"""
+        self.check(name)
+        with self.condition:
+            resident = self.resident.pop(name, None)
+            if resident is None:
+                return False
+            if resident.leases > 0:
+                self.retired.append(resident)
+        logger.info(f"♻️  Unloaded {name}")
+        del resident
+        free_device_memory()
+        return True
+    
+    def stats(self):
+        with self.condition:
+            models = {}
+            for name, spec in self.specs.items():
+                resident = self.resident.get(name)
+                if resident is not None:
+                    state = "reloading" if name in self.loading else "resident"
+                else:
+                    state = "loading" if name in self.loading else ("failed" if name in self.errors else "available")
+                models[name] = {
+                    "model": spec["model"],
+                    "state": state,
+                    "pinned": name in self.pinned,
+                    "size_mb": round(resident.size / 1e6) if resident else None,
+                    "leases": resident.leases if resident else 0,
+                    "idle_seconds": round(time.time() - resident.last_used, 1) if resident else None,
+                    "error": self.errors.get(name)
+                }
+            return {
+                "budget_mb": round(self.budget / 1e6) if self.budget else None,
+                "used_mb": round(self.used_bytes() / 1e6),
+                "retired_instances": len(self.retired),
+                "evictions": self.evictions,
+                "models": models
+            }
+
+def free_device_memory():
+    """Return freed blocks to the driver so the next load sees them"""
+    gc.collect()
+    if device == "cuda":
+        torch.cuda.empty_cache()
+
+model_registry = ModelRegistry(MODEL_SPECS, PINNED_MODELS)
 
 @app.on_event("startup")
 async def startup_event():
     """Load TTS model on server startup"""
-    global tts_model, device
+    global device
     
     logger.info("🚀 Starting Coqui TTS Server...")
     
@@ -72,15 +525,22 @@ async def startup_event():
         gpu_memory = torch.cuda.get_device_properties(0).total_memory / 1e9
         logger.info(f"   GPU: {gpu_name}")
         logger.info(f"   VRAM: {gpu_memory:.1f} GB")
+        model_registry.configure(MODEL_VRAM_BUDGET_MB or gpu_memory * 1e3 * MODEL_VRAM_FRACTION)
     else:
         logger.warning("⚠️  No GPU detected! Voice generation will be SLOW.")
+        model_registry.configure(MODEL_VRAM_BUDGET_MB)
     
-    # Load model
-    logger.info(f"📦 Loading model: {MODEL_NAME}...")
+    # Preloads run in the background; startup waits for the default engine only
     start_time = time.time()
+    loads = {}
+    for name in PRELOAD_MODELS:
+        try:
+            loads[name] = model_registry.load(name)
+        except KeyError as e:
+            logger.warning(f"⚠️  PRELOAD_MODELS: {e}")
     
     try:
-        tts_model = TTS(MODEL_NAME).to(device)
+        await asyncio.wrap_future(loads.get(DEFAULT_ENGINE) or model_registry.load(DEFAULT_ENGINE))
         load_time = time.time() - start_time
         logger.info(f"✅ Model loaded in {load_time:.2f}s")
         logger.info("🎤 Server ready for voice generation!")
@@ -95,13 +555,13 @@ async def root():
         "service": "Coqui TTS GPU Server",
         "model": MODEL_NAME,
         "device": device,
-        "status": "ready" if tts_model else "loading"
+        "status": "ready" if model_registry.is_resident(DEFAULT_ENGINE) else "loading"
     }
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    if not tts_model:
+    if not model_registry.is_resident(DEFAULT_ENGINE):
         return JSONResponse(
             status_code=503,
             content={"status": "loading", "message": "Model still loading"}
@@ -112,9 +572,23 @@ async def health_check():
         "model": MODEL_NAME,
         "device": device,
         "gpu_available": torch.cuda.is_available(),
-        "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+        "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "inference_queue": inference_queue_stats(),
+        "dynamic_batching": batch_scheduler.stats(),
+        "inference_mode": {"precision": PRECISION, "compile": TORCH_COMPILE},
+        "sentence_cache": sentence_cache.stats(),
+        "models": model_registry.stats()
     }
 
+def check_bitrate(bitrate):
+    """Range-check a bitrate parameter in kbit/s, 400 outside MIN_BITRATE_KBPS..MAX_BITRATE_KBPS"""
+    if not MIN_BITRATE_KBPS <= bitrate <= MAX_BITRATE_KBPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"bitrate must be between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbit/s"
+        )
+    return bitrate
+
 @app.post("/generate")
 async def generate_speech_json(request: GenerateRequest):
     """
@@ -125,14 +599,24 @@ async def generate_speech_json(request: GenerateRequest):
         request: GenerateRequest with text and voice settings
     
     Returns:
-        Audio file (WAV format)
+        Audio file (WAV, or the requested output_format at the requested bitrate)
     """
-    if not tts_model:
+    if request.engine not in MODEL_SPECS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown engine '{request.engine}' (use {', '.join(MODEL_SPECS)})"
+        )
+    # Other engines load on first use (the request waits up to MODEL_LOAD_TIMEOUT)
+    if request.engine == DEFAULT_ENGINE and not model_registry.is_resident(DEFAULT_ENGINE):
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     
     if not request.text or len(request.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
+    output_format = check_output_format(request.output_format)
+    check_bitrate(request.bitrate)
+    _, _, _, media_type, extension = OUTPUT_FORMATS[output_format]
+    
     logger.info(f"🎤 Generating audio (JSON endpoint): {request.text[:50]}...")
     start_time = time.time()
     
@@ -140,21 +624,35 @@ async def generate_speech_json(request: GenerateRequest):
     
     try:
         # Generate output filename
-        output_filename = f"output_{int(time.time())}_{os.getpid()}.wav"
+        output_filename = f"output_{uuid.uuid4().hex}.{extension}"
         output_path = OUTPUT_DIR / output_filename
         
         # Generate audio with default speaker (no cloning)
-        logger.info(f"   Using default speaker: {request.speaker}")
+        logger.info(f"   Using default speaker: {request.speaker} ({request.engine})")
         logger.info("   Generating speech...")
         gen_start = time.time()
         
-        tts_model.tts_to_file(
-            text=request.text,
-            file_path=str(output_path),
-            language=request.language,
-            speaker=request.speaker,
-            split_sentences=True
-        )
+        job = {
+            "text": request.text,
+            "speaker": request.speaker,
+            "output_path": str(output_path),
+            "output_format": output_format,
+            "bitrate": request.bitrate,
+            "cache_usage": new_cache_usage()
+        }
+        if request.engine == DEFAULT_ENGINE:
+            # Batched with other concurrent requests for the same speaker
+            await batch_scheduler.submit(("speaker", request.speaker, request.language), job)
+        else:
+            # Loads happen on the registry's loader thread; inference workers only see resident models
+            resident = await acquire_model(request.engine)
+            try:
+                await run_inference(
+                    render_engine, request.engine, resident.model, request.text, request.speaker,
+                    request.language, str(output_path), output_format, request.bitrate
+                )
+            finally:
+                model_registry.release(resident)
         
         gen_time = time.time() - gen_start
         total_time = time.time() - start_time
@@ -164,14 +662,19 @@ async def generate_speech_json(request: GenerateRequest):
         # Return audio file
         return FileResponse(
             path=output_path,
-            media_type="audio/wav",
+            media_type=media_type,
             filename=output_filename,
             headers={
                 "X-Generation-Time": f"{gen_time:.2f}",
-                "X-Total-Time": f"{total_time:.2f}"
+                "X-Total-Time": f"{total_time:.2f}",
+                **cache_usage_headers(job["cache_usage"])
             }
         )
     
+    except HTTPException:
+        raise
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Error generating audio: {e}")
         raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
@@ -179,7 +682,9 @@ async def generate_speech_json(request: GenerateRequest):
 @app.post("/generate-audio")
 async def generate_audio(
     text: str = Form(...),
-    speaker_wav: UploadFile = File(...)
+    speaker_wav: UploadFile = File(...),
+    output_format: str = Form("wav"),
+    bitrate: int = Form(OUTPUT_BITRATE_KBPS)
 ):
     """
     Generate audio from text using voice cloning
@@ -187,46 +692,51 @@ async def generate_audio(
     Args:
         text: Text to convert to speech
         speaker_wav: Reference audio file for voice cloning (WAV, MP3)
+        output_format: wav, mp3, opus or aac (default: wav)
+        bitrate: kbit/s for compressed formats, 8-320 (default: OUTPUT_BITRATE)
     
     Returns:
-        Audio file (WAV format)
+        Audio file in the requested format
     """
-    if not tts_model:
+    if not model_registry.is_resident(DEFAULT_ENGINE):
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     
     if not text or len(text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
+    output_format = check_output_format(output_format)
+    check_bitrate(bitrate)
+    _, _, _, media_type, extension = OUTPUT_FORMATS[output_format]
+    
     logger.info(f"🎤 Generating audio for text: {text[:50]}...")
     start_time = time.time()
     
-    # Create temp files
-    temp_speaker_path = None
     output_path = None
     
     try:
-        # Save uploaded speaker audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_speaker:
-            temp_speaker_path = temp_speaker.name
-            content = await speaker_wav.read()
-            temp_speaker.write(content)
-        
-        logger.info(f"   Speaker audio saved: {len(content)} bytes")
+        # Uploaded speaker audio stays in memory, owned by the batch scheduler
+        content = await speaker_wav.read()
+        logger.info(f"   Speaker audio received: {len(content)} bytes")
         
         # Generate output filename
-        output_filename = f"output_{int(time.time())}.wav"
+        output_filename = f"output_{uuid.uuid4().hex}.{extension}"
         output_path = OUTPUT_DIR / output_filename
         
         # Generate audio with voice cloning
         logger.info("   Generating speech...")
         gen_start = time.time()
         
-        tts_model.tts_to_file(
-            text=text,
-            file_path=str(output_path),
-            speaker_wav=temp_speaker_path,
-            language="en",  # Change if needed
-            split_sentences=True  # Better for long texts
+        # Batched with other concurrent requests that upload the same reference audio
+        job = {
+            "text": text,
+            "output_path": str(output_path),
+            "output_format": output_format,
+            "bitrate": bitrate
+        }
+        await batch_scheduler.submit(
+            ("voice", hashlib.sha256(content).hexdigest(), "en"),  # Change language if needed
+            job,
+            reference=content
         )
         
         gen_time = time.time() - gen_start
@@ -237,71 +747,742 @@ async def generate_audio(
         # Return audio file
         return FileResponse(
             path=output_path,
-            media_type="audio/wav",
+            media_type=media_type,
             filename=output_filename,
             headers={
                 "X-Generation-Time": f"{gen_time:.2f}",
-                "X-Total-Time": f"{total_time:.2f}"
+                "X-Total-Time": f"{total_time:.2f}",
+                **cache_usage_headers(job["cache_usage"])
             }
         )
     
+    except HTTPException:
+        raise
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Error generating audio: {e}")
         raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
+
+def micro_batch_size():
+    """Number of sequences to decode together, limited by free VRAM"""
+    if device != "cuda":
+        return BATCH_MAX_SIZE
+    free_bytes, _ = torch.cuda.mem_get_info()
+    fits = int(free_bytes // (BATCH_ITEM_VRAM_MB * 1024 * 1024))
+    return max(1, min(BATCH_MAX_SIZE, fits))
+
+def inference_settings(xtts):
+    """Sampling settings XTTS uses for tts_to_file, taken from the model config"""
+    config = xtts.config
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+
+def batch_inference(xtts, sentences, language, gpt_cond_latent, speaker_embedding,
+                    batch_size=None, do_sample=True):
+    """
+    Run XTTS on many sentences that share one speaker
+
+    The autoregressive GPT decoding (the expensive part) runs on micro-batches
+    of sentences with exactly the same number of text tokens. XTTS's generate()
+    takes no attention mask, so padding shorter rows would condition them on
+    extra tokens at shifted positions; equal lengths need no padding and each
+    row sees the same input as it would alone. Each sequence is then trimmed at
+    its first stop token and decoded to audio on its own, exactly like
+    Xtts.inference does. Falls back to per-sentence inference if a batch fails
+    (e.g. OOM).
+
+    batch_size defaults to micro_batch_size(); do_sample=False decodes greedily,
+    which scripts/test-coqui-batch.py uses to compare batch sizes.
+    Returns one 1-D float tensor per sentence, in input order
+    """
+    settings = inference_settings(xtts)
+    lang = language.split("-")[0]
+    gpt = xtts.gpt
+
+    tokens = [
+        torch.IntTensor(xtts.tokenizer.encode(sentence.strip().lower(), lang=lang)).to(xtts.device)
+        for sentence in sentences
+    ]
+    # Bucket by token length, then split each bucket into micro-batches
+    def token_length(i):
+        return tokens[i].shape[-1]
+
+    order = sorted(range(len(sentences)), key=token_length)
+    wavs = [None] * len(sentences)
+    batch_size = batch_size or micro_batch_size()
+    batches = []
+    for _, bucket in itertools.groupby(order, key=token_length):
+        bucket = list(bucket)
+        batches += [bucket[start:start + batch_size] for start in range(0, len(bucket), batch_size)]
+
+    for batch in batches:
+        try:
+            with inference_context():
+                text_inputs = torch.stack([tokens[i] for i in batch])
+
+                codes = gpt.generate(
+                    cond_latents=gpt_cond_latent.expand(len(batch), -1, -1),
+                    text_inputs=text_inputs,
+                    input_tokens=None,
+                    do_sample=do_sample,
+                    top_p=settings["top_p"],
+                    top_k=settings["top_k"],
+                    temperature=settings["temperature"],
+                    num_return_sequences=1,
+                    num_beams=1,
+                    length_penalty=settings["length_penalty"],
+                    repetition_penalty=settings["repetition_penalty"],
+                    output_attentions=False,
+                )
+
+                for row, i in enumerate(batch):
+                    seq = codes[row:row + 1]
+                    stops = (seq[0] == gpt.stop_audio_token).nonzero()
+                    if len(stops) > 0:
+                        seq = seq[:, :int(stops[0]) + 1]
+                    text_tokens = tokens[i].unsqueeze(0)
+                    gpt_latents = gpt(
+                        text_tokens,
+                        torch.tensor([text_tokens.shape[-1]], device=xtts.device),
+                        seq,
+                        torch.tensor([seq.shape[-1] * gpt.code_stride_len], device=xtts.device),
+                        cond_latents=gpt_cond_latent,
+                        return_attentions=False,
+                        return_latent=True,
+                    )
+                    wavs[i] = xtts.hifigan_decoder(gpt_latents, g=speaker_embedding).cpu().squeeze()
+        except Exception as e:
+            logger.warning(f"⚠️  Batched decoding failed ({e}), falling back to per-sentence inference")
+            if device == "cuda":
+                torch.cuda.empty_cache()
+            for i in batch:
+                with inference_context():
+                    out = xtts.inference(
+                        sentences[i], language, gpt_cond_latent, speaker_embedding, do_sample=do_sample, **settings
+                    )
+                wav = out["wav"]
+                wavs[i] = wav.cpu().squeeze() if torch.is_tensor(wav) else torch.as_tensor(wav).squeeze()
+
+    return wavs
+
+def speaker_latents(xtts, speaker_wav=None, speaker=None):
+    """Conditioning latents for a reference file, or for a built-in speaker name"""
+    if speaker_wav is None:
+        latents = xtts.speaker_manager.speakers[speaker]
+        return latents["gpt_cond_latent"], latents["speaker_embedding"]
     
-    finally:
-        # Cleanup temp speaker file
-        if temp_speaker_path and os.path.exists(temp_speaker_path):
+    config = xtts.config
+    with inference_context():
+        return xtts.get_conditioning_latents(
+            audio_path=[speaker_wav],
+            gpt_cond_len=config.gpt_cond_len,
+            gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+            max_ref_length=config.max_ref_len,
+            sound_norm_refs=config.sound_norm_refs
+        )
+
+class SentenceAudioCache:
+    """
+    Persistent LRU cache of synthesized sentence audio on local disk
+    
+    Keyed by a hash of (sentence, voice, language, synthesis settings), each
+    entry is a 16-bit WAV file. Recency is kept in file mtimes so it survives
+    restarts; the oldest files are deleted once the total passes max_bytes.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> file size, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        if self.enabled:
+            self.load_index()
+    
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(sentence, voice, language, settings):
+        parts = [MODEL_NAME, voice, language] + [f"{name}={settings[name]}" for name in sorted(settings)] + [sentence]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+    
+    def path(self, key):
+        return self.directory / key[:2] / f"{key}.wav"
+    
+    def load_index(self):
+        """Rebuild the index from the files already on disk"""
+        found = []
+        for file in self.directory.glob("*/*.wav"):
+            stat = file.stat()
+            found.append((stat.st_mtime, file.stem, stat.st_size))
+        with self.lock:
+            for _, key, size in sorted(found):
+                self.entries[key] = size
+                self.total_bytes += size
+            self.evict()
+        if found:
+            logger.info(f"   Sentence cache: {len(self.entries)} sentences ({self.total_bytes / 1e6:.1f} MB)")
+    
+    def evict(self):
+        # Caller holds the lock
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
             try:
-                os.remove(temp_speaker_path)
-            except:
+                self.path(key).unlink()
+            except OSError:
                 pass
+    
+    def get(self, key, usage=None):
+        """
+        Return the cached waveform for key as a 1-D float tensor, or None
+        usage is an optional per-request dict of hits/misses/bytes_saved to update
+        """
+        if not self.enabled:
+            return None
+        
+        with self.lock:
+            size = self.entries.get(key)
+            if size is not None:
+                self.entries.move_to_end(key)
+        
+        wav = None
+        if size is not None:
+            path = self.path(key)
+            try:
+                wav, _ = torchaudio.load(str(path))
+                wav = wav.squeeze(0)
+                os.utime(path)
+            except Exception as e:
+                logger.warning(f"⚠️  Dropping unreadable cached sentence {key[:12]}: {e}")
+                wav = None
+                with self.lock:
+                    if self.entries.pop(key, None) is not None:
+                        self.total_bytes -= size
+        
+        with self.lock:
+            if wav is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += size
+        if usage is not None:
+            if wav is None:
+                usage["misses"] += 1
+            else:
+                usage["hits"] += 1
+                usage["bytes_saved"] += size
+        return wav
+    
+    def put(self, key, wav, sample_rate):
+        """Store a sentence waveform (without the trailing silence)"""
+        if not self.enabled:
+            return
+        
+        path = self.path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            torchaudio.save(str(tmp_path), wav.float().clamp(-1.0, 1.0).unsqueeze(0), sample_rate,
+                            format="wav", bits_per_sample=16)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except Exception as e:
+            logger.warning(f"⚠️  Could not cache sentence audio: {e}")
+            return
+        
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.evict()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+sentence_cache = SentenceAudioCache(SENTENCE_CACHE_DIR, SENTENCE_CACHE_MAX_BYTES)
+
+def new_cache_usage():
+    """Per-request sentence cache counters, filled in by synthesize_texts"""
+    return {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+def cache_usage_headers(usage):
+    """Response headers reporting how much of a request came from the sentence cache"""
+    lookups = usage["hits"] + usage["misses"]
+    return {
+        "X-Sentence-Cache-Hits": str(usage["hits"]),
+        "X-Sentence-Cache-Misses": str(usage["misses"]),
+        "X-Sentence-Cache-Hit-Ratio": f"{usage['hits'] / lookups:.3f}" if lookups else "0.000",
+        "X-Sentence-Cache-Bytes-Saved": str(usage["bytes_saved"])
+    }
+
+def synthesize_texts(tts, texts, language, voice, latents, usages=None):
+    """
+    Synthesize several texts for one speaker with batched decoding
+    
+    voice identifies the speaker in sentence cache keys; latents is a callable
+    returning (gpt_cond_latent, speaker_embedding), only called if some sentence
+    misses the cache. usages, if given, is one new_cache_usage() dict per text.
+    Returns one peak-normalized waveform per text, assembled like tts_to_file
+    """
+    xtts = tts.synthesizer.tts_model
+    sample_rate = tts.synthesizer.output_sample_rate
+    # The batched path decodes at the default speed
+    settings = dict(inference_settings(xtts), speed=1.0)
+    
+    # Same sentence splitting as tts_to_file(split_sentences=True)
+    sentences = []
+    owners = []
+    for index, text in enumerate(texts):
+        for sentence in tts.synthesizer.split_into_sentences(text):
+            sentences.append(sentence)
+            owners.append(index)
+    
+    # Stitch cached sentences, decode only the misses
+    keys = [sentence_cache.make_key(sentence, voice, language, settings) for sentence in sentences]
+    sentence_wavs = [
+        sentence_cache.get(key, usages[owner] if usages else None)
+        for key, owner in zip(keys, owners)
+    ]
+    missing = [i for i, wav in enumerate(sentence_wavs) if wav is None]
+    
+    logger.info(f"   {len(sentences)} sentences ({len(sentences) - len(missing)} cached), "
+                f"micro-batch size {micro_batch_size()}")
+    if missing:
+        gpt_cond_latent, speaker_embedding = latents()
+        decoded = batch_inference(xtts, [sentences[i] for i in missing], language, gpt_cond_latent, speaker_embedding)
+        for i, wav in zip(missing, decoded):
+            sentence_wavs[i] = wav
+            sentence_cache.put(keys[i], wav, sample_rate)
+    
+    # Reassemble each text with the same inter-sentence silence as tts_to_file
+    silence = torch.zeros(10000)
+    pieces = [[] for _ in texts]
+    for owner, wav in zip(owners, sentence_wavs):
+        pieces[owner] += [wav.float(), silence]
+    
+    wavs = []
+    for parts in pieces:
+        wav = torch.cat(parts)
+        wavs.append(wav / max(0.01, float(wav.abs().max())))
+    return wavs
+
+def render_batch(texts, language, speaker_path, voice_hash, output_format="wav", bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """
+    Blocking part of /generate-audio-batch, runs on the inference executor
+    Returns (zip archive bytes, generation time in seconds, sentence cache usage)
+    """
+    usage = new_cache_usage()
+    gen_start = time.time()
+    with model_registry.lease(DEFAULT_ENGINE) as tts:
+        sample_rate = tts.synthesizer.output_sample_rate
+        # Speaker conditioning once for every text in the batch (if anything misses the cache)
+        latents = functools.partial(speaker_latents, tts.synthesizer.tts_model, speaker_wav=speaker_path)
+        wavs = synthesize_texts(tts, texts, language, f"voice:{voice_hash}", latents, [usage] * len(texts))
+    gen_time = time.time() - gen_start
+    
+    manifest = []
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        for index, wav in enumerate(wavs):
+            buffer = io.BytesIO()
+            save_audio(buffer, wav, sample_rate, output_format, bitrate_kbps)
+            filename = f"audio_{index:03d}.{OUTPUT_FORMATS[output_format][4]}"
+            zf.writestr(filename, buffer.getvalue())
+            manifest.append({
+                "index": index,
+                "filename": filename,
+                "duration": round(wav.shape[-1] / sample_rate, 3)
+            })
+        zf.writestr("manifest.json", json.dumps({
+            "sample_rate": sample_rate,
+            "format": output_format,
+            "outputs": manifest
+        }))
+    
+    return archive.getvalue(), gen_time, usage
+
+def save_audio(target, wav, sample_rate, output_format="wav", bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """
+    Write one output to a path or file object as 16-bit WAV or a compressed format
+    Compressed formats are encoded in process (FFmpeg via torchaudio StreamWriter),
+    fed ENCODE_BLOCK_SIZE samples at a time
+    """
+    if output_format == "wav":
+        torchaudio.save(target, wav.unsqueeze(0), sample_rate, format="wav", bits_per_sample=16)
+        return
+    
+    from torchaudio.io import StreamWriter
+    
+    if output_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+        # libopus only takes these rates (VITS and Tacotron2 output 22050 Hz)
+        target_rate = min((r for r in OPUS_SAMPLE_RATES if r >= sample_rate), default=48000)
+        wav = torchaudio.functional.resample(wav.float(), sample_rate, target_rate)
+        sample_rate = target_rate
+    
+    container, encoder, encoder_format, _, _ = OUTPUT_FORMATS[output_format]
+    writer = StreamWriter(target, format=container)
+    writer.add_audio_stream(
+        sample_rate, 1,
+        format="flt",
+        encoder=encoder,
+        encoder_format=encoder_format,
+        encoder_option={"b": str(int(bitrate_kbps) * 1000)}
+    )
+    samples = wav.float().clamp(-1.0, 1.0).cpu().unsqueeze(1)
+    with writer.open():
+        for start in range(0, samples.shape[0], ENCODE_BLOCK_SIZE):
+            writer.write_audio_chunk(0, samples[start:start + ENCODE_BLOCK_SIZE])
+
+def render_request_batch(key, jobs, reference=None):
+    """
+    Blocking part of a dynamic batch, runs on the inference executor
+    All jobs share the key's language and speaker: reference is the uploaded
+    speaker audio (bytes) for cloned voices, otherwise the key names a built-in
+    speaker. Each result is written to its output_path, each job's sentence cache
+    counters to job["cache_usage"] and anything that failed it to job["error"]
+    """
+    language = key[2]
+    voice = f"{key[0]}:{key[1]}"
+    for job in jobs:
+        job["cache_usage"] = new_cache_usage()
+    
+    with model_registry.lease(DEFAULT_ENGINE) as tts:
+        sample_rate = tts.synthesizer.output_sample_rate
+        xtts = tts.synthesizer.tts_model
+        
+        computed = []
+        
+        def latents():
+            # Computed once per batch, even if the jobs are retried one by one
+            if not computed:
+                if reference is not None:
+                    computed.append(speaker_latents(xtts, speaker_wav=io.BytesIO(reference)))
+                else:
+                    computed.append(speaker_latents(xtts, speaker=key[1]))
+            return computed[0]
+        
+        try:
+            wavs = synthesize_texts(
+                tts, [job["text"] for job in jobs], language, voice, latents,
+                [job["cache_usage"] for job in jobs]
+            )
+        except ModelUnavailable:
+            raise
+        except Exception as e:
+            if len(jobs) == 1:
+                raise
+            # One text can break the batched pass; redo the jobs one by one so only it fails
+            logger.warning(f"⚠️  Batched pass failed ({e}), retrying {len(jobs)} requests individually")
+            wavs = []
+            for job in jobs:
+                job["cache_usage"] = new_cache_usage()
+                try:
+                    wavs.extend(synthesize_texts(tts, [job["text"]], language, voice, latents, [job["cache_usage"]]))
+                except Exception as job_error:
+                    job["error"] = job_error
+                    wavs.append(None)
+    
+    for job, wav in zip(jobs, wavs):
+        if wav is None:
+            continue
+        try:
+            save_audio(job["output_path"], wav, sample_rate, job["output_format"], job["bitrate"])
+        except Exception as e:
+            job["error"] = e
+
+async def acquire_model(name):
+    """
+    Lease a registry model without tying up an inference worker
+    The load is awaited on the event loop and the lease taken once the model is
+    resident; ModelUnavailable after MODEL_LOAD_TIMEOUT or if the load fails
+    """
+    deadline = time.time() + MODEL_LOAD_TIMEOUT
+    while True:
+        # shield: a caller giving up must not cancel a load other requests wait for
+        load = asyncio.shield(asyncio.wrap_future(model_registry.load(name)))
+        try:
+            await asyncio.wait_for(load, max(0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            raise ModelUnavailable(f"{name} is still loading")
+        except ModelUnavailable:
+            raise
+        except Exception as e:
+            raise ModelUnavailable(f"{name} failed to load: {e}")
+        try:
+            return model_registry.acquire(name, timeout=0)
+        except ModelUnavailable:
+            # Evicted between the load finishing and the lease; load it again
+            if time.time() >= deadline:
+                raise
+
+def render_engine(engine, model, text, speaker, language, output_path, output_format, bitrate_kbps):
+    """
+    Blocking synthesis with a leased non-default engine, runs on the inference executor
+    Chatterbox and the single-speaker Coqui models ignore speaker; VITS falls back to
+    its first speaker when the requested one isn't in its set
+    """
+    if engine.startswith("chatterbox"):
+        kwargs = {"language_id": language} if engine == "chatterbox-multilingual" else {}
+        wav = model.generate(text, **kwargs).squeeze(0).float().cpu()
+        sample_rate = model.sr
+    else:
+        speakers = model.speakers if model.is_multi_speaker else None
+        if speakers and speaker not in speakers:
+            speaker = speakers[0]
+        with torch.inference_mode():
+            wav = torch.tensor(model.tts(text, speaker=speaker if speakers else None), dtype=torch.float32)
+        sample_rate = model.synthesizer.output_sample_rate
+    
+    wav = wav / max(0.01, float(wav.abs().max()))
+    save_audio(output_path, wav, sample_rate, output_format, bitrate_kbps)
+
+class BatchScheduler:
+    """
+    Dynamic batching of concurrent requests
+    
+    Requests are grouped by (kind, speaker, language). The first request in a
+    group waits up to window_ms for others; the group is flushed early once it
+    holds max_requests. Each flush runs as one batched pass on the inference
+    executor and every caller gets its own output back.
+    """
+    
+    def __init__(self, window_ms, max_requests):
+        self.window = window_ms / 1000.0
+        self.max_requests = max(1, max_requests)
+        self.pending = {}  # key -> [(job, future)]
+        self.references = {}  # key -> uploaded speaker audio, held until the batch has run
+        self.timers = {}
+        self.histogram = {}
+        self.batches = 0
+    
+    async def submit(self, key, job, reference=None):
+        """
+        Queue a job and wait for its batch to finish
+        reference is the speaker audio for a cloned voice (the key holds its hash); the
+        scheduler keeps it, so the batch doesn't depend on any one caller staying connected
+        """
+        admit_inference()
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            group = self.pending.setdefault(key, [])
+            group.append((job, future))
+            if reference is not None:
+                self.references.setdefault(key, reference)
+            
+            if len(group) >= self.max_requests:
+                self.flush(key)
+            elif key not in self.timers:
+                self.timers[key] = loop.call_later(self.window, self.flush, key)
+            
+            return await future
+        finally:
+            release_inference()
+    
+    def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        
+        # Drop callers that gave up (client disconnected) while waiting
+        group = [(job, future) for job, future in self.pending.pop(key, []) if not future.done()]
+        reference = self.references.pop(key, None)
+        if not group:
+            return
+        
+        self.batches += 1
+        self.histogram[len(group)] = self.histogram.get(len(group), 0) + 1
+        asyncio.ensure_future(self.run(key, group, reference))
+    
+    async def run(self, key, group, reference=None):
+        loop = asyncio.get_running_loop()
+        jobs = [job for job, _ in group]
+        try:
+            if len(jobs) > 1:
+                logger.info(f"   Dynamic batch of {len(jobs)} requests ({key[0]}, {key[2]})")
+            await loop.run_in_executor(
+                inference_executor,
+                functools.partial(run_counted, len(jobs), render_request_batch, key, jobs, reference)
+            )
+            # Only the jobs that failed get the exception
+            for job, future in group:
+                if future.done():
+                    continue
+                if job.get("error") is not None:
+                    future.set_exception(job["error"])
+                else:
+                    future.set_result(None)
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+    
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "max_requests": self.max_requests,
+            "batches": self.batches,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.histogram.items())},
+            "waiting": sum(len(group) for group in self.pending.values())
+        }
+
+batch_scheduler = BatchScheduler(BATCH_WINDOW_MS, BATCH_MAX_REQUESTS)
 
 @app.post("/generate-audio-batch")
 async def generate_audio_batch(
     texts: list[str] = Form(...),
-    speaker_wav: UploadFile = File(...)
+    speaker_wav: UploadFile = File(...),
+    language: str = Form("en"),
+    output_format: str = Form("wav"),
+    bitrate: int = Form(OUTPUT_BITRATE_KBPS)
 ):
     """
     Generate multiple audio files from a list of texts (for chapters)
     
+    Speaker conditioning is computed once for the whole request and all
+    sentences are decoded on the GPU in micro-batches sized to free VRAM
+    
     Args:
-        texts: List of texts to convert (JSON array)
+        texts: Texts to convert (repeat the form field, or one JSON array)
         speaker_wav: Reference audio for voice cloning
+        language: Language code for every text (default: en)
+        output_format: wav, mp3, opus or aac for every file (default: wav)
+        bitrate: kbit/s for compressed formats, 8-320 (default: OUTPUT_BITRATE)
     
     Returns:
-        List of audio file URLs
+        ZIP archive with audio_000.wav, audio_001.wav, ... (or .mp3/.opus/.aac) and manifest.json
     """
-    if not tts_model:
+    if not model_registry.is_resident(DEFAULT_ENGINE):
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     
+    output_format = check_output_format(output_format)
+    check_bitrate(bitrate)
+    
+    # Accept a single JSON-encoded array as well as repeated form fields
+    if len(texts) == 1 and texts[0].lstrip().startswith("["):
+        try:
+            texts = json.loads(texts[0])
+        except ValueError:
+            pass
+    
+    if not texts or any(not t or len(t.strip()) == 0 for t in texts):
+        raise HTTPException(status_code=400, detail="Texts cannot be empty")
+    
     logger.info(f"🎤 Batch generation: {len(texts)} texts")
+    start_time = time.time()
     
-    # TODO: Implement batch processing
-    # For now, return error to implement later
-    raise HTTPException(
-        status_code=501, 
-        detail="Batch generation coming soon. Use single generation endpoint for now."
-    )
+    temp_speaker_path = None
+    
+    try:
+        content = await speaker_wav.read()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_speaker:
+            temp_speaker_path = temp_speaker.name
+            temp_speaker.write(content)
+        
+        archive, gen_time, usage = await run_inference(
+            render_batch, texts, language, temp_speaker_path, hashlib.sha256(content).hexdigest(),
+            output_format, bitrate
+        )
+        
+        total_time = time.time() - start_time
+        logger.info(f"✅ Batch of {len(texts)} generated in {gen_time:.2f}s (total: {total_time:.2f}s)")
+        
+        return Response(
+            content=archive,
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": 'attachment; filename="batch.zip"',
+                "X-Generation-Time": f"{gen_time:.2f}",
+                "X-Total-Time": f"{total_time:.2f}",
+                "X-Batch-Count": str(len(texts)),
+                **cache_usage_headers(usage)
+            }
+        )
+    
+    except HTTPException:
+        raise
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error generating batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch generation failed: {str(e)}")
+    
+    finally:
+        if temp_speaker_path and os.path.exists(temp_speaker_path):
+            try:
+                os.remove(temp_speaker_path)
+            except:
+                pass
 
 @app.get("/models")
 async def list_models():
-    """List available TTS models"""
+    """List the registry's engines with their state, size and active leases"""
     return {
         "current_model": MODEL_NAME,
-        "available_models": [
-            "tts_models/multilingual/multi-dataset/xtts_v2",
-            "tts_models/en/vctk/vits",
-            "tts_models/en/ljspeech/tacotron2-DDC"
-        ]
+        "default_engine": DEFAULT_ENGINE,
+        "available_models": [spec["model"] for spec in MODEL_SPECS.values()],
+        **model_registry.stats()
     }
 
+def registry_call(fn, name):
+    try:
+        return fn(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+@app.post("/models/{name}/load", status_code=202)
+async def load_model(name: str):
+    """Start loading an engine in the background (no-op if already resident)"""
+    registry_call(model_registry.load, name)
+    return {"engine": name, "state": model_registry.stats()["models"][name]["state"]}
+
+@app.post("/models/{name}/reload", status_code=202)
+async def reload_model(name: str):
+    """
+    Load a fresh instance of an engine and swap it in once ready
+    Requests in flight finish on the old instance; nothing is dropped
+    """
+    registry_call(model_registry.reload, name)
+    return {"engine": name, "state": model_registry.stats()["models"][name]["state"]}
+
+@app.delete("/models/{name}")
+async def unload_model(name: str):
+    """Evict an engine now (its memory is freed once requests using it finish)"""
+    if name in PINNED_MODELS:
+        raise HTTPException(status_code=409, detail=f"{name} is pinned (PINNED_MODELS)")
+    return {"engine": name, "unloaded": registry_call(model_registry.unload, name)}
+
 @app.delete("/cleanup")
 async def cleanup_temp_files():
     """Clean up old temporary audio files"""
     try:
         deleted = 0
-        for file in OUTPUT_DIR.glob("*.wav"):
+        for file in OUTPUT_DIR.glob("output_*.*"):  # Any output_format
             # Delete files older than 1 hour
             if time.time() - file.stat().st_mtime > 3600:
                 file.unlink()
@@ -3,13 +3,25 @@ Coqui TTS (XTTS v2) Server for Hearo
 Provides text-to-speech with voice cloning capabilities
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import torch
+import torchaudio
 import io
 import os
-import tempfile
 import re
+import json
+import struct
+import difflib
+import zipfile
+import hashlib
+import functools
+import contextlib
+import threading
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy import signal
 from TTS.api import TTS
@@ -24,164 +36,537 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 tts_model = None
 device = None
 
-def apply_denoising(audio_path, strength=0.01):
+# Speaker conditioning cache settings
+# XTTS_LATENT_CACHE_MB: in-memory budget for cached conditioning latents
+# XTTS_LATENT_SPILL: also persist latents as .pt files next to the voice file
+LATENT_CACHE_MAX_BYTES = int(float(os.environ.get('XTTS_LATENT_CACHE_MB', 256)) * 1024 * 1024)
+LATENT_SPILL_TO_DISK = os.environ.get('XTTS_LATENT_SPILL', 'true').lower() == 'true'
+
+# Content-addressed voice store
+# Voices are stored as mono 16-bit PCM at this rate, named by the SHA-256 of that PCM
+VOICE_STORE_SAMPLE_RATE = 22050
+
+# Persistent sentence audio cache
+# XTTS_SENTENCE_CACHE_DIR: where synthesized sentences are kept as 16-bit WAV files
+# XTTS_SENTENCE_CACHE_MB: disk budget, least recently used sentences are deleted past it (0 disables)
+SENTENCE_CACHE_DIR = os.environ.get('XTTS_SENTENCE_CACHE_DIR', os.path.join(os.getcwd(), 'cache', 'sentences'))
+SENTENCE_CACHE_MAX_BYTES = int(float(os.environ.get('XTTS_SENTENCE_CACHE_MB', 1024)) * 1024 * 1024)
+
+# Sentence normalization cache (entries); retries and re-renders send the same paragraphs
+TEXT_CACHE_SIZE = int(os.environ.get('XTTS_TEXT_CACHE_SIZE', 4096))
+
+# Incremental re-renders splice changed sentences into the previous audio
+# with a crossfade of this length at each joint
+SPLICE_CROSSFADE_MS = float(os.environ.get('XTTS_SPLICE_CROSSFADE_MS', 15))
+
+# Post-processing works on blocks of this many samples to keep memory bounded
+DENOISE_BLOCK_SIZE = 65536
+
+# Compressed output (output_format mp3/opus/aac), default bitrate in kbit/s
+OUTPUT_BITRATE_KBPS = float(os.environ.get('XTTS_OUTPUT_BITRATE', 64))
+MIN_BITRATE_KBPS, MAX_BITRATE_KBPS = 8, 320  # Accepted range for the bitrate parameter
+
+# Inference mode
+# XTTS_PRECISION: fp32, or fp16/bf16 autocast (fp16 needs CUDA, bf16 also runs on CPU)
+# XTTS_COMPILE: torch.compile the GPT decoder and the HiFiGAN vocoder (the first
+# requests are slower while kernels compile)
+INFERENCE_PRECISION = os.environ.get('XTTS_PRECISION', 'fp32').lower()
+TORCH_COMPILE = os.environ.get('XTTS_COMPILE', 'false').lower() == 'true'
+AUTOCAST_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+# CPU fast path (only when running on CPU)
+# XTTS_CPU_THREADS: intra-op threads (default: the physical cores this process may use)
+# XTTS_CPU_QUANTIZE: dynamic int8 quantization of the GPT decoder's linear layers
+# XTTS_CPU_ONNX_VOCODER: run the HiFiGAN vocoder in ONNX Runtime (needs onnxruntime);
+# the exported model is kept in XTTS_ONNX_DIR
+CPU_THREADS = int(os.environ.get('XTTS_CPU_THREADS', 0))
+CPU_QUANTIZE = os.environ.get('XTTS_CPU_QUANTIZE', 'false').lower() == 'true'
+CPU_ONNX_VOCODER = os.environ.get('XTTS_CPU_ONNX_VOCODER', 'false').lower() == 'true'
+ONNX_DIR = os.environ.get('XTTS_ONNX_DIR', os.path.join(os.getcwd(), 'cache', 'onnx'))
+
+# Chapter pipeline: sentence post-processing runs on these CPU threads while
+# the GPU synthesizes the next sentence (one thread per request in flight)
+POSTPROCESS_WORKERS = int(os.environ.get('XTTS_POSTPROCESS_WORKERS', 4))
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix='postprocess')
+
+@functools.lru_cache(maxsize=256)
+def _design_sos(order, cutoff, fs, btype):
+    from scipy.signal import butter
+
+    nyquist = fs / 2
+    if isinstance(cutoff, tuple):
+        normalized = tuple(min(c / nyquist, 0.99) for c in cutoff)
+    else:
+        normalized = min(cutoff / nyquist, 0.99)
+    return butter(order, normalized, btype=btype, output='sos')
+
+def design_filter(order, cutoff, fs, btype='high'):
+    """
+    Memoized Butterworth design for the DSP chain (denoiser, EQ stages)
+    Keyed by (order, cutoff, fs, type); cutoff is Hz, or a (low, high) tuple for band filters
+    Returns (sos, zi): the shared SOS array (don't modify it) and a fresh zeroed sosfilt state
+    """
+    if isinstance(cutoff, (list, tuple)):
+        cutoff = tuple(round(float(c), 3) for c in cutoff)
+    else:
+        cutoff = round(float(cutoff), 3)
+    sos = _design_sos(int(order), cutoff, int(fs), btype)
+    return sos, np.zeros((sos.shape[0], 2))
+
+@functools.lru_cache(maxsize=256)
+def _design_biquad(kind, fc, fs, q, gain_db):
+    # RBJ audio EQ cookbook biquads, as one SOS section
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / fs
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if kind == 'peak':
+        b = [1 + alpha * A, -2 * cos_w0, 1 - alpha * A]
+        a = [1 + alpha / A, -2 * cos_w0, 1 - alpha / A]
+    elif kind == 'high_shelf':
+        sqrt_a = np.sqrt(A)
+        b = [A * ((A + 1) + (A - 1) * cos_w0 + 2 * sqrt_a * alpha),
+             -2 * A * ((A - 1) + (A + 1) * cos_w0),
+             A * ((A + 1) + (A - 1) * cos_w0 - 2 * sqrt_a * alpha)]
+        a = [(A + 1) - (A - 1) * cos_w0 + 2 * sqrt_a * alpha,
+             2 * ((A - 1) - (A + 1) * cos_w0),
+             (A + 1) - (A - 1) * cos_w0 - 2 * sqrt_a * alpha]
+    elif kind == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    else:
+        raise ValueError(f"Unknown biquad type: {kind}")
+
+    return np.array([b + a]) / a[0]
+
+def design_biquad(kind, fc, fs, q=0.7071, gain_db=0.0):
     """
-    Apply noise reduction to audio file
+    Memoized single-section biquad ('peak', 'high_shelf' or 'highpass')
+    Returns (sos, zi) like design_filter
+    """
+    sos = _design_biquad(kind, round(float(fc), 3), int(fs), round(float(q), 4), round(float(gain_db), 3))
+    return sos, np.zeros((1, 2))
+
+def filter_cache_stats():
+    infos = [_design_sos.cache_info(), _design_biquad.cache_info()]
+    return {
+        "hits": sum(info.hits for info in infos),
+        "misses": sum(info.misses for info in infos),
+        "entries": sum(info.currsize for info in infos),
+        "max_entries": sum(info.maxsize for info in infos)
+    }
+
+class StreamingDenoiser:
+    """
+    Block-based noise reduction with state carried across blocks
+    High-pass filter (Butterworth SOS, sosfilt state kept between blocks)
+    followed by a noise gate smoothed with an O(n) 5ms running mean, centered on
+    each sample like np.convolve(mode='same'). The centered window needs
+    lookahead, so gated output lags input by `lookahead` samples (about 2.5 ms)
+    and flush() returns the tail. Working memory is one block, however long the audio is
+    """
+
+    def __init__(self, framerate, strength, block_size=DENOISE_BLOCK_SIZE):
+        # Cutoff frequency scales with strength (50-200 Hz range)
+        self.cutoff = 50 + (strength * 1500)  # Higher strength = more aggressive
+
+        self.sos, self.zi = design_filter(4, self.cutoff, framerate, btype='high')
+        self.gate_threshold = strength * 2.0  # Scale with strength
+        self.kernel_size = max(int(framerate * 0.005), 1)  # 5ms smoothing
+        self.lookahead = (self.kernel_size - 1) // 2
+        # Last kernel_size - 1 gate values, so the running mean spans block boundaries
+        self.gate_history = np.zeros(self.kernel_size - 1)
+        # High-passed samples still waiting for their lookahead
+        self.delayed = np.zeros(0)
+        self.block_size = block_size
+
+    def highpass(self, block):
+        """High-pass the next block (linear, so it can run before the signal's gain is known)"""
+        from scipy.signal import sosfilt
+
+        filtered, self.zi = sosfilt(self.sos, block, zi=self.zi)
+        return filtered
+
+    def _smooth(self, mask):
+        """Running mean of the gate mask over the kernel_size values ending at each position"""
+        k = self.kernel_size
+        # Running mean via cumulative sum
+        gate = np.concatenate([self.gate_history, mask])
+        csum = np.concatenate([[0.0], np.cumsum(gate)])
+        if k > 1:
+            self.gate_history = gate[-(k - 1):]
+        return (csum[k:] - csum[:-k]) / k
+
+    def _apply(self, smooth, samples, ready):
+        # smooth[i] is the window ending lookahead samples after samples[i + len(self.delayed) - lookahead]
+        offset = self.lookahead - len(self.delayed)
+        out = samples[:ready] * smooth[offset:offset + ready]
+        self.delayed = samples[ready:]
+        return out
+
+    def gate(self, filtered):
+        """
+        Gate the next high-passed block: each sample is scaled by the fraction of the
+        5ms around it above threshold. Returns the samples whose window is complete
+        """
+        smooth = self._smooth(np.abs(filtered) > self.gate_threshold)
+        samples = np.concatenate([self.delayed, filtered])
+        return self._apply(smooth, samples, max(0, len(samples) - self.lookahead))
+
+    def flush(self):
+        """Gate the last `lookahead` samples (nothing above threshold after the end, like mode='same')"""
+        smooth = self._smooth(np.zeros(self.lookahead))
+        samples = self.delayed
+        return self._apply(smooth, samples, len(samples)).astype(np.float32)
+
+    def process(self, audio):
+        """Denoise the next chunk of a float signal, returns the float32 output ready so far"""
+        out = [self.gate(self.highpass(audio[start:start + self.block_size]))
+               for start in range(0, len(audio), self.block_size)]
+        return np.concatenate(out).astype(np.float32) if out else np.zeros(0, dtype=np.float32)
+
+def normalize_denoised(denoised, levels=None):
+    """Normalize denoised audio to 0.95 peak to prevent clipping (in place, no extra copy)"""
+    gain = levels.get('denoise_gain') if levels else None
+    if gain is None:
+        max_val = np.abs(denoised).max() if len(denoised) else 0
+        gain = 0.95 / max_val if max_val > 0 else 1.0
+    denoised *= gain
+    if levels is not None:
+        levels['denoise_gain'] = float(gain)
+    return denoised
+
+def apply_denoising(audio, framerate, strength=0.01, levels=None):
+    """
+    Apply noise reduction to the model's output before it is written anywhere
     Uses high-pass filtering and spectral gating to reduce robotic hiss
+    Expects peak-normalized float audio, returns float32 peak-normalized to 0.95
+    (or scaled by levels['denoise_gain'] when given, see postprocess_audio)
     """
     if strength <= 0:
-        return  # No denoising needed
-    
+        return audio  # No denoising needed
+
     try:
-        import wave
-        from scipy.signal import butter, filtfilt
-        
-        # Read WAV file
-        with wave.open(audio_path, 'rb') as wav_file:
-            params = wav_file.getparams()
-            framerate = params.framerate
-            frames = wav_file.readframes(params.nframes)
-            audio_data = np.frombuffer(frames, dtype=np.int16)
-        
-        # Convert to float for processing
-        audio_float = audio_data.astype(np.float32) / 32768.0
-        
-        # Apply high-pass filter to remove low-frequency rumble/hiss
-        # Cutoff frequency scales with strength (50-200 Hz range)
-        cutoff = 50 + (strength * 1500)  # Higher strength = more aggressive
-        nyquist = framerate / 2
-        normalized_cutoff = min(cutoff / nyquist, 0.99)
-        
-        print(f"   Applying high-pass filter at {cutoff:.1f} Hz")
-        
-        # Design Butterworth high-pass filter
-        b, a = butter(4, normalized_cutoff, btype='high')
-        audio_filtered = filtfilt(b, a, audio_float)
-        
-        # Apply noise gate to reduce very quiet sections
-        gate_threshold = strength * 2.0  # Scale with strength
-        gate_mask = np.abs(audio_filtered) > gate_threshold
-        
-        # Smooth the gate mask to avoid clicks
-        gate_mask_float = gate_mask.astype(np.float32)
-        kernel_size = int(framerate * 0.005)  # 5ms smoothing
-        if kernel_size > 0:
-            kernel = np.ones(kernel_size) / kernel_size
-            gate_mask_smooth = np.convolve(gate_mask_float, kernel, mode='same')
-        else:
-            gate_mask_smooth = gate_mask_float
-        
-        # Apply smooth gate
-        audio_gated = audio_filtered * gate_mask_smooth
-        
-        # Normalize to prevent clipping
-        max_val = np.abs(audio_gated).max()
-        if max_val > 0:
-            audio_gated = audio_gated / max_val * 0.95
-        
-        # Convert back to int16
-        audio_denoised = (audio_gated * 32768.0).astype(np.int16)
-        
-        # Write back to file
-        with wave.open(audio_path, 'wb') as wav_file:
-            wav_file.setparams(params)
-            wav_file.writeframes(audio_denoised.tobytes())
-            
-        print(f"   ✓ Denoising applied (strength: {strength}, cutoff: {cutoff:.1f}Hz)")
-        
+        denoiser = StreamingDenoiser(framerate, strength)
+        print(f"   Applying high-pass filter at {denoiser.cutoff:.1f} Hz")
+
+        denoised = normalize_denoised(np.concatenate([denoiser.process(audio), denoiser.flush()]), levels)
+
+        print(f"   ✓ Denoising applied (strength: {strength}, cutoff: {denoiser.cutoff:.1f}Hz)")
+        return denoised
+
     except Exception as e:
         print(f"   ⚠️  Denoising failed: {e}")
         import traceback
         traceback.print_exc()
         # Don't fail if denoising doesn't work, just continue
+        return audio
 
-def apply_mastering(audio_path):
+def postprocess_audio(audio, framerate, denoiser_strength, mastering=False, levels=None):
     """
-    Apply professional audio mastering chain:
-    - Compression (1.5:1 ratio) for consistent volume
-    - EQ (boost 3-6kHz for clarity, cut <120Hz for clean bass)
-    
-    Uses ffmpeg for fast processing (~0.5s per file)
+    Peak-normalize model output (as tts_to_file does), denoise and optionally master it
+    Returns float32 audio ready for write_wav
+
+    levels is an optional dict of the gains each stage applies. Stages whose gain
+    is missing measure it and record it there; stages whose gain is present reuse
+    it, so re-rendered sentences come out at the level of the chapter they join.
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    input_gain = levels.get('input_gain') if levels else None
+    if input_gain is None:
+        input_gain = 1.0 / max(0.01, float(np.abs(audio).max()) if len(audio) else 0.0)
+    audio *= input_gain
+    if levels is not None:
+        levels['input_gain'] = float(input_gain)
+    audio = apply_denoising(audio, framerate, denoiser_strength, levels)
+    if mastering:
+        audio = apply_mastering(audio, framerate, levels=levels)
+    return audio
+
+def write_wav(target, audio, framerate):
+    """
+    Write float audio as 16-bit mono WAV, converting one block at a time
+    target is a path or a writable file object
+    """
+    import wave
+    with wave.open(target, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(framerate)
+        for start in range(0, len(audio), DENOISE_BLOCK_SIZE):
+            block = audio[start:start + DENOISE_BLOCK_SIZE]
+            wav_file.writeframes((np.clip(block, -1.0, 1.0) * 32767.0).astype(np.int16).tobytes())
+
+def encode_wav(audio, framerate):
+    """Encode float audio as a WAV file in memory, returns a BytesIO at position 0"""
+    buffer = io.BytesIO()
+    write_wav(buffer, audio, framerate)
+    buffer.seek(0)
+    return buffer
+
+# output_format -> (FFmpeg container, encoder, encoder sample format, mimetype, file extension)
+OUTPUT_FORMATS = {
+    'mp3': ('mp3', 'libmp3lame', 'fltp', 'audio/mpeg', 'mp3'),
+    'opus': ('ogg', 'libopus', 'flt', 'audio/ogg', 'opus'),
+    'aac': ('adts', 'aac', 'fltp', 'audio/aac', 'aac'),
+}
+
+class EncodedChunks:
+    """File-like write target that hands encoded bytes over as soon as they are written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class StreamingEncoder:
     """
+    Incremental in-process encoder for compressed output (FFmpeg via torchaudio StreamWriter)
+    write() takes the next chunk of float audio and returns the encoded bytes ready so far,
+    close() flushes the encoder. Only the encoder's own frame buffer is held, never the file
+    """
+
+    def __init__(self, output_format, sample_rate, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+        from torchaudio.io import StreamWriter
+
+        container, encoder, encoder_format, self.mimetype, self.extension = OUTPUT_FORMATS[output_format]
+        self.sink = EncodedChunks()
+        self.writer = StreamWriter(self.sink, format=container)
+        self.writer.add_audio_stream(
+            sample_rate, 1,
+            format='flt',
+            encoder=encoder,
+            encoder_format=encoder_format,
+            encoder_option={'b': str(int(float(bitrate_kbps) * 1000))}
+        )
+        self.writer.open()
+
+    def write(self, audio):
+        chunk = torch.from_numpy(np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0)).unsqueeze(1)
+        self.writer.write_audio_chunk(0, chunk)
+        return self.sink.take()
+
+    def close(self):
+        self.writer.flush()
+        self.writer.close()
+        return self.sink.take()
+
+def encode_compressed(audio, framerate, output_format, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Generator of encoded bytes for a float signal, encoding one block at a time"""
+    encoder = StreamingEncoder(output_format, framerate, bitrate_kbps)
+    for start in range(0, len(audio), DENOISE_BLOCK_SIZE):
+        data = encoder.write(audio[start:start + DENOISE_BLOCK_SIZE])
+        if data:
+            yield data
+    yield encoder.close()
+
+def audio_response(audio, framerate, output_format='wav', bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Attachment response with the audio as WAV, or encoded incrementally as it is sent"""
+    if output_format == 'wav':
+        return send_file(encode_wav(audio, framerate), mimetype='audio/wav', as_attachment=True, download_name='speech.wav')
+
+    _, _, _, mimetype, extension = OUTPUT_FORMATS[output_format]
+    return Response(
+        encode_compressed(audio, framerate, output_format, bitrate_kbps),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="speech.{extension}"'}
+    )
+
+def parse_output_format(output_format):
+    """Validate an output_format parameter, returns 'wav' or a key of OUTPUT_FORMATS"""
+    output_format = str(output_format or 'wav').lower()
+    if output_format != 'wav' and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output_format '{output_format}' (use wav, {', '.join(OUTPUT_FORMATS)})")
+    return output_format
+
+def parse_bitrate(bitrate):
+    """Validate a bitrate parameter in kbit/s ("64", 64 or 64.0), returns an int"""
+    if bitrate is None or bitrate == '':
+        return OUTPUT_BITRATE_KBPS
+    try:
+        value = float(bitrate)
+    except (TypeError, ValueError):
+        raise ValueError(f"bitrate must be a number of kbit/s, got '{bitrate}'")
+    if not value.is_integer() or not MIN_BITRATE_KBPS <= value <= MAX_BITRATE_KBPS:
+        raise ValueError(f"bitrate must be a whole number between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbit/s")
+    return int(value)
+
+def measure_loudness(audio, framerate):
+    """
+    Integrated loudness in LUFS (ITU-R BS.1770 / EBU R128)
+    K-weighting, 400ms blocks with 75% overlap, -70 LUFS absolute and -10 LU relative gates
+    """
+    from scipy.signal import sosfilt
+
+    shelf, _ = design_biquad('high_shelf', 1500.0, framerate, q=1 / np.sqrt(2), gain_db=4.0)
+    highpass, _ = design_biquad('highpass', 38.0, framerate, q=0.5)
+    weighted = sosfilt(np.vstack([shelf, highpass]), audio)
+
+    block = int(0.4 * framerate)
+    step = int(0.1 * framerate)
+    if len(weighted) < block:
+        energies = np.array([np.mean(weighted ** 2)]) if len(weighted) else np.zeros(1)
+    else:
+        csum = np.concatenate([[0.0], np.cumsum(weighted.astype(np.float64) ** 2)])
+        starts = np.arange(0, len(weighted) - block + 1, step)
+        energies = (csum[starts + block] - csum[starts]) / block
+
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(energies)
+
+    gated = energies[loudness > -70.0]
+    if len(gated) == 0:
+        return float('-inf')
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = energies[(loudness > -70.0) & (loudness > relative_gate)]
+    if len(gated) == 0:
+        return float('-inf')
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def compress(audio, framerate, threshold_db=-20.0, ratio=1.5, attack_ms=5.0, release_ms=50.0):
+    """
+    Feed-forward RMS compressor
+    Level detection and attack/release smoothing run on 1ms frames,
+    then the gain curve is interpolated back to sample rate
+    """
+    frame = max(int(framerate * 0.001), 1)
+    n_frames = int(np.ceil(len(audio) / frame))
+    padded = np.zeros(n_frames * frame, dtype=np.float32)
+    padded[:len(audio)] = audio
+
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, frame) ** 2, axis=1))
+    with np.errstate(divide='ignore'):
+        level_db = 20 * np.log10(np.maximum(rms, 1e-9))
+    # Static curve: gain reduction above threshold
+    target_db = np.minimum(0.0, (threshold_db - level_db) * (1 - 1 / ratio))
+
+    attack = np.exp(-1.0 / max(attack_ms, 1e-3))    # per 1ms frame
+    release = np.exp(-1.0 / max(release_ms, 1e-3))
+    gain_db = np.empty(n_frames)
+    current = 0.0
+    for i, target in enumerate(target_db):
+        coeff = attack if target < current else release
+        current = coeff * current + (1 - coeff) * target
+        gain_db[i] = current
+
+    centers = np.arange(n_frames) * frame + frame / 2
+    gain = 10 ** (np.interp(np.arange(len(audio)), centers, gain_db) / 20)
+    return (audio * gain).astype(np.float32)
+
+def limit_peaks(audio, framerate, ceiling_db=-1.5, release_ms=50.0):
+    """
+    Peak limiter: gain never lets a sample exceed the ceiling
+    Gain reduction is held over a 1.5ms window then released smoothly
+    """
+    from scipy.ndimage import minimum_filter1d
+    from scipy.signal import lfilter
+
+    ceiling = 10 ** (ceiling_db / 20)
+    peaks = np.abs(audio)
+    if peaks.max(initial=0.0) <= ceiling:
+        return audio
+
+    needed = np.minimum(1.0, ceiling / np.maximum(peaks, 1e-9))
+    hold = max(int(framerate * 0.0015), 1)
+    needed = minimum_filter1d(needed, size=2 * hold + 1)
+
+    # Smooth recovery: 1 - gain goes through a one-pole release, never below what is needed
+    coeff = np.exp(-1.0 / (framerate * release_ms / 1000))
+    reduction = lfilter([1 - coeff], [1, -coeff], 1.0 - needed)
+    gain = np.minimum(needed, 1.0 - reduction)
+    return (audio * gain).astype(np.float32)
+
+def apply_mastering(audio, framerate, target_lufs=-16.0, true_peak_db=-1.5, levels=None):
+    """
+    Apply professional audio mastering chain, in process:
+    - High-pass at 120Hz for clean bass
+    - EQ (peaking +3dB at 4.5kHz, Q 2) for speech clarity
+    - Compression (1.5:1 ratio, -20dB threshold) for consistent volume
+    - Loudness normalization to -16 LUFS with a -1.5dB peak ceiling (audiobook standard)
+
+    Works on the float array; no temp files, no ffmpeg
+    With levels['mastering_gain'] set, that loudness gain is applied instead of measured
+    """
+    from scipy.signal import sosfilt
+
     try:
         print(f"   🎚️  Applying audio mastering...")
-        
-        # Create temp output file
-        temp_output = audio_path + ".mastered.wav"
-        
-        # ffmpeg filter chain:
-        # 1. highpass=120 - Remove rumble below 120Hz
-        # 2. equalizer - Boost 3-6kHz for speech clarity
-        # 3. acompressor - Gentle compression (1.5:1 ratio)
-        # 4. loudnorm - Final normalization
-        
-        import subprocess
-        import sys
-        
-        # Try multiple ffmpeg locations
-        conda_prefix = os.environ.get('CONDA_PREFIX', '')
-        ffmpeg_paths = [
-            os.path.join(conda_prefix, 'Library', 'bin', 'ffmpeg.exe') if conda_prefix else None,
-            r'C:\Users\dane\miniconda3\envs\coqui-tts\Library\bin\ffmpeg.exe',
-            'ffmpeg',  # System PATH
-        ]
-        
-        ffmpeg_cmd = None
-        for path in ffmpeg_paths:
-            if path and (os.path.exists(path) if os.path.isabs(path) else True):
-                ffmpeg_cmd = path
-                break
-        
-        if not ffmpeg_cmd:
-            print(f"   ⚠️  Mastering skipped (ffmpeg not found in any location)")
-            return
-        
-        cmd = [
-            ffmpeg_cmd,
-            '-i', audio_path,
-            '-af',
-            'highpass=f=120,'                           # Remove low rumble
-            'equalizer=f=4500:t=q:w=2:g=3,'            # Boost 3-6kHz for clarity
-            'acompressor=threshold=-20dB:ratio=1.5:attack=5:release=50,'  # Gentle compression
-            'loudnorm=I=-16:TP=-1.5:LRA=11',           # Final normalization for audiobooks
-            '-ar', '22050',                             # Keep sample rate
-            '-y',                                       # Overwrite output
-            temp_output
-        ]
-        
-        # Run ffmpeg (capture output to avoid clutter)
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=10
-        )
-        
-        if result.returncode == 0 and os.path.exists(temp_output):
-            # Replace original with mastered version
-            os.replace(temp_output, audio_path)
-            print(f"   ✓ Mastering applied (compression + EQ)")
+
+        highpass, _ = design_filter(2, 120.0, framerate, btype='high')
+        presence, _ = design_biquad('peak', min(4500.0, framerate * 0.45), framerate, q=2.0, gain_db=3.0)
+        mastered = sosfilt(np.vstack([highpass, presence]), audio).astype(np.float32)
+
+        mastered = compress(mastered, framerate, threshold_db=-20.0, ratio=1.5, attack_ms=5.0, release_ms=50.0)
+
+        gain = levels.get('mastering_gain') if levels else None
+        if gain is None:
+            loudness = measure_loudness(mastered, framerate)
+            gain = 10 ** ((target_lufs - loudness) / 20) if np.isfinite(loudness) else 1.0
         else:
-            error_msg = result.stderr.decode('utf-8', errors='ignore') if result.stderr else 'No stderr output'
-            stdout_msg = result.stdout.decode('utf-8', errors='ignore') if result.stdout else 'No stdout'
-            print(f"   ⚠️  Mastering skipped")
-            print(f"      Return code: {result.returncode}")
-            print(f"      Stderr: {error_msg[:200]}")
-            print(f"      Stdout: {stdout_msg[:200]}")
-            if os.path.exists(temp_output):
-                os.unlink(temp_output)
-        
-    except FileNotFoundError:
-        print(f"   ⚠️  Mastering skipped (ffmpeg not found)")
-    except subprocess.TimeoutExpired:
-        print(f"   ⚠️  Mastering timed out")
-        if os.path.exists(temp_output):
-            os.unlink(temp_output)
+            loudness = target_lufs - 20 * np.log10(gain)
+        mastered *= gain
+        if levels is not None:
+            levels['mastering_gain'] = float(gain)
+        mastered = limit_peaks(mastered, framerate, ceiling_db=true_peak_db)
+
+        print(f"   ✓ Mastering applied ({loudness:.1f} -> {target_lufs:.1f} LUFS)")
+        return mastered
+
     except Exception as e:
         print(f"   ⚠️  Mastering failed: {e}")
-        if os.path.exists(temp_output):
-            os.unlink(temp_output)
         # Don't fail if mastering doesn't work, just continue
+        return audio
+
+# Text normalization works on separators (the punctuation and whitespace between
+# words) rather than running every rule over the whole chapter. Separators are
+# rewritten independently and memoized; only the "word and word" rule looks at the
+# words around them.
+_SEPARATOR_RULES = [
+    # Add explicit pauses after sentence-ending punctuation
+    # Using commas creates better pauses in XTTS than ellipsis
+    (re.compile(r'([.!?])\s+'), r'\1, '),
+    # Add pauses after colons and semicolons
+    (re.compile(r'([:;])\s+'), r'\1, '),
+    # Ensure commas have proper spacing
+    (re.compile(r',\s*'), ', '),
+    # Clean up excessive commas (in case of double application)
+    (re.compile(r',\s*,+'), ','),
+    # Clean up excessive spaces
+    (re.compile(r'\s+'), ' '),
+]
+
+# Add a pause before "and" between words. It only matches words and the whitespace
+# between them, which the separator rules leave alone, so running it first gives the
+# same matches (including how repeated "and"s pair up) as the old pass order did
+_CONJUNCTION = re.compile(r'(\w+)\s+and\s+(\w+)')
+# A separator that is exactly one space between two non-separators never changes,
+# so it is not matched at all
+_SEPARATOR = re.compile(r'(?! (?=[^.!?:;,\s]))[.!?:;,\s]+')
+# Separators ending a sentence can't be part of a "word and word" match, so the text
+# between them normalizes independently (and is what the LRU caches)
+_SENTENCE_BREAK = re.compile(r'([.!?:;,\s]*[.!?]\s[.!?:;,\s]*)')
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_separator(separator):
+    for pattern, replacement in _SEPARATOR_RULES:
+        separator = pattern.sub(replacement, separator)
+    return separator
+
+def _replace_separator(match):
+    return _normalize_separator(match.group())
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _normalize_sentence(sentence):
+    sentence = _CONJUNCTION.sub(r'\1, and \2', sentence)
+    return _SEPARATOR.sub(_replace_separator, sentence)
 
 def preprocess_text(text):
     """
@@ -189,30 +574,25 @@ def preprocess_text(text):
     - Normalize punctuation
     - Add explicit pauses for better pacing
     - Fix common issues
+    Sentences are normalized independently and cached, so retries and re-renders
+    of the same chapter skip the work
     """
-    # Add explicit pauses after sentence-ending punctuation
-    # Using commas creates better pauses in XTTS than ellipsis
-    text = re.sub(r'\.(\s+)', r'., ', text)  # Period gets a comma pause
-    text = re.sub(r'!(\s+)', r'!, ', text)   # Exclamation gets a comma pause
-    text = re.sub(r'\?(\s+)', r'?, ', text)  # Question gets a comma pause
-    
-    # Add pauses after colons and semicolons
-    text = re.sub(r':(\s+)', r':, ', text)
-    text = re.sub(r';(\s+)', r';, ', text)
-    
-    # Ensure commas have proper spacing
-    text = re.sub(r',(\s*)', r', ', text)
-    
-    # Add comma pauses for better pacing in long sentences with "and"
-    text = re.sub(r'(\w+)\s+and\s+(\w+)', r'\1, and \2', text)
-    
-    # Clean up excessive commas (in case of double application)
-    text = re.sub(r',\s*,+', r',', text)
-    
-    # Clean up excessive spaces
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    parts = _SENTENCE_BREAK.split(text)
+    normalized = [
+        _normalize_sentence(part) if i % 2 == 0 else _normalize_separator(part)
+        for i, part in enumerate(parts)
+    ]
+    return ''.join(normalized).strip()
+
+def text_cache_stats():
+    """Hit/miss counters for the sentence normalization cache"""
+    info = _normalize_sentence.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+    }
 
 def get_device():
     """Detect available device (CUDA, MPS, or CPU)"""
@@ -223,6 +603,155 @@ def get_device():
     else:
         return "cpu"
 
+def autocast_dtype():
+    """Autocast dtype for XTTS_PRECISION on this device, None for fp32"""
+    dtype = AUTOCAST_DTYPES.get(INFERENCE_PRECISION)
+    if device == 'cuda' or (device == 'cpu' and dtype == torch.bfloat16 and not CPU_QUANTIZE):
+        return dtype
+    return None
+
+def inference_context():
+    """torch.inference_mode(), plus autocast when XTTS_PRECISION asks for it"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    dtype = autocast_dtype()
+    if dtype is not None:
+        stack.enter_context(torch.autocast(device_type=device, dtype=dtype))
+    return stack
+
+def configure_inference(tts):
+    """
+    Apply XTTS_PRECISION and XTTS_COMPILE to a loaded model
+    Weights stay fp32 (autocast picks the precision per op); the vocoder's output is
+    cast back to float32 so callers always get float32 audio. torch.compile patches
+    forward in place, so state dicts and attribute access are unchanged
+    """
+    xtts = tts.synthesizer.tts_model
+    if INFERENCE_PRECISION not in ('fp32', *AUTOCAST_DTYPES):
+        print(f"⚠️  Unknown XTTS_PRECISION '{INFERENCE_PRECISION}', using fp32")
+    elif INFERENCE_PRECISION != 'fp32' and autocast_dtype() is None:
+        print(f"⚠️  {INFERENCE_PRECISION} autocast is not available on {device}, using fp32")
+
+    if autocast_dtype() is not None:
+        vocoder_forward = xtts.hifigan_decoder.forward
+        xtts.hifigan_decoder.forward = lambda *args, **kwargs: vocoder_forward(*args, **kwargs).float()
+
+    if TORCH_COMPILE:
+        import torch._dynamo
+        # Anything that fails to compile runs eagerly instead of failing the request
+        torch._dynamo.config.suppress_errors = True
+        # The GPT transformer runs once per generated audio token, the vocoder once per sentence
+        xtts.gpt.gpt.forward = torch.compile(xtts.gpt.gpt.forward, dynamic=True)
+        xtts.hifigan_decoder.forward = torch.compile(xtts.hifigan_decoder.forward, dynamic=True)
+
+    print(f"   Inference mode: {INFERENCE_PRECISION if autocast_dtype() else 'fp32'}"
+          f"{' + torch.compile' if TORCH_COMPILE else ''}")
+
+def physical_cores():
+    """
+    Physical cores this process may run on
+    Hyperthread siblings share a core's vector units, so they add little to matrix math
+    """
+    try:
+        available = os.sched_getaffinity(0)
+    except AttributeError:  # Not Linux
+        available = set(range(os.cpu_count() or 1))
+
+    cores = set()
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu = package = None
+            for line in f:
+                key, _, value = line.partition(':')
+                key, value = key.strip(), value.strip()
+                if key == 'processor':
+                    cpu = int(value)
+                elif key == 'physical id':
+                    package = value
+                elif key == 'core id' and cpu in available:
+                    cores.add((package, value))
+    except (OSError, ValueError):
+        pass
+    return len(cores) or len(available)
+
+def configure_cpu_threads():
+    """Pin torch's thread pools to the physical cores, returns the intra-op thread count"""
+    threads = CPU_THREADS or physical_cores()
+    torch.set_num_threads(threads)
+    try:
+        # Each request runs one op at a time; extra inter-op threads only compete for cores
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Can only be set before the first parallel op
+    return threads
+
+def _conv1d_to_linear(module):
+    """
+    Swap transformers' Conv1D (GPT-2's attention and MLP projections, y = x @ W + b)
+    for the equivalent nn.Linear so dynamic quantization picks them up
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+def onnx_vocoder(xtts):
+    """
+    Export the HiFiGAN vocoder to ONNX (once, kept in ONNX_DIR) and return a
+    forward(latents, g) that runs it in ONNX Runtime
+    """
+    import onnxruntime
+
+    path = os.path.join(ONNX_DIR, 'xtts_v2_hifigan.onnx')
+    if not os.path.exists(path):
+        print(f"   Exporting the vocoder to {path}")
+        os.makedirs(ONNX_DIR, exist_ok=True)
+        latents = torch.randn(1, 40, 1024)
+        speaker_embedding = torch.randn(1, 512, 1)
+        with torch.no_grad():
+            torch.onnx.export(
+                xtts.hifigan_decoder, (latents, speaker_embedding), f"{path}.tmp",
+                input_names=['latents', 'g'], output_names=['wav'],
+                dynamic_axes={'latents': {1: 'frames'}, 'wav': {2: 'samples'}},
+                opset_version=17
+            )
+        os.replace(f"{path}.tmp", path)
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = torch.get_num_threads()
+    session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def forward(latents, g=None):
+        wav = session.run(None, {'latents': latents.float().cpu().numpy(), 'g': g.float().cpu().numpy()})[0]
+        return torch.from_numpy(wav)
+    return forward
+
+def configure_cpu_inference(tts):
+    """
+    CPU fast path: int8 dynamic quantization of the GPT decoder (the per-token loop
+    where CPU time goes) and optionally the vocoder in ONNX Runtime
+    """
+    xtts = tts.synthesizer.tts_model
+
+    if CPU_QUANTIZE:
+        _conv1d_to_linear(xtts.gpt.gpt)
+        torch.quantization.quantize_dynamic(xtts.gpt.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        torch.quantization.quantize_dynamic(xtts.gpt.gpt_inference.lm_head, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        print("   GPT decoder quantized to int8")
+
+    if CPU_ONNX_VOCODER:
+        try:
+            xtts.hifigan_decoder.forward = onnx_vocoder(xtts)
+            print("   Vocoder running in ONNX Runtime")
+        except Exception as e:
+            print(f"⚠️  ONNX vocoder unavailable, using PyTorch: {e}")
+
 def get_tts_model():
     """Initialize and return TTS model"""
     global tts_model, device
@@ -235,6 +764,7 @@ def get_tts_model():
         if device == "cpu":
             print("⚠️  WARNING: CPU inference is SLOW (30-120 seconds per request)")
             print("⚠️  For production, use a GPU instance")
+            print(f"CPU threads: {configure_cpu_threads()} | int8 GPT: {CPU_QUANTIZE} | ONNX vocoder: {CPU_ONNX_VOCODER}")
         print(f"{'='*60}\n")
         
         # Initialize XTTS v2 model with TOS agreement
@@ -243,11 +773,708 @@ def get_tts_model():
         os.environ['COQUI_TOS_AGREED'] = '1'
         
         tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=False).to(device)
+        if device == "cpu":
+            configure_cpu_inference(tts_model)
+        configure_inference(tts_model)
         
         print("✅ Model loaded successfully!\n")
     
     return tts_model
 
+class ConditioningCache:
+    """
+    Bounded LRU cache of XTTS conditioning latents
+    Keyed by the content hash of the reference voice, evicts by total tensor bytes
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(latents):
+        return sum(t.element_size() * t.nelement() for t in latents)
+
+    def get(self, key):
+        with self.lock:
+            latents = self.entries.get(key)
+            if latents is not None:
+                self.entries.move_to_end(key)
+            return latents
+
+    def put(self, key, latents):
+        size = self.entry_size(latents)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entry_size(self.entries.pop(key))
+            self.entries[key] = latents
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= self.entry_size(evicted)
+                self.evictions += 1
+
+    def record(self, outcome):
+        with self.lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'disk':
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "spill_to_disk": LATENT_SPILL_TO_DISK
+            }
+
+latent_cache = ConditioningCache(LATENT_CACHE_MAX_BYTES)
+
+# (path, mtime, size) -> sha256, so unchanged voice files are only hashed once
+_voice_hashes = {}
+
+def hash_voice_file(voice_path):
+    """Return the SHA-256 of a voice file's contents"""
+    stat = os.stat(voice_path)
+    stamp = (voice_path, stat.st_mtime_ns, stat.st_size)
+    digest = _voice_hashes.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(voice_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        _voice_hashes[stamp] = digest
+    return digest
+
+# voice hash -> [lock, users]: one computation per voice, concurrent requests wait for it
+_latent_locks = {}
+_latent_locks_guard = threading.Lock()
+
+@contextlib.contextmanager
+def latent_lock(voice_hash):
+    with _latent_locks_guard:
+        entry = _latent_locks.setdefault(voice_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _latent_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _latent_locks[voice_hash]
+
+def get_conditioning_latents(tts, voice_path):
+    """
+    Return (gpt_cond_latent, speaker_embedding) for a reference voice
+    Looks in memory first, then the on-disk .pt spill, then computes them.
+    Misses are single-flight per voice: concurrent requests for the same new
+    voice wait for one computation (and one spill write) instead of each doing it
+    """
+    voice_hash = hash_voice_file(voice_path)
+
+    latents = latent_cache.get(voice_hash)
+    if latents is not None:
+        latent_cache.record('hit')
+        return latents
+
+    with latent_lock(voice_hash):
+        # Another request may have computed them while this one waited
+        latents = latent_cache.get(voice_hash)
+        if latents is not None:
+            latent_cache.record('hit')
+            return latents
+
+        spill_path = f"{voice_path}.latents.pt"
+        if LATENT_SPILL_TO_DISK and os.path.exists(spill_path):
+            try:
+                saved = torch.load(spill_path, map_location=device)
+                if saved.get("hash") == voice_hash:
+                    latents = (saved["gpt_cond_latent"], saved["speaker_embedding"])
+                    latent_cache.put(voice_hash, latents)
+                    latent_cache.record('disk')
+                    return latents
+            except Exception as e:
+                print(f"   ⚠️  Ignoring unreadable latent spill {spill_path}: {e}")
+
+        latent_cache.record('miss')
+        xtts = tts.synthesizer.tts_model
+        config = xtts.config
+        print(f"   Computing conditioning latents for {os.path.basename(voice_path)}")
+        with inference_context():
+            latents = xtts.get_conditioning_latents(
+                audio_path=[voice_path],
+                gpt_cond_len=config.gpt_cond_len,
+                gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+                max_ref_length=config.max_ref_len,
+                sound_norm_refs=config.sound_norm_refs
+            )
+        latent_cache.put(voice_hash, latents)
+
+        if LATENT_SPILL_TO_DISK:
+            # Written under a temporary name and renamed, so readers never see a partial file
+            tmp_path = f"{spill_path}.{threading.get_ident()}.tmp"
+            try:
+                torch.save({
+                    "hash": voice_hash,
+                    "gpt_cond_latent": latents[0].cpu(),
+                    "speaker_embedding": latents[1].cpu()
+                }, tmp_path)
+                os.replace(tmp_path, spill_path)
+            except Exception as e:
+                print(f"   ⚠️  Could not spill latents to {spill_path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        return latents
+
+def get_voices_dir():
+    """Return the voice store directory, creating it if needed"""
+    voices_dir = os.path.join(os.getcwd(), 'uploads', 'voices')
+    os.makedirs(voices_dir, exist_ok=True)
+    return voices_dir
+
+def normalize_voice_pcm(audio_bytes):
+    """
+    Decode reference audio to mono 16-bit PCM at VOICE_STORE_SAMPLE_RATE
+    Returns an int16 array, or None if the audio can't be decoded
+    """
+    try:
+        waveform, sample_rate = torchaudio.load(io.BytesIO(audio_bytes))
+    except Exception as e:
+        print(f"   ⚠️  Could not decode voice sample, storing raw bytes: {e}")
+        return None
+
+    waveform = waveform.mean(dim=0)
+    if sample_rate != VOICE_STORE_SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, VOICE_STORE_SAMPLE_RATE)
+    return (waveform.clamp(-1.0, 1.0) * 32767.0).round().to(torch.int16).numpy()
+
+# SHA-256 of uploaded bytes -> stored filename, so byte-identical re-uploads skip decoding
+_upload_index = {}
+_voice_store_lock = threading.Lock()
+
+def store_voice(audio_bytes):
+    """
+    Add a reference voice to the content-addressed store
+    Identical audio (after normalization) always maps to the same file
+
+    Returns (filename, filepath, voice_hash, created)
+    """
+    voices_dir = get_voices_dir()
+    upload_hash = hashlib.sha256(audio_bytes).hexdigest()
+
+    filename = _upload_index.get(upload_hash)
+    if filename:
+        filepath = os.path.join(voices_dir, filename)
+        if os.path.exists(filepath):
+            return filename, filepath, filename[len('voice_'):-len('.wav')], False
+
+    pcm = normalize_voice_pcm(audio_bytes)
+    if pcm is not None:
+        voice_hash = hashlib.sha256(pcm.tobytes()).hexdigest()
+    else:
+        voice_hash = upload_hash
+
+    # 16 hex chars keeps IDs readable while collisions stay negligible
+    filename = f"voice_{voice_hash[:16]}.wav"
+    filepath = os.path.join(voices_dir, filename)
+
+    with _voice_store_lock:
+        created = not os.path.exists(filepath)
+        if created:
+            tmp_path = filepath + '.tmp'
+            if pcm is not None:
+                import wave
+                with wave.open(tmp_path, 'wb') as wav_file:
+                    wav_file.setnchannels(1)
+                    wav_file.setsampwidth(2)
+                    wav_file.setframerate(VOICE_STORE_SAMPLE_RATE)
+                    wav_file.writeframes(pcm.tobytes())
+            else:
+                with open(tmp_path, 'wb') as f:
+                    f.write(audio_bytes)
+            os.replace(tmp_path, filepath)
+        _upload_index[upload_hash] = filename
+
+    return filename, filepath, voice_hash[:16], created
+
+class SentenceAudioCache:
+    """
+    Persistent LRU cache of synthesized sentence audio on local disk
+    Keyed by a hash of (normalized sentence, voice, language, synthesis settings),
+    each entry is a 16-bit WAV file. Recency is kept in file mtimes so it survives
+    restarts; the oldest files are deleted once the total passes max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> file size, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        if self.enabled:
+            self.load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(sentence, voice, language, settings):
+        parts = ['xtts_v2', voice, language] + [f"{name}={settings[name]}" for name in sorted(settings)] + [sentence]
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.wav")
+
+    def load_index(self):
+        """Rebuild the index from the files already on disk"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.wav'):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-len('.wav')], stat.st_size))
+        with self.lock:
+            for _, key, size in sorted(found):
+                self.entries[key] = size
+                self.total_bytes += size
+            self.evict()
+        if found:
+            print(f"   ✓ Sentence cache: {len(self.entries)} sentences ({self.total_bytes / 1e6:.1f} MB)")
+
+    def evict(self):
+        # Caller holds the lock
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def get(self, key, usage=None):
+        """
+        Return the cached float32 waveform for key, or None
+        usage is an optional per-request dict of hits/misses/bytes_saved to update
+        """
+        import wave
+
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            size = self.entries.get(key)
+            if size is not None:
+                self.entries.move_to_end(key)
+
+        audio = None
+        if size is not None:
+            path = self.path(key)
+            try:
+                with wave.open(path, 'rb') as wav_file:
+                    frames = wav_file.readframes(wav_file.getnframes())
+                audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32767.0
+                os.utime(path)
+            except (OSError, EOFError, wave.Error) as e:
+                print(f"   ⚠️  Dropping unreadable cached sentence {key[:12]}: {e}")
+                with self.lock:
+                    if self.entries.pop(key, None) is not None:
+                        self.total_bytes -= size
+
+        with self.lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += size
+        if usage is not None:
+            if audio is None:
+                usage['misses'] += 1
+            else:
+                usage['hits'] += 1
+                usage['bytes_saved'] += size
+        return audio
+
+    def put(self, key, audio, framerate):
+        """Store a sentence waveform (without the trailing silence)"""
+        if not self.enabled:
+            return
+
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_wav(tmp_path, audio, framerate)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"   ⚠️  Could not cache sentence audio: {e}")
+            return
+
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.evict()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "directory": self.directory,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+sentence_cache = SentenceAudioCache(SENTENCE_CACHE_DIR, SENTENCE_CACHE_MAX_BYTES)
+
+def new_cache_usage():
+    """Per-request sentence cache counters, filled in by synthesize_sentences"""
+    return {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+def cache_usage_headers(usage):
+    """Response headers reporting how much of a request came from the sentence cache"""
+    lookups = usage['hits'] + usage['misses']
+    return {
+        "X-Sentence-Cache-Hits": str(usage['hits']),
+        "X-Sentence-Cache-Misses": str(usage['misses']),
+        "X-Sentence-Cache-Hit-Ratio": f"{usage['hits'] / lookups:.3f}" if lookups else "0.000",
+        "X-Sentence-Cache-Bytes-Saved": str(usage['bytes_saved'])
+    }
+
+def synthesize_sentences(tts, text, language, speed, speaker_wav=None, speaker_name=None, usage=None, sentences=None):
+    """
+    Synthesize text with XTTS using (cached) conditioning latents
+    Mirrors tts_to_file: sentence splitting, inference settings from the model
+    config and 10000 samples of silence after each sentence
+    Sentences already in the sentence cache are not synthesized again; usage
+    (see new_cache_usage) collects the per-request hit counts
+    sentences, if given, is the already split text (text is then ignored)
+    Yields one float32 array per sentence at the model's output sample rate
+    """
+    xtts = tts.synthesizer.tts_model
+    config = xtts.config
+    sample_rate = tts.synthesizer.output_sample_rate
+
+    # Latents are only needed once a sentence misses the cache
+    latents = None
+    voice = f"voice:{hash_voice_file(speaker_wav)}" if speaker_wav else f"speaker:{speaker_name}"
+
+    settings = {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+        "speed": speed
+    }
+
+    silence = np.zeros(10000, dtype=np.float32)
+    if sentences is None:
+        sentences = tts.synthesizer.split_into_sentences(text)
+    for sentence in sentences:
+        key = sentence_cache.make_key(sentence, voice, language, settings)
+        waveform = sentence_cache.get(key, usage)
+        if waveform is None:
+            if latents is None:
+                if speaker_wav:
+                    latents = get_conditioning_latents(tts, speaker_wav)
+                else:
+                    speaker = xtts.speaker_manager.speakers[speaker_name]
+                    latents = (speaker["gpt_cond_latent"], speaker["speaker_embedding"])
+            with inference_context():
+                outputs = xtts.inference(sentence, language, *latents, **settings)
+            waveform = outputs["wav"]
+            if torch.is_tensor(waveform):
+                waveform = waveform.float().cpu().numpy()
+            waveform = np.asarray(waveform, dtype=np.float32).squeeze()
+            sentence_cache.put(key, waveform, sample_rate)
+        yield np.concatenate([waveform, silence])
+
+def wav_stream_header(sample_rate, channels=1, bits_per_sample=16):
+    """
+    WAV header for a stream of unknown length
+    RIFF and data sizes are set to 0xFFFFFFFF, which players treat as "until EOF"
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', 0xFFFFFFFF)
+    )
+
+def stream_speech(tts, text, language, speed, denoiser_strength, speaker_wav=None, speaker_name=None,
+                  output_format='wav', bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """
+    Generator for chunked audio responses
+    WAV: sends the header at once, then 16-bit PCM for each sentence as soon as it is synthesized
+    Compressed formats: each sentence goes through one encoder, its output is sent as it comes
+
+    If synthesis fails after the headers are out, the exception is re-raised so the
+    server aborts the connection and the client sees a failed transfer, not a short file
+    """
+    sample_rate = tts.synthesizer.output_sample_rate
+    encoder = None
+    if output_format == 'wav':
+        yield wav_stream_header(sample_rate)
+    else:
+        encoder = StreamingEncoder(output_format, sample_rate, bitrate_kbps)
+
+    def encode(audio):
+        if encoder:
+            return encoder.write(audio)
+        return (np.clip(audio, -1.0, 1.0) * 32767.0).astype(np.int16).tobytes()
+
+    # One denoiser for the whole stream so filter state carries across sentences
+    denoiser = StreamingDenoiser(sample_rate, denoiser_strength) if denoiser_strength > 0 else None
+
+    sentences = 0
+    peak = 0.0
+    try:
+        for sentence_wav in synthesize_sentences(tts, text, language, speed, speaker_wav, speaker_name):
+            # Normalize before gating, as postprocess_audio does, so the gate's threshold
+            # means the same here. The whole signal's peak isn't known yet, so the gain
+            # follows the loudest sentence so far
+            if len(sentence_wav):
+                peak = max(peak, float(np.abs(sentence_wav).max()))
+            sentence_wav = np.asarray(sentence_wav, dtype=np.float32) / max(0.01, peak)
+            if denoiser:
+                sentence_wav = denoiser.process(sentence_wav)
+            sentences += 1
+            data = encode(sentence_wav)
+            if data:
+                yield data
+        if denoiser:
+            # The gate's last few milliseconds, held back for its lookahead
+            yield encode(denoiser.flush())
+        if encoder:
+            data = encoder.close()
+            encoder = None
+            yield data
+        print(f"✅ Streamed {sentences} sentence(s)")
+    except Exception as e:
+        # Headers are already sent; re-raising aborts the connection instead of ending it cleanly
+        print(f"❌ Streaming failed after {sentences} sentence(s): {e}")
+        raise
+    finally:
+        # Also reached when the client disconnects (GeneratorExit)
+        if encoder:
+            try:
+                encoder.close()
+            except Exception:
+                pass
+
+class PostprocessStage:
+    """
+    CPU stage of the chapter pipeline
+    Sentences are queued as the GPU produces them and processed in order on a
+    postprocess_executor thread. Only peak tracking and the denoiser's high-pass
+    overlap synthesis: the gate compares against a threshold that depends on the
+    whole signal's peak gain, and mastering needs its loudness, so both run in
+    finish() after the last sentence, as does encoding in the caller. That keeps
+    the result equal to postprocess_audio
+    """
+
+    def __init__(self, framerate, denoiser_strength):
+        self.framerate = framerate
+        self.denoiser = StreamingDenoiser(framerate, denoiser_strength) if denoiser_strength > 0 else None
+        self.pieces = []
+        self.peak = 0.0
+        self.busy = 0.0
+        self.queue = queue.Queue()
+        self.worker = postprocess_executor.submit(self.run)
+
+    def run(self):
+        while True:
+            wav = self.queue.get()
+            if wav is None:
+                return
+            started = time.perf_counter()
+            if len(wav):
+                self.peak = max(self.peak, float(np.abs(wav).max()))
+            if self.denoiser:
+                wav = self.denoiser.highpass(wav).astype(np.float32)
+            self.pieces.append(wav)
+            self.busy += time.perf_counter() - started
+
+    def put(self, wav):
+        self.queue.put(wav)
+
+    def close(self):
+        """Wait until every queued sentence has been processed"""
+        self.queue.put(None)
+        self.worker.result()
+
+    def finish(self, mastering=False, levels=None, timings=None):
+        """
+        Apply the whole-signal steps, returns float32 audio ready for write_wav
+        Seconds spent gating and mastering go into timings['gate'] / timings['master']
+        """
+        timings = {} if timings is None else timings
+        started = time.perf_counter()
+        audio = np.concatenate(self.pieces) if self.pieces else np.zeros(0, dtype=np.float32)
+        self.pieces = []
+
+        input_gain = levels.get('input_gain') if levels else None
+        if input_gain is None:
+            input_gain = 1.0 / max(0.01, self.peak)
+        audio *= input_gain
+        if levels is not None:
+            levels['input_gain'] = float(input_gain)
+
+        if self.denoiser:
+            gated = [self.denoiser.gate(audio[start:start + DENOISE_BLOCK_SIZE])
+                     for start in range(0, len(audio), DENOISE_BLOCK_SIZE)]
+            audio = np.concatenate(gated + [self.denoiser.flush()]).astype(np.float32)
+            audio = normalize_denoised(audio, levels)
+            print(f"   ✓ Denoising applied (cutoff: {self.denoiser.cutoff:.1f}Hz)")
+        timings['gate'] = time.perf_counter() - started
+        if mastering:
+            started = time.perf_counter()
+            audio = apply_mastering(audio, self.framerate, levels=levels)
+            timings['master'] = time.perf_counter() - started
+        return audio
+
+def render_chapter(tts, text, language, speed, denoiser_strength, mastering=False,
+                   speaker_wav=None, speaker_name=None, usage=None, levels=None):
+    """
+    Staged render of a whole text: sentence splitting -> GPU synthesis -> CPU post-processing
+    Each synthesized sentence is handed to a PostprocessStage right away, so its
+    high-pass filtering overlaps inference of the next sentence
+
+    Returns (audio, sentences, sentence_lengths, timings); timings holds the seconds
+    spent in each stage. Only highpass overlaps synthesis; drain is how long the GPU
+    side then waited for it to catch up, gate and master run after synthesis
+    """
+    timings = {}
+    started = time.perf_counter()
+    sentences = tts.synthesizer.split_into_sentences(text)
+    timings['split'] = time.perf_counter() - started
+
+    stage = PostprocessStage(tts.synthesizer.output_sample_rate, denoiser_strength)
+    lengths = []
+    started = time.perf_counter()
+    try:
+        for wav in synthesize_sentences(tts, text, language, speed, speaker_wav, speaker_name, usage, sentences):
+            lengths.append(len(wav))
+            stage.put(wav)
+    finally:
+        timings['synthesis'] = time.perf_counter() - started
+        stage.close()
+    timings['highpass'] = stage.busy
+    timings['drain'] = time.perf_counter() - started - timings['synthesis']
+
+    audio = stage.finish(mastering, levels, timings)
+    return audio, sentences, lengths, timings
+
+def report_stage_timings(timings):
+    """
+    Log the per-stage breakdown, returns it as X-<Stage>-Time response headers
+    highpass overlaps synthesis; drain, gate, master and encode add to the wall time after it
+    """
+    bottleneck = max(('synthesis', 'highpass', 'gate', 'master', 'encode'), key=lambda name: timings.get(name, 0.0))
+    serial = sum(timings.get(name, 0.0) for name in ('drain', 'gate', 'master', 'encode'))
+    print("   ⏱️  " + " | ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+          + f" (bottleneck: {bottleneck}, {serial:.2f}s after synthesis)")
+    return {f"X-{name.title()}-Time": f"{seconds:.3f}" for name, seconds in timings.items()}
+
+def splice_segments(segments, crossfade):
+    """
+    Join audio segments with a linear crossfade of up to `crossfade` samples at each joint
+    Returns (audio, starts): starts[i] is where segments[i] begins in the output
+    """
+    overlaps = [0] + [
+        min(crossfade, len(previous), len(segment))
+        for previous, segment in zip(segments, segments[1:])
+    ]
+    out = np.zeros(sum(len(segment) for segment in segments) - sum(overlaps), dtype=np.float32)
+
+    starts = []
+    position = 0
+    for segment, overlap in zip(segments, overlaps):
+        start = position - overlap
+        if overlap:
+            ramp = ((np.arange(overlap) + 0.5) / overlap).astype(np.float32)
+            out[start:position] *= 1.0 - ramp
+            out[start:position] += segment[:overlap] * ramp
+        out[position:start + len(segment)] = segment[overlap:]
+        starts.append(start)
+        position = start + len(segment)
+    return out, starts
+
+def build_manifest(sentences, offsets, total_length, sample_rate, settings, levels):
+    """
+    Sentence manifest for a render: where each sentence sits in the audio (in samples,
+    each sentence includes its trailing silence) plus the settings and post-processing
+    gains needed to re-render part of it with /generate-incremental
+    """
+    ends = list(offsets[1:]) + [total_length]
+    return {
+        "version": 1,
+        "sample_rate": sample_rate,
+        **settings,
+        "levels": levels,
+        "sentences": [
+            {"text": sentence, "start": int(start), "end": int(end)}
+            for sentence, start, end in zip(sentences, offsets, ends)
+        ]
+    }
+
+def manifest_archive(audio, sample_rate, manifest):
+    """ZIP with speech.wav and manifest.json, returns a BytesIO at position 0"""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr('speech.wav', encode_wav(audio, sample_rate).getvalue())
+        zf.writestr('manifest.json', json.dumps(manifest))
+    archive.seek(0)
+    return archive
+
+def read_wav(data):
+    """Decode 16-bit mono WAV bytes, returns (float32 audio, sample rate)"""
+    import wave
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wav_file:
+            if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2:
+                raise ValueError("Expected 16-bit mono WAV")
+            frames = wav_file.readframes(wav_file.getnframes())
+            sample_rate = wav_file.getframerate()
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Unreadable WAV: {e}")
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32767.0, sample_rate
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -275,6 +1502,13 @@ def info():
             "cpu": "30-120 seconds per request",
             "gpu": "2-5 seconds per request"
         },
+        "inference_mode": {
+            "precision": INFERENCE_PRECISION,
+            "compile": TORCH_COMPILE,
+            "cpu_threads": torch.get_num_threads() if dev == "cpu" else None,
+            "cpu_quantize": CPU_QUANTIZE,
+            "cpu_onnx_vocoder": CPU_ONNX_VOCODER
+        },
         "available_speakers": [
             "Claribel Dervla",
             "Daisy Studious", 
@@ -287,7 +1521,11 @@ def info():
             "temperature": "Lower (0.5-0.7) for more consistent, higher (0.8-0.95) for more expressive",
             "speed": "0.9-1.1 for natural pacing",
             "speaker": "Try different speakers - some sound more natural than others"
-        }
+        },
+        "conditioning_cache": latent_cache.stats(),
+        "filter_cache": filter_cache_stats(),
+        "text_cache": text_cache_stats(),
+        "sentence_cache": sentence_cache.stats()
     }), 200
 
 @app.route('/voices', methods=['GET'])
@@ -295,8 +1533,7 @@ def list_voices():
     """
     List available cloned voices
     """
-    voices_dir = os.path.join(os.getcwd(), 'uploads', 'voices')
-    os.makedirs(voices_dir, exist_ok=True)
+    voices_dir = get_voices_dir()
 
     # List all .wav files in the voices directory
     voices = [f for f in os.listdir(voices_dir) if f.endswith('.wav')]
@@ -318,8 +1555,22 @@ def generate():
         "temperature": 0.5 (default: 0.5, range 0.1-1.0, lower=more stable, optimized for natural sound),
         "speed": 0.92 (default: 0.92, range 0.5-2.0, optimized for audiobook pacing),
         "speaker": "Claribel Dervla" (default speaker name if not using voice cloning),
-        "denoiser_strength": 0.02 (default: 0.02, range 0.0-1.0)
+        "denoiser_strength": 0.02 (default: 0.02, range 0.0-1.0),
+        "mastering": false (default: false, EQ + compression + -16 LUFS; ignored when streaming),
+        "stream": false (default: false, also accepted as ?stream=1),
+        "manifest": false (default: false, respond with a ZIP of speech.wav and the
+                    sentence manifest.json that /generate-incremental needs; ignored when streaming),
+        "output_format": "wav" (default: "wav", or "mp3", "opus" (Ogg), "aac" (ADTS); manifest needs wav),
+        "bitrate": 64 (default: XTTS_OUTPUT_BITRATE, kbit/s for compressed formats)
     }
+    
+    With stream enabled the response is chunked audio that starts playing
+    after the first sentence instead of after the whole text. Compressed
+    formats are encoded in process as the audio is produced, never buffered whole
+
+    Sentences synthesized before (same text, voice, language and settings) come
+    from the sentence cache; X-Sentence-Cache-Hits, -Misses, -Hit-Ratio and
+    -Bytes-Saved headers report how much of the response was cached
     """
     data = request.get_json()
     text = data.get('text')
@@ -329,9 +1580,19 @@ def generate():
     speed = data.get('speed', 0.92)  # Default 0.92 for audiobook pacing
     speaker_name = data.get('speaker', 'Claribel Dervla')
     denoiser_strength = data.get('denoiser_strength', 0.02)
+    mastering = bool(data.get('mastering', False))
+    stream = str(request.args.get('stream', data.get('stream', ''))).lower() in ('1', 'true', 'yes')
+    want_manifest = bool(data.get('manifest', False))
+    try:
+        output_format = parse_output_format(data.get('output_format'))
+        bitrate = parse_bitrate(data.get('bitrate'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     if not text:
         return jsonify({"error": "Text is required"}), 400
+    if want_manifest and output_format != 'wav':
+        return jsonify({"error": "manifest responses are WAV only (they are the source for /generate-incremental)"}), 400
 
     # Preprocess text for better quality
     text = preprocess_text(text)
@@ -340,7 +1601,7 @@ def generate():
     print(f"   Text: {text[:50]}{'...' if len(text) > 50 else ''}")
     print(f"   Language: {language}")
     print(f"   Voice ID: {voice_id if voice_id else 'Default'}")
-    print(f"   Temperature: {temperature} | Speed: {speed} | Denoiser: {denoiser_strength}")
+    print(f"   Temperature: {temperature} | Speed: {speed} | Denoiser: {denoiser_strength} | Mastering: {mastering}")
 
     # Get TTS model
     tts = get_tts_model()
@@ -348,65 +1609,200 @@ def generate():
     # Resolve voice file path
     speaker_wav = None
     if voice_id:
-        voices_dir = os.path.join(os.getcwd(), 'uploads', 'voices')
-        speaker_wav = os.path.join(voices_dir, voice_id)
+        speaker_wav = os.path.join(get_voices_dir(), voice_id)
         if not os.path.exists(speaker_wav):
             return jsonify({"error": f"Voice file '{voice_id}' not found"}), 404
 
+    if stream:
+        return Response(
+            stream_with_context(stream_speech(
+                tts,
+                text,
+                language=language,
+                speed=speed,
+                denoiser_strength=denoiser_strength,
+                speaker_wav=speaker_wav,
+                speaker_name=speaker_name,
+                output_format=output_format,
+                bitrate_kbps=bitrate
+            )),
+            mimetype='audio/wav' if output_format == 'wav' else OUTPUT_FORMATS[output_format][3],
+            headers={"X-Sample-Rate": str(tts.synthesizer.output_sample_rate)}
+        )
+
     # Generate speech
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        output_path = tmp_file.name
+    # Voice cloning reuses cached conditioning latents for speaker_wav,
+    # default voices use the model's built-in speaker latents.
+    # Sentences rendered before come from the sentence cache, only misses are synthesized
+    # Denoising and mastering (compression + EQ) run in memory. The high-pass runs on a
+    # CPU thread while the following sentences are synthesized; gating and mastering
+    # need the whole signal and run once synthesis is done
+    usage = new_cache_usage()
+    levels = {}
+    wav, sentences, lengths, timings = render_chapter(
+        tts,
+        text,
+        language=language,
+        speed=speed,
+        denoiser_strength=denoiser_strength,
+        mastering=mastering,
+        speaker_wav=speaker_wav,
+        speaker_name=speaker_name,
+        usage=usage,
+        levels=levels
+    )
+    sample_rate = tts.synthesizer.output_sample_rate
+
+    # Encode straight into the response (no temp files)
+    # Compressed formats are encoded block by block while the response is sent
+    started = time.perf_counter()
+    if want_manifest:
+        offsets = np.cumsum([0] + lengths[:-1]).tolist()
+        manifest = build_manifest(sentences, offsets, len(wav), sample_rate, {
+            "language": language,
+            "speed": speed,
+            "voice_id": voice_id,
+            "speaker": None if voice_id else speaker_name,
+            "denoiser_strength": denoiser_strength,
+            "mastering": mastering
+        }, levels)
+        response = send_file(
+            manifest_archive(wav, sample_rate, manifest),
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name='speech.zip'
+        )
+    else:
+        response = audio_response(wav, sample_rate, output_format, bitrate)
+    if output_format == 'wav':
+        timings['encode'] = time.perf_counter() - started
+
+    print(f"✅ Speech generated successfully! ({usage['hits']} cached sentence(s), {usage['misses']} synthesized)")
+    timing_headers = report_stage_timings(timings)
+
+    response.headers.update(cache_usage_headers(usage))
+    response.headers.update(timing_headers)
+    return response
 
+@app.route('/generate-incremental', methods=['POST'])
+def generate_incremental():
+    """
+    Re-render a chapter after an edit, synthesizing only the sentences that changed
+    
+    Expects multipart/form-data with:
+    - text: New chapter text
+    - previous_text: Chapter text the previous audio was rendered from
+    - previous_audio: The previous speech.wav
+    - manifest: The previous manifest.json (file or form field), from /generate
+      with "manifest": true or from an earlier /generate-incremental
+    
+    Voice, language, speed and post-processing come from the manifest. The texts
+    are diffed sentence by sentence; unchanged sentences are cut from the previous
+    audio and new ones are synthesized with the previous render's gains, then
+    spliced in with short crossfades.
+    
+    Returns a ZIP with speech.wav and the updated manifest.json
+    """
     try:
-        if speaker_wav:
-            # Voice cloning mode with quality settings
-            tts.tts_to_file(
-                text=text,
-                speaker_wav=speaker_wav,
-                language=language,
-                file_path=output_path,
-                speed=speed
-            )
+        text = request.form.get('text')
+        previous_text = request.form.get('previous_text')
+        if not text or not previous_text:
+            return jsonify({"error": "text and previous_text are required"}), 400
+        if 'previous_audio' not in request.files:
+            return jsonify({"error": "No previous_audio file provided"}), 400
+
+        if 'manifest' in request.files:
+            manifest = json.loads(request.files['manifest'].read())
+        elif request.form.get('manifest'):
+            manifest = json.loads(request.form['manifest'])
         else:
-            # Default voice mode with better speaker
-            tts.tts_to_file(
-                text=text,
-                speaker=speaker_name,
-                language=language,
-                file_path=output_path,
-                speed=speed
-            )
+            return jsonify({"error": "No manifest provided"}), 400
+
+        previous_audio, audio_rate = read_wav(request.files['previous_audio'].read())
 
-        # Apply denoising post-processing if requested
-        if denoiser_strength > 0:
-            apply_denoising(output_path, denoiser_strength)
+        tts = get_tts_model()
+        sample_rate = tts.synthesizer.output_sample_rate
+        if audio_rate != sample_rate or manifest.get('sample_rate') != sample_rate:
+            return jsonify({"error": f"Previous audio must be {sample_rate}Hz, as rendered by this server"}), 400
+
+        # The manifest must describe previous_text, or offsets would cut the wrong audio
+        old_entries = manifest['sentences']
+        old_sentences = [entry['text'] for entry in old_entries]
+        if tts.synthesizer.split_into_sentences(preprocess_text(previous_text)) != old_sentences:
+            return jsonify({"error": "Manifest does not match previous_text"}), 409
+        if old_entries and old_entries[-1]['end'] > len(previous_audio):
+            return jsonify({"error": "Previous audio is shorter than the manifest"}), 409
+
+        voice_id = manifest.get('voice_id')
+        speaker_wav = None
+        if voice_id:
+            speaker_wav = os.path.join(get_voices_dir(), voice_id)
+            if not os.path.exists(speaker_wav):
+                return jsonify({"error": f"Voice file '{voice_id}' not found"}), 404
 
-        # Apply audio mastering (compression + EQ)
-        # DISABLED: ffmpeg DLL dependency issues on Windows
-        # apply_mastering(output_path)
+        settings = {key: manifest.get(key) for key in ('language', 'speed', 'voice_id', 'speaker', 'denoiser_strength', 'mastering')}
+        levels = manifest.get('levels') or {}
+        new_sentences = tts.synthesizer.split_into_sentences(preprocess_text(text))
 
-        print(f"✅ Speech generated successfully!")
+        print(f"\n📝 Re-rendering chapter: {len(old_sentences)} -> {len(new_sentences)} sentences")
 
-        # Read the generated audio file
-        with open(output_path, 'rb') as f:
-            audio_data = f.read()
+        # Each segment is a run of reused or of new sentences, with those sentences' lengths
+        segments = []
+        segment_lengths = []
+        reused = 0
+        usage = new_cache_usage()
+        matcher = difflib.SequenceMatcher(None, old_sentences, new_sentences, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                segments.append(previous_audio[old_entries[i1]['start']:old_entries[i2 - 1]['end']])
+                segment_lengths.append([entry['end'] - entry['start'] for entry in old_entries[i1:i2]])
+                reused += i2 - i1
+            elif j2 > j1:
+                sentence_wavs = list(synthesize_sentences(
+                    tts,
+                    None,
+                    language=settings['language'],
+                    speed=settings['speed'],
+                    speaker_wav=speaker_wav,
+                    speaker_name=settings['speaker'],
+                    usage=usage,
+                    sentences=new_sentences[j1:j2]
+                ))
+                # Copy of levels: stages with no recorded gain measure their own
+                segments.append(postprocess_audio(
+                    np.concatenate(sentence_wavs), sample_rate,
+                    settings['denoiser_strength'] or 0, bool(settings['mastering']), dict(levels)
+                ))
+                segment_lengths.append([len(w) for w in sentence_wavs])
 
-        # Clean up temp file
-        os.unlink(output_path)
+        crossfade = int(sample_rate * SPLICE_CROSSFADE_MS / 1000)
+        wav, starts = splice_segments(segments, crossfade)
 
-        # Return audio file
-        return send_file(
-            io.BytesIO(audio_data),
-            mimetype='audio/wav',
+        offsets = []
+        for start, lengths in zip(starts, segment_lengths):
+            offsets += (start + np.cumsum([0] + lengths[:-1])).tolist()
+        updated = build_manifest(new_sentences, offsets, len(wav), sample_rate, settings, levels)
+
+        synthesized = len(new_sentences) - reused
+        print(f"✅ Re-rendered: {reused} sentence(s) reused, {synthesized} synthesized")
+
+        response = send_file(
+            manifest_archive(wav, sample_rate, updated),
+            mimetype='application/zip',
             as_attachment=True,
-            download_name='speech.wav'
+            download_name='speech.zip'
         )
+        response.headers.update(cache_usage_headers(usage))
+        response.headers['X-Sentences-Reused'] = str(reused)
+        response.headers['X-Sentences-Synthesized'] = str(synthesized)
+        return response
 
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid manifest or audio: {e}"}), 400
     except Exception as e:
-        # Cleanup on error
-        if os.path.exists(output_path):
-            os.unlink(output_path)
-        raise e
+        error_msg = str(e)
+        print(f"❌ Error: {error_msg}")
+        return jsonify({"error": error_msg}), 500
 
 @app.route('/generate-cloned', methods=['POST'])
 def generate_cloned():
@@ -420,6 +1816,9 @@ def generate_cloned():
     - temperature: Temperature setting (default: 0.5)
     - speed: Speed multiplier (default: 0.92)
     - denoiser_strength: Denoising amount (default: 0.02)
+    - mastering: Apply the mastering chain (default: false)
+    - output_format: wav, mp3, opus or aac (default: wav)
+    - bitrate: kbit/s for compressed formats (default: XTTS_OUTPUT_BITRATE)
     """
     try:
         # Get form data
@@ -428,6 +1827,12 @@ def generate_cloned():
         temperature = float(request.form.get('temperature', 0.5))
         speed = float(request.form.get('speed', 0.92))
         denoiser_strength = float(request.form.get('denoiser_strength', 0.02))
+        mastering = request.form.get('mastering', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            output_format = parse_output_format(request.form.get('output_format'))
+            bitrate = parse_bitrate(request.form.get('bitrate'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Get uploaded audio file
         if 'speaker_wav' not in request.files:
@@ -440,10 +1845,9 @@ def generate_cloned():
         if not text:
             return jsonify({"error": "Text is required"}), 400
         
-        # Save speaker reference temporarily
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as speaker_tmp:
-            speaker_wav_path = speaker_tmp.name
-            speaker_file.save(speaker_wav_path)
+        # Keep the reference in the voice store so repeat requests
+        # reuse the stored file and its cached conditioning latents
+        voice_filename, speaker_wav_path, _, created = store_voice(speaker_file.read())
         
         # Preprocess text
         text = preprocess_text(text)
@@ -451,58 +1855,38 @@ def generate_cloned():
         print(f"\n📝 Generating speech with voice cloning...")
         print(f"   Text: {text[:50]}{'...' if len(text) > 50 else ''}")
         print(f"   Language: {language}")
-        print(f"   Speaker: Custom (cloned from upload)")
-        print(f"   Temperature: {temperature} | Speed: {speed} | Denoiser: {denoiser_strength}")
+        print(f"   Speaker: {voice_filename} ({'new upload' if created else 'stored voice'})")
+        print(f"   Temperature: {temperature} | Speed: {speed} | Denoiser: {denoiser_strength} | Mastering: {mastering}")
         
         # Get TTS model
         tts = get_tts_model()
         
-        # Generate speech with voice cloning
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_tmp:
-            output_path = output_tmp.name
-        
-        try:
-            # Voice cloning with quality settings
-            tts.tts_to_file(
-                text=text,
-                speaker_wav=speaker_wav_path,
-                language=language,
-                file_path=output_path,
-                speed=speed
-            )
-            
-            # Apply denoising
-            if denoiser_strength > 0:
-                apply_denoising(output_path, denoiser_strength)
-            
-            # Apply audio mastering (compression + EQ)
-            # DISABLED: ffmpeg DLL dependency issues on Windows
-            # apply_mastering(output_path)
-            
-            print(f"✅ Voice-cloned speech generated successfully!")
-            
-            # Read audio
-            with open(output_path, 'rb') as f:
-                audio_data = f.read()
-            
-            # Cleanup
-            os.unlink(output_path)
-            os.unlink(speaker_wav_path)
-            
-            return send_file(
-                io.BytesIO(audio_data),
-                mimetype='audio/wav',
-                as_attachment=True,
-                download_name='speech.wav'
-            )
-            
-        except Exception as e:
-            # Cleanup on error
-            if os.path.exists(output_path):
-                os.unlink(output_path)
-            if os.path.exists(speaker_wav_path):
-                os.unlink(speaker_wav_path)
-            raise e
+        # Generate speech with voice cloning (cached conditioning latents and sentences),
+        # the denoiser's high-pass overlaps synthesis on a CPU thread
+        usage = new_cache_usage()
+        wav, _, _, timings = render_chapter(
+            tts,
+            text,
+            language=language,
+            speed=speed,
+            denoiser_strength=denoiser_strength,
+            mastering=mastering,
+            speaker_wav=speaker_wav_path,
+            usage=usage
+        )
+
+        # Encode into the response (compressed formats while it is sent)
+        started = time.perf_counter()
+        response = audio_response(wav, tts.synthesizer.output_sample_rate, output_format, bitrate)
+        if output_format == 'wav':
+            timings['encode'] = time.perf_counter() - started
+
+        print(f"✅ Voice-cloned speech generated successfully! ({usage['hits']} cached sentence(s), {usage['misses']} synthesized)")
+        timing_headers = report_stage_timings(timings)
+
+        response.headers.update(cache_usage_headers(usage))
+        response.headers.update(timing_headers)
+        return response
         
     except Exception as e:
         error_msg = str(e)
@@ -516,6 +1900,9 @@ def upload_voice():
     
     Expects a multipart/form-data file upload with key 'voice'
     Returns the path where the voice was saved
+    
+    Voices are content-addressed: uploading the same audio again returns
+    the existing voice instead of storing another copy
     """
     try:
         if 'voice' not in request.files:
@@ -526,21 +1913,20 @@ def upload_voice():
         if voice_file.filename == '':
             return jsonify({"error": "Empty filename"}), 400
         
-        # Create voices directory if it doesn't exist
-        voices_dir = os.path.join(os.getcwd(), 'uploads', 'voices')
-        os.makedirs(voices_dir, exist_ok=True)
+        # Save the voice file (or find the existing copy)
+        filename, filepath, voice_hash, created = store_voice(voice_file.read())
         
-        # Save the voice file
-        filename = f"voice_{hash(voice_file.filename)}_{voice_file.filename}"
-        filepath = os.path.join(voices_dir, filename)
-        voice_file.save(filepath)
-        
-        print(f"✅ Voice sample uploaded: {filename}")
+        if created:
+            print(f"✅ Voice sample uploaded: {filename}")
+        else:
+            print(f"✅ Voice sample already stored: {filename}")
         
         return jsonify({
             "success": True,
             "path": filepath,
-            "filename": filename
+            "filename": filename,
+            "voice_hash": voice_hash,
+            "deduplicated": not created
         }), 200
         
     except Exception as e:
@@ -559,7 +1945,7 @@ if __name__ == '__main__':
     print(f"Endpoints:")
     print(f"  GET  http://localhost:8000/health")
     print(f"  GET  http://localhost:8000/info")
-    print(f"  POST http://localhost:8000/generate (default voices)")
+    print(f"  POST http://localhost:8000/generate (default voices, ?stream=1 for chunked audio)")
     print(f"  POST http://localhost:8000/generate-cloned (voice cloning)")
     print(f"  POST http://localhost:8000/voices/upload")
     print(f"  GET  http://localhost:8000/voices")
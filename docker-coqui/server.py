@@ -1,10 +1,12 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import torch
 from TTS.api import TTS
-import tempfile
-import time
+import numpy as np
+import io
+import os
+import wave
 
 app = FastAPI()
 
@@ -19,6 +21,20 @@ app.add_middleware(
 tts_model = None
 device = None
 
+# PRECISION: fp32, or fp16/bf16 autocast on CUDA; TORCH_COMPILE=1 compiles the GPT decoder and vocoder
+PRECISION = os.environ.get("PRECISION", "fp32").lower()
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+AUTOCAST_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+# output_format -> (FFmpeg container, encoder, encoder sample format, media type)
+OUTPUT_FORMATS = {
+    "mp3": ("mp3", "libmp3lame", "fltp", "audio/mpeg"),
+    "opus": ("ogg", "libopus", "flt", "audio/ogg"),
+    "aac": ("adts", "aac", "fltp", "audio/aac"),
+}
+MIN_BITRATE_KBPS, MAX_BITRATE_KBPS = 8, 320  # Accepted range for the bitrate parameter
+ENCODE_BLOCK_SIZE = 65536  # Samples handed to the encoder per write
+
 @app.on_event("startup")
 async def startup():
     global tts_model, device
@@ -28,6 +44,15 @@ async def startup():
     if device == "cuda":
         print(f"GPU: {torch.cuda.get_device_name(0)}")
     tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+    xtts = tts_model.synthesizer.tts_model
+    if device == "cuda" and PRECISION in AUTOCAST_DTYPES:
+        vocoder_forward = xtts.hifigan_decoder.forward  # Keep float32 audio out of autocast
+        xtts.hifigan_decoder.forward = lambda *args, **kwargs: vocoder_forward(*args, **kwargs).float()
+    if TORCH_COMPILE:
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        xtts.gpt.gpt.forward = torch.compile(xtts.gpt.gpt.forward, dynamic=True)
+        xtts.hifigan_decoder.forward = torch.compile(xtts.hifigan_decoder.forward, dynamic=True)
     print("✅ Ready!")
 
 @app.get("/health")
@@ -39,14 +64,94 @@ async def health():
         "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
     }
 
+def synthesize(text, speaker_wav, language="en"):
+    """In-memory XTTS: latents once from the uploaded reference, then one inference per sentence"""
+    with torch.inference_mode(), torch.autocast(
+        device_type="cuda", dtype=AUTOCAST_DTYPES.get(PRECISION, torch.float16),
+        enabled=device == "cuda" and PRECISION in AUTOCAST_DTYPES
+    ):
+        return _synthesize(text, speaker_wav, language)
+
+def _synthesize(text, speaker_wav, language):
+    xtts = tts_model.synthesizer.tts_model
+    config = xtts.config
+    gpt_cond_latent, speaker_embedding = xtts.get_conditioning_latents(
+        audio_path=[speaker_wav],
+        gpt_cond_len=config.gpt_cond_len,
+        gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+        max_ref_length=config.max_ref_len,
+        sound_norm_refs=config.sound_norm_refs
+    )
+    settings = {k: getattr(config, k) for k in ("temperature", "length_penalty", "repetition_penalty", "top_k", "top_p")}
+    pieces = []
+    for sentence in tts_model.synthesizer.split_into_sentences(text):
+        wav = xtts.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)["wav"]
+        wav = wav.cpu().numpy() if torch.is_tensor(wav) else np.asarray(wav)
+        pieces += [wav.astype(np.float32).squeeze(), np.zeros(10000, dtype=np.float32)]
+    return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+def encode_wav(wav, sample_rate):
+    peak = max(0.01, float(np.abs(wav).max()) if len(wav) else 0.0)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((np.clip(wav / peak, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+class EncodedChunks:
+    """File-like write target that hands encoded bytes over as soon as they are written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def encode_compressed(wav, sample_rate, output_format, bitrate_kbps):
+    """
+    Same normalization as encode_wav, encoded in process (torchaudio StreamWriter)
+    Generator: yields the encoded bytes block by block, the whole file is never buffered
+    """
+    from torchaudio.io import StreamWriter
+    container, encoder, encoder_format, _ = OUTPUT_FORMATS[output_format]
+    peak = max(0.01, float(np.abs(wav).max()) if len(wav) else 0.0)
+    sink = EncodedChunks()
+    writer = StreamWriter(sink, format=container)
+    writer.add_audio_stream(sample_rate, 1, format="flt", encoder=encoder, encoder_format=encoder_format,
+                            encoder_option={"b": str(bitrate_kbps * 1000)})
+    writer.open()
+    try:
+        for start in range(0, len(wav), ENCODE_BLOCK_SIZE):
+            block = np.clip(wav[start:start + ENCODE_BLOCK_SIZE] / peak, -1.0, 1.0).astype(np.float32)
+            writer.write_audio_chunk(0, torch.from_numpy(block).unsqueeze(1))
+            data = sink.take()
+            if data:
+                yield data
+        writer.flush()
+    finally:
+        writer.close()
+    yield sink.take()
+
 @app.post("/generate-audio")
-async def generate_audio(text: str = Form(...), speaker_wav: UploadFile = File(...)):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_speaker:
-        content = await speaker_wav.read()
-        temp_speaker.write(content)
-        temp_speaker_path = temp_speaker.name
-    
-    output_path = f"/tmp/output_{int(time.time())}.wav"
-    tts_model.tts_to_file(text=text, file_path=output_path, speaker_wav=temp_speaker_path, language="en")
-    
-    return FileResponse(output_path, media_type="audio/wav")
+async def generate_audio(text: str = Form(...), speaker_wav: UploadFile = File(...),
+                         output_format: str = Form("wav"), bitrate: int = Form(64)):
+    output_format = output_format.lower()
+    if output_format != "wav" and output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output_format '{output_format}'")
+    if not MIN_BITRATE_KBPS <= bitrate <= MAX_BITRATE_KBPS:
+        raise HTTPException(status_code=400, detail=f"bitrate must be between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbit/s")
+    content = await speaker_wav.read()
+    wav = synthesize(text, io.BytesIO(content), language="en")
+    sample_rate = tts_model.synthesizer.output_sample_rate
+    if output_format == "wav":
+        return Response(content=encode_wav(wav, sample_rate), media_type="audio/wav")
+    return StreamingResponse(encode_compressed(wav, sample_rate, output_format, bitrate),
+                             media_type=OUTPUT_FORMATS[output_format][3])
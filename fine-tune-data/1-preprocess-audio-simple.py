@@ -1,112 +1,268 @@
 """
 Simple audio preprocessing using scipy and soundfile
 Works with Python 3.11 conda environment
+
+Files are processed in parallel (one per worker process) and streamed: audio is
+read, downmixed and resampled in blocks, and each chunk is written as soon as it
+is full, so memory use doesn't grow with the length of the track.
+processed-audio/manifest-simple.json records each source's hash and chunks; re-runs
+skip sources that haven't changed and only process new or modified files.
 """
 
 import os
+import json
+import hashlib
 import numpy as np
 import soundfile as sf
+from math import gcd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from scipy import signal
 from scipy.io import wavfile
 
 # Configuration
 RAW_AUDIO_DIR = Path("raw-audio")
 PROCESSED_DIR = Path("processed-audio")
+MANIFEST_FILE = PROCESSED_DIR / "manifest-simple.json"
+# 1-preprocess-audio.py writes the same chunk names into processed-audio/ and keeps its own manifest
+OTHER_MANIFEST_FILE = PROCESSED_DIR / "manifest.json"
 TARGET_SAMPLE_RATE = 22050  # XTTS standard
 CHUNK_DURATION = 15  # seconds per chunk
+MIN_CHUNK_DURATION = 5  # shorter final chunks are dropped
+BLOCK_SIZE = 65536  # source frames read per block
+WORKERS = int(os.environ.get("PREPROCESS_WORKERS", os.cpu_count() or 1))
 
-def convert_and_split_audio(input_file):
-    """Convert MP3 to WAV and split into chunks"""
-    print(f"\nProcessing {input_file.name}...")
-    
-    # Load audio using soundfile (handles MP3)
+# Anything that changes the output; a source is redone if these differ from its manifest entry
+SETTINGS = {
+    "sample_rate": TARGET_SAMPLE_RATE,
+    "chunk_duration": CHUNK_DURATION,
+    "min_chunk_duration": MIN_CHUNK_DURATION,
+}
+
+class StreamingResampler:
+    """
+    Block-wise resample_poly with the same output as resampling the whole signal
+
+    Each block is resampled together with `pad` input samples of context on both
+    sides (more than the anti-aliasing filter's half-length) and only the outputs
+    that belong to the block are kept, so there are no seams at block edges.
+    Blocks start on multiples of `down`, which keeps them on the output grid
+    """
+
+    def __init__(self, orig_sr, target_sr):
+        common = gcd(orig_sr, target_sr)
+        self.up = target_sr // common
+        self.down = orig_sr // common
+        half_len = 10 * max(self.up, self.down)  # resample_poly's default filter, in upsampled samples
+        context = half_len // self.up + 2
+        self.pad = -(-context // self.down) * self.down
+        # Zeros before the signal, like resample_poly's constant padding
+        self.buffer = np.zeros(self.pad, dtype=np.float32)
+
+    def process(self, block):
+        """Add input samples, returns the output samples that are final so far"""
+        if self.up == self.down:
+            return block
+        self.buffer = np.concatenate([self.buffer, block.astype(np.float32)])
+        ready = (len(self.buffer) - 2 * self.pad) // self.down * self.down
+        if ready <= 0:
+            return np.zeros(0, dtype=np.float32)
+        out = self._resample(self.pad + ready + self.pad, ready * self.up // self.down)
+        self.buffer = self.buffer[ready:]
+        return out
+
+    def flush(self):
+        """Resample what is left, with zeros after the signal"""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        remaining = len(self.buffer) - self.pad
+        self.buffer = np.concatenate([self.buffer, np.zeros(self.pad, dtype=np.float32)])
+        out = self._resample(len(self.buffer), -(-remaining * self.up // self.down))
+        self.buffer = np.zeros(self.pad, dtype=np.float32)
+        return out
+
+    def _resample(self, length, count):
+        start = self.pad * self.up // self.down
+        resampled = signal.resample_poly(self.buffer[:length], self.up, self.down)
+        return resampled[start:start + count].astype(np.float32)
+
+def read_blocks(input_file):
+    """Yield (mono float32 block, sample rate) from an audio file, one block at a time"""
     try:
-        audio_data, sample_rate = sf.read(input_file)
-    except Exception as e:
-        print(f"  Error loading file: {e}")
-        print(f"  Trying alternative method...")
-        # Fallback: use scipy's wavfile if it's already WAV
-        sample_rate, audio_data = wavfile.read(input_file)
-        audio_data = audio_data.astype(np.float32) / 32768.0  # Normalize to -1 to 1
-    
-    print(f"  Loaded: {len(audio_data)/sample_rate:.1f} seconds at {sample_rate} Hz")
-    
-    # Convert to mono if stereo
-    if len(audio_data.shape) > 1:
-        audio_data = np.mean(audio_data, axis=1)
-        print(f"  Converted stereo to mono")
-    
-    # Resample to 22050 Hz if needed
-    if sample_rate != TARGET_SAMPLE_RATE:
-        num_samples = int(len(audio_data) * TARGET_SAMPLE_RATE / sample_rate)
-        audio_data = signal.resample(audio_data, num_samples)
-        sample_rate = TARGET_SAMPLE_RATE
-        print(f"  Resampled to {TARGET_SAMPLE_RATE} Hz")
-    
-    # Split into chunks
-    chunk_samples = CHUNK_DURATION * sample_rate
-    num_chunks = int(np.ceil(len(audio_data) / chunk_samples))
-    
+        f = sf.SoundFile(input_file)
+    except RuntimeError:
+        # Older libsndfile builds can't read MP3; WAV can still be memory-mapped.
+        # Only an open failure falls back, errors mid-file are raised as they are
+        f = None
+    if f is not None:
+        with f:
+            for block in f.blocks(blocksize=BLOCK_SIZE, dtype="float32", always_2d=True):
+                yield block.mean(axis=1), f.samplerate
+        return
+    sample_rate, audio_data = wavfile.read(input_file, mmap=True)
+    scale = float(np.iinfo(audio_data.dtype).max + 1) if audio_data.dtype.kind in "iu" else 1.0
+    for start in range(0, len(audio_data), BLOCK_SIZE):
+        block = np.asarray(audio_data[start:start + BLOCK_SIZE], dtype=np.float32) / scale
+        yield (block.mean(axis=1) if block.ndim > 1 else block), sample_rate
+
+def convert_and_split_audio(input_file):
+    """
+    Convert an audio file to 22050 Hz mono and split it into chunks
+    Runs in a worker process; returns [(chunk filename, duration in seconds)]
+    """
     base_name = input_file.stem
+    chunk_samples = CHUNK_DURATION * TARGET_SAMPLE_RATE
+    resampler = None
+    pending = []
+    pending_len = 0
+    index = 0
     saved_chunks = []
-    
-    for i in range(num_chunks):
-        start = i * chunk_samples
-        end = min((i + 1) * chunk_samples, len(audio_data))
-        chunk = audio_data[start:end]
-        
+
+    def write_chunk(samples):
+        nonlocal index
+        duration = len(samples) / TARGET_SAMPLE_RATE
         # Skip if chunk is too short (< 5 seconds)
-        if len(chunk) / sample_rate < 5:
-            continue
-        
-        # Save chunk
-        output_file = PROCESSED_DIR / f"{base_name}_chunk_{i:03d}.wav"
-        sf.write(output_file, chunk, sample_rate)
-        
-        duration = len(chunk) / sample_rate
-        saved_chunks.append(output_file)
-        print(f"  ✓ Chunk {i:03d}: {duration:.1f}s -> {output_file.name}")
-    
+        if duration >= MIN_CHUNK_DURATION:
+            output_file = PROCESSED_DIR / f"{base_name}_chunk_{index:03d}.wav"
+            sf.write(output_file, samples, TARGET_SAMPLE_RATE)
+            saved_chunks.append((output_file.name, duration))
+        index += 1
+
+    def take(samples):
+        nonlocal pending, pending_len
+        pending.append(samples)
+        pending_len += len(samples)
+        while pending_len >= chunk_samples:
+            audio = np.concatenate(pending)
+            write_chunk(audio[:chunk_samples])
+            pending = [audio[chunk_samples:]]
+            pending_len = len(pending[0])
+
+    for block, sample_rate in read_blocks(input_file):
+        if resampler is None:
+            resampler = StreamingResampler(sample_rate, TARGET_SAMPLE_RATE)
+        take(resampler.process(block))
+    if resampler is not None:
+        take(resampler.flush())
+    if pending_len:
+        write_chunk(np.concatenate(pending))
+
     return saved_chunks
 
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_manifest(path=MANIFEST_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def forget_in_other_manifest(name):
+    """This source's chunks were just rewritten, so the other script's entry for it is stale"""
+    other = load_manifest(OTHER_MANIFEST_FILE)
+    if other.pop(name, None) is not None:
+        save_manifest(other, OTHER_MANIFEST_FILE)
+
+def is_up_to_date(entry, audio_file):
+    """True if the manifest entry matches the source file, the settings and the chunks on disk"""
+    if not entry or entry.get("settings") != SETTINGS:
+        return False
+    if not all((PROCESSED_DIR / name).exists() for name, _ in entry["chunks"]):
+        return False
+    stat = audio_file.stat()
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    # Touched or copied: only redo it if the contents changed
+    if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(audio_file):
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+    return False
+
+def process_file(audio_file):
+    """Worker entry point: hash the source and convert it, returns its manifest entry"""
+    stat = audio_file.stat()
+    return {
+        "sha256": file_sha256(audio_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "settings": SETTINGS,
+        "chunks": convert_and_split_audio(audio_file),
+    }
+
 def main():
     print("="*60)
     print("XTTS Audio Preprocessing (Simple)")
     print("="*60)
-    
+
     # Create output directory
     PROCESSED_DIR.mkdir(exist_ok=True)
-    
+
     # Find audio files
     audio_files = list(RAW_AUDIO_DIR.glob("*.mp3")) + list(RAW_AUDIO_DIR.glob("*.wav"))
-    
+
     if not audio_files:
         print("\n❌ No audio files found in raw-audio/")
         print("   Supported: .mp3, .wav")
         return
-    
-    print(f"\nFound {len(audio_files)} audio file(s):")
+
+    manifest = load_manifest()
+    todo = [f for f in audio_files if not is_up_to_date(manifest.get(f.name), f)]
+
+    print(f"\nFound {len(audio_files)} audio file(s), {len(audio_files) - len(todo)} already processed:")
     for f in audio_files:
-        print(f"  - {f.name}")
-    
-    all_chunks = []
-    
-    # Process each file
-    for audio_file in audio_files:
-        try:
-            chunks = convert_and_split_audio(audio_file)
-            all_chunks.extend(chunks)
-        except Exception as e:
-            print(f"  ❌ Error processing {audio_file.name}: {e}")
-            import traceback
-            traceback.print_exc()
-    
+        print(f"  - {f.name}{'' if f in todo else ' (unchanged, skipped)'}")
+
+    failed = 0
+
+    # Process new or changed files in parallel, one file per worker
+    if todo:
+        print(f"\nProcessing {len(todo)} file(s) with {min(WORKERS, len(todo))} worker(s)...")
+        with ProcessPoolExecutor(max_workers=max(1, min(WORKERS, len(todo)))) as pool:
+            futures = {pool.submit(process_file, f): f for f in todo}
+            for future in as_completed(futures):
+                audio_file = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"  ❌ Error processing {audio_file.name}: {e}")
+                    continue
+
+                # Chunks from an older version of this file that no longer exist in the new one
+                old = manifest.get(audio_file.name)
+                if old:
+                    kept = {name for name, _ in entry["chunks"]}
+                    for name, _ in old["chunks"]:
+                        if name not in kept:
+                            (PROCESSED_DIR / name).unlink(missing_ok=True)
+
+                manifest[audio_file.name] = entry
+                forget_in_other_manifest(audio_file.name)
+                save_manifest(manifest)
+                duration = sum(d for _, d in entry["chunks"])
+                print(f"  ✓ {audio_file.name}: {len(entry['chunks'])} chunks, {duration:.1f}s")
+
+    save_manifest(manifest)
+    current = [manifest[f.name] for f in audio_files if f.name in manifest]
+    all_chunks = [chunk for entry in current for chunk in entry["chunks"]]
+
     print("\n" + "="*60)
-    print(f"✅ Preprocessing Complete!")
+    print(f"✅ Preprocessing Complete!" if not failed else f"⚠️  Preprocessing finished with {failed} failed file(s)")
     print(f"   Created {len(all_chunks)} audio chunks")
-    total_duration = len(all_chunks) * CHUNK_DURATION / 60
-    print(f"   Estimated duration: ~{total_duration:.1f} minutes")
+    total_duration = sum(d for _, d in all_chunks) / 60
+    print(f"   Total duration: ~{total_duration:.1f} minutes")
     print(f"   Output: processed-audio/")
     print()
     print("Next step: Run '2-transcribe-audio.py' to generate transcriptions")
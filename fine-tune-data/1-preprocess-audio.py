@@ -2,13 +2,19 @@
 Step 1: Audio Preprocessing
 Converts your audio files to the correct format for XTTS training
 Splits into manageable chunks (10-30 seconds each)
+
+Files are processed in parallel, one per worker process. processed-audio/manifest.json
+records each source's hash and chunks; re-runs skip sources that haven't changed
+and only process new or modified files.
 """
 
 import os
+import json
+import hashlib
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pydub import AudioSegment
 from pydub.silence import split_on_silence
-import subprocess
 
 # Configuration
 RAW_AUDIO_DIR = Path("raw-audio")
@@ -17,11 +23,21 @@ TARGET_SAMPLE_RATE = 22050  # XTTS standard
 MIN_CHUNK_LENGTH = 5000  # 5 seconds minimum
 MAX_CHUNK_LENGTH = 30000  # 30 seconds maximum
 SILENCE_THRESH = -40  # dB threshold for silence detection
+MANIFEST_FILE = PROCESSED_DIR / "manifest.json"
+# 1-preprocess-audio-simple.py writes the same chunk names into processed-audio/ and keeps its own manifest
+OTHER_MANIFEST_FILE = PROCESSED_DIR / "manifest-simple.json"
+WORKERS = int(os.environ.get("PREPROCESS_WORKERS", os.cpu_count() or 1))
 
-def convert_to_wav_22050(input_file, output_file):
-    """Convert any audio file to WAV 22050Hz mono"""
-    print(f"Converting {input_file.name}...")
-    
+# Anything that changes the output; a source is redone if these differ from its manifest entry
+SETTINGS = {
+    "sample_rate": TARGET_SAMPLE_RATE,
+    "min_chunk_length": MIN_CHUNK_LENGTH,
+    "max_chunk_length": MAX_CHUNK_LENGTH,
+    "silence_thresh": SILENCE_THRESH,
+}
+
+def convert_to_wav_22050(input_file):
+    """Load any audio file as 22050Hz mono (in memory, chunks are the only files written)"""
     # Load audio (pydub handles MP3, WAV, etc.)
     audio = AudioSegment.from_file(input_file)
     
@@ -32,16 +48,10 @@ def convert_to_wav_22050(input_file, output_file):
     # Resample to 22050 Hz
     audio = audio.set_frame_rate(TARGET_SAMPLE_RATE)
     
-    # Export as WAV
-    audio.export(output_file, format="wav")
-    print(f"  ✓ Converted to {output_file.name}")
-    
     return audio
 
 def split_audio_intelligent(audio, base_name):
-    """Split audio into chunks based on silence detection"""
-    print(f"Splitting {base_name} into chunks...")
-    
+    """Split audio into chunks based on silence detection, returns [(chunk filename, duration in seconds)]"""
     # Split on silence (natural pauses)
     chunks = split_on_silence(
         audio,
@@ -93,11 +103,63 @@ def split_audio_intelligent(audio, base_name):
             output_file = PROCESSED_DIR / f"{base_name}_chunk_{i:03d}.wav"
             chunk.export(output_file, format="wav")
             duration = len(chunk) / 1000.0
-            saved_chunks.append(output_file)
-            print(f"  ✓ Chunk {i:03d}: {duration:.1f}s -> {output_file.name}")
+            saved_chunks.append((output_file.name, duration))
     
     return saved_chunks
 
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_manifest(path=MANIFEST_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def forget_in_other_manifest(name):
+    """This source's chunks were just rewritten, so the other script's entry for it is stale"""
+    other = load_manifest(OTHER_MANIFEST_FILE)
+    if other.pop(name, None) is not None:
+        save_manifest(other, OTHER_MANIFEST_FILE)
+
+def is_up_to_date(entry, audio_file):
+    """True if the manifest entry matches the source file, the settings and the chunks on disk"""
+    if not entry or entry.get("settings") != SETTINGS:
+        return False
+    if not all((PROCESSED_DIR / name).exists() for name, _ in entry["chunks"]):
+        return False
+    stat = audio_file.stat()
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    # Touched or copied: only redo it if the contents changed
+    if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(audio_file):
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+    return False
+
+def process_file(audio_file):
+    """Worker entry point: hash, convert and split one source, returns its manifest entry"""
+    stat = audio_file.stat()
+    audio = convert_to_wav_22050(audio_file)
+    return {
+        "sha256": file_sha256(audio_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "settings": SETTINGS,
+        "chunks": split_audio_intelligent(audio, audio_file.stem),
+    }
+
 def main():
     print("="*60)
     print("XTTS Audio Preprocessing")
@@ -117,33 +179,52 @@ def main():
         print("   Supported formats: MP3, WAV, M4A, FLAC, OGG")
         return
     
-    print(f"Found {len(audio_files)} audio file(s):")
+    manifest = load_manifest()
+    todo = [f for f in audio_files if not is_up_to_date(manifest.get(f.name), f)]
+    
+    print(f"Found {len(audio_files)} audio file(s), {len(audio_files) - len(todo)} already processed:")
     for f in audio_files:
-        print(f"  - {f.name}")
+        print(f"  - {f.name}{'' if f in todo else ' (unchanged, skipped)'}")
     print()
     
-    all_chunks = []
-    
-    # Process each file
-    for audio_file in audio_files:
-        base_name = audio_file.stem
-        
-        # Convert to correct format
-        temp_wav = PROCESSED_DIR / f"{base_name}_temp.wav"
-        audio = convert_to_wav_22050(audio_file, temp_wav)
-        
-        # Split into chunks
-        chunks = split_audio_intelligent(audio, base_name)
-        all_chunks.extend(chunks)
-        
-        # Remove temp file
-        temp_wav.unlink()
+    failed = 0
+    
+    # Process new or changed files in parallel, one file per worker
+    if todo:
+        print(f"Processing {len(todo)} file(s) with {min(WORKERS, len(todo))} worker(s)...")
+        with ProcessPoolExecutor(max_workers=max(1, min(WORKERS, len(todo)))) as pool:
+            futures = {pool.submit(process_file, f): f for f in todo}
+            for future in as_completed(futures):
+                audio_file = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"  ❌ Error processing {audio_file.name}: {e}")
+                    continue
+                
+                # Chunks from an older version of this file that no longer exist in the new one
+                old = manifest.get(audio_file.name)
+                if old:
+                    kept = {name for name, _ in entry["chunks"]}
+                    for name, _ in old["chunks"]:
+                        if name not in kept:
+                            (PROCESSED_DIR / name).unlink(missing_ok=True)
+                
+                manifest[audio_file.name] = entry
+                forget_in_other_manifest(audio_file.name)
+                save_manifest(manifest)
+                duration = sum(d for _, d in entry["chunks"])
+                print(f"  ✓ {audio_file.name}: {len(entry['chunks'])} chunks, {duration:.1f}s")
         print()
     
+    save_manifest(manifest)
+    all_chunks = [chunk for f in audio_files if f.name in manifest for chunk in manifest[f.name]["chunks"]]
+    
     print("="*60)
-    print(f"✅ Preprocessing Complete!")
+    print(f"✅ Preprocessing Complete!" if not failed else f"⚠️  Preprocessing finished with {failed} failed file(s)")
     print(f"   Created {len(all_chunks)} audio chunks")
-    print(f"   Total duration: ~{sum(AudioSegment.from_wav(c).duration_seconds for c in all_chunks) / 60:.1f} minutes")
+    print(f"   Total duration: ~{sum(d for _, d in all_chunks) / 60:.1f} minutes")
     print(f"   Output: processed-audio/")
     print()
     print("Next step: Run '2-transcribe-audio.py' to generate transcriptions")
@@ -3,68 +3,813 @@ RunPod Serverless Handler for Coqui TTS
 Optimized for GPU inference with XTTS-v2 model
 """
 
+import time
+PROCESS_START = time.time()  # Cold-start clock starts before the heavy imports
+
 import runpod
 import torch
+import torch.nn.functional as F
 import torchaudio
 from TTS.api import TTS
-import tempfile
+import io
+import queue
+import asyncio
+import threading
+import concurrent.futures
+import wave
 import base64
+import urllib.request
+import urllib.parse
+import ipaddress
+import socket
+import uuid
+import inspect
+import argparse
+import contextlib
 import logging
+import numpy as np
 from pathlib import Path
 import os
 
+try:
+    import boto3
+except ImportError:  # Only needed for object storage transfers
+    boto3 = None
+
+IMPORT_DONE = time.time()
+
+# Cold start: CHECKPOINT_MMAP memory-maps local checkpoints instead of reading them
+# into memory before unpickling, WARMUP runs one dummy inference before the first job
+CHECKPOINT_MMAP = os.environ.get("CHECKPOINT_MMAP", "1") == "1"
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+
+# Inference mode
+# PRECISION: fp32, or fp16/bf16 autocast (fp16 needs CUDA, bf16 also runs on CPU)
+# TORCH_COMPILE: torch.compile the GPT decoder and the HiFiGAN vocoder (compiled during the warmup)
+PRECISION = os.environ.get("PRECISION", "fp32").lower()
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+AUTOCAST_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
 # Patch torch.load to use weights_only=False by default
 # This is needed for XTTS model files with PyTorch 2.6+
+# TTS opens checkpoints itself and passes a file object; mmap needs the path, so local
+# files are loaded by name (torch 2.1+, zip-format checkpoints)
 _original_torch_load = torch.load
-def patched_torch_load(*args, **kwargs):
+_supports_mmap = "mmap" in inspect.signature(_original_torch_load).parameters
+def patched_torch_load(f, *args, **kwargs):
     kwargs.setdefault('weights_only', False)
-    return _original_torch_load(*args, **kwargs)
+    path = f if isinstance(f, (str, Path)) else getattr(f, "name", None)
+    if CHECKPOINT_MMAP and _supports_mmap and isinstance(path, (str, Path)) and os.path.isfile(path):
+        kwargs.setdefault('mmap', True)
+        try:
+            return _original_torch_load(str(path), *args, **kwargs)
+        except RuntimeError as e:
+            # Legacy (non-zip) checkpoints cannot be mapped, run --prepare to convert them
+            logger.warning(f"mmap load failed for {path}, reading it fully: {e}")
+            kwargs.pop('mmap')
+            return _original_torch_load(str(path), *args, **kwargs)
+    return _original_torch_load(f, *args, **kwargs)
 torch.load = patched_torch_load
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Output formats: output_format -> (FFmpeg container, encoder, encoder sample format, media type, extension)
+# Compressed formats are encoded in process with torchaudio's StreamWriter, OUTPUT_BITRATE is the default in kbit/s
+OUTPUT_FORMATS = {
+    "wav": (None, None, None, "audio/wav", "wav"),
+    "mp3": ("mp3", "libmp3lame", "fltp", "audio/mpeg", "mp3"),
+    "opus": ("ogg", "libopus", "flt", "audio/ogg", "opus"),
+    "aac": ("adts", "aac", "fltp", "audio/aac", "aac"),
+}
+OUTPUT_BITRATE_KBPS = int(os.environ.get("OUTPUT_BITRATE", 64))
+MIN_BITRATE_KBPS, MAX_BITRATE_KBPS = 8, 320  # Accepted range for the bitrate input
+ENCODE_BLOCK_SIZE = 65536  # Samples handed to the encoder per write
+
+# Object storage for inputs and outputs by reference
+# Any S3-compatible store works (S3_ENDPOINT_URL for MinIO), credentials come from the
+# usual AWS_* variables. With S3_BUCKET set, outputs estimated above INLINE_AUDIO_MAX_MB
+# are uploaded even if the request did not ask for it; smaller ones stay inline base64
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_OUTPUT_PREFIX = os.environ.get("S3_OUTPUT_PREFIX", "tts-output/")
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", 3600))
+UPLOAD_PART_SIZE = max(5, int(os.environ.get("UPLOAD_PART_MB", 8))) * 1024 * 1024  # S3 minimum part is 5 MB
+INLINE_AUDIO_MAX_BYTES = int(float(os.environ.get("INLINE_AUDIO_MAX_MB", 5)) * 1024 * 1024)
+TRANSFER_TIMEOUT = int(os.environ.get("TRANSFER_TIMEOUT", 60))
+# URLs from job input must be http(s) to a public address (ALLOW_PRIVATE_URLS=1 for
+# an in-network store such as MinIO); downloads stop at INPUT_MAX_MB
+ALLOW_PRIVATE_URLS = os.environ.get("ALLOW_PRIVATE_URLS", "0") == "1"
+INPUT_MAX_BYTES = int(float(os.environ.get("INPUT_MAX_MB", 50)) * 1024 * 1024)
+
+# Concurrency: the worker takes up to MAX_CONCURRENCY jobs at once, growing while free
+# VRAM leaves room for another JOB_VRAM_MB above VRAM_HEADROOM_MB. Sentences from all
+# running jobs are decoded together in micro-batches of up to BATCH_MAX_SIZE sequences,
+# each estimated at BATCH_ITEM_VRAM_MB during GPT decoding
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", 4))
+JOB_VRAM_MB = int(os.environ.get("JOB_VRAM_MB", 1500))
+VRAM_HEADROOM_MB = int(os.environ.get("VRAM_HEADROOM_MB", 1024))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_ITEM_VRAM_MB = int(os.environ.get("BATCH_ITEM_VRAM_MB", 300))
+
 # Global TTS model (loaded once at cold start)
 tts_model = None
 device = None
+s3 = None
+cold_start_timings = {}  # Phase -> seconds, filled by load_model()
+
+def autocast_dtype():
+    """Autocast dtype for PRECISION on this device, None for fp32"""
+    dtype = AUTOCAST_DTYPES.get(PRECISION)
+    if device == "cuda" or (device == "cpu" and dtype == torch.bfloat16):
+        return dtype
+    return None
+
+def inference_context():
+    """torch.inference_mode(), plus autocast when PRECISION asks for it"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    dtype = autocast_dtype()
+    if dtype is not None:
+        stack.enter_context(torch.autocast(device_type=device, dtype=dtype))
+    return stack
+
+def configure_inference(model):
+    """
+    Apply PRECISION and TORCH_COMPILE to the loaded model
+    Weights stay fp32 (autocast picks the precision per op) and the vocoder's output
+    is cast back to float32; torch.compile patches forward in place
+    """
+    xtts = model.synthesizer.tts_model
+    if PRECISION not in ("fp32", *AUTOCAST_DTYPES):
+        logger.warning(f"Unknown PRECISION '{PRECISION}', using fp32")
+    elif PRECISION != "fp32" and autocast_dtype() is None:
+        logger.warning(f"{PRECISION} autocast is not available on {device}, using fp32")
+    
+    if autocast_dtype() is not None:
+        vocoder_forward = xtts.hifigan_decoder.forward
+        xtts.hifigan_decoder.forward = lambda *args, **kwargs: vocoder_forward(*args, **kwargs).float()
+    
+    if TORCH_COMPILE:
+        import torch._dynamo
+        # Anything that fails to compile runs eagerly instead of failing the job
+        torch._dynamo.config.suppress_errors = True
+        # The GPT transformer runs once per generated audio token, the vocoder once per sentence
+        xtts.gpt.gpt.forward = torch.compile(xtts.gpt.gpt.forward, dynamic=True)
+        xtts.hifigan_decoder.forward = torch.compile(xtts.hifigan_decoder.forward, dynamic=True)
+    
+    logger.info(f"Inference mode: {PRECISION if autocast_dtype() else 'fp32'}"
+                f"{' + torch.compile' if TORCH_COMPILE else ''}")
+
+def prepare_checkpoint():
+    """
+    Download the model and re-serialize model.pth with only the weights (zip format)
+    Run at image build time (python handler.py --prepare) so workers start from a
+    baked, memory-mappable checkpoint instead of downloading and unpickling it
+    """
+    from TTS.utils.manage import ModelManager
+    
+    model_dir, _, _ = ModelManager().download_model(MODEL_NAME)
+    checkpoint = os.path.join(model_dir, "model.pth")
+    marker = checkpoint + ".prepared"
+    if os.path.exists(marker):
+        logger.info(f"Checkpoint already prepared: {checkpoint}")
+        return checkpoint
+    
+    start = time.time()
+    state = _original_torch_load(checkpoint, map_location="cpu", weights_only=False)
+    tmp_path = checkpoint + ".tmp"
+    torch.save({"model": state["model"]}, tmp_path)
+    os.replace(tmp_path, checkpoint)
+    Path(marker).touch()
+    logger.info(f"Checkpoint prepared in {time.time() - start:.1f}s: {checkpoint}")
+    return checkpoint
 
 def load_model():
-    """Load TTS model on cold start"""
+    """
+    Load TTS model on cold start (eagerly, before the worker takes jobs)
+    Logs how long each phase took and keeps it in cold_start_timings
+    """
     global tts_model, device
     
     if tts_model is not None:
         return tts_model
     
     logger.info("Loading TTS model...")
+    cold_start_timings["imports"] = IMPORT_DONE - PROCESS_START
     
-    # Check GPU availability
+    # Check GPU availability (this also initializes the CUDA context)
+    start = time.time()
     if torch.cuda.is_available():
         device = "cuda"
+        torch.cuda.init()
         logger.info(f"GPU detected: {torch.cuda.get_device_name(0)}")
     else:
         device = "cpu"
         logger.warning("No GPU detected, using CPU (will be slow)")
+    cold_start_timings["cuda_init"] = time.time() - start
     
-    # Load XTTS-v2 model
-    tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+    # Load XTTS-v2 model (memory-mapped checkpoint, see patched_torch_load)
+    start = time.time()
+    model = TTS(MODEL_NAME)
+    cold_start_timings["load"] = time.time() - start
+    
+    start = time.time()
+    model = model.to(device)
+    configure_inference(model)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    cold_start_timings["to_device"] = time.time() - start
+    
+    # One short inference so CUDA kernels, cuBLAS handles and the allocator
+    # (and torch.compile's graphs) are set up before the first real job instead of during it
+    if WARMUP:
+        start = time.time()
+        with inference_context():
+            synthesize(model, "Warming up.", "en", 1.0)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        cold_start_timings["warmup"] = time.time() - start
+    
+    cold_start_timings["total"] = time.time() - PROCESS_START
+    tts_model = model
     logger.info("TTS model loaded successfully")
+    logger.info("Cold start: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in cold_start_timings.items()))
     
     return tts_model
 
-def handler(event):
+def speaker_latents(model, speaker_wav=None, speaker="Claribel Dervla"):
+    """Conditioning latents from a reference (speaker_wav may be a file object) or a built-in speaker"""
+    xtts = model.synthesizer.tts_model
+    config = xtts.config
+    
+    if speaker_wav is not None:
+        gpt_cond_latent, speaker_embedding = xtts.get_conditioning_latents(
+            audio_path=[speaker_wav],
+            gpt_cond_len=config.gpt_cond_len,
+            gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+            max_ref_length=config.max_ref_len,
+            sound_norm_refs=config.sound_norm_refs
+        )
+    else:
+        latents = xtts.speaker_manager.speakers[speaker]
+        gpt_cond_latent, speaker_embedding = latents["gpt_cond_latent"], latents["speaker_embedding"]
+    return gpt_cond_latent.to(xtts.device), speaker_embedding.to(xtts.device)
+
+def inference_settings(model):
+    """Sampling settings XTTS uses for tts_to_file, taken from the model config"""
+    config = model.synthesizer.tts_model.config
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p
+    }
+
+def synthesize(model, text, language, speed, speaker_wav=None, speaker="Claribel Dervla"):
+    """
+    Run XTTS fully in memory, one sentence after another (used for the warmup)
+    Conditioning latents are computed once, then each sentence is synthesized like
+    tts_to_file does, with the same silence in between
+    Returns a float32 waveform at the model's output sample rate
+    """
+    xtts = model.synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = speaker_latents(model, speaker_wav, speaker)
+    settings = dict(inference_settings(model), speed=speed)
+    
+    pieces = []
+    silence = np.zeros(10000, dtype=np.float32)
+    for sentence in model.synthesizer.split_into_sentences(text):
+        wav = xtts.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)["wav"]
+        if torch.is_tensor(wav):
+            wav = wav.cpu().numpy()
+        pieces += [np.asarray(wav, dtype=np.float32).squeeze(), silence]
+    
+    return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+def free_vram_mb():
+    """Free VRAM, counting memory PyTorch's allocator has reserved but is not using"""
+    free_bytes, _ = torch.cuda.mem_get_info()
+    cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    return (free_bytes + cached) / (1024 * 1024)
+
+def concurrency_modifier(current_concurrency):
+    """
+    How many jobs RunPod may hand this worker at once
+    Grows by one while another job's working set fits in free VRAM, backs off by one
+    when free VRAM drops under the headroom. CPU workers take one job at a time
+    """
+    if device != "cuda":
+        return 1
+    
+    free_mb = free_vram_mb()
+    if free_mb < VRAM_HEADROOM_MB:
+        target = current_concurrency - 1
+    elif free_mb > VRAM_HEADROOM_MB + JOB_VRAM_MB:
+        target = current_concurrency + 1
+    else:
+        target = current_concurrency
+    return max(1, min(MAX_CONCURRENCY, target))
+
+def micro_batch_size():
+    """Number of sentences to decode together, limited by free VRAM"""
+    if device != "cuda":
+        return BATCH_MAX_SIZE
+    return max(1, min(BATCH_MAX_SIZE, int(free_vram_mb() // BATCH_ITEM_VRAM_MB)))
+
+def batch_decode(model, items):
+    """
+    Decode sentences from any number of jobs as one padded GPT batch
+    
+    Each item brings its own language, speaker latents and speed. The autoregressive
+    GPT decoding (the expensive part) runs batched; each sequence is then trimmed at
+    its first stop token and vocoded on its own, exactly like Xtts.inference does.
+    Returns one float32 waveform per item
+    """
+    xtts = model.synthesizer.tts_model
+    gpt = xtts.gpt
+    settings = inference_settings(model)
+    
+    tokens = [
+        torch.IntTensor(
+            xtts.tokenizer.encode(item["sentence"].strip().lower(), lang=item["language"].split("-")[0])
+        ).to(xtts.device)
+        for item in items
+    ]
+    max_len = max(t.shape[-1] for t in tokens)
+    text_inputs = torch.full((len(items), max_len), gpt.stop_text_token, dtype=torch.int32, device=xtts.device)
+    for row, t in enumerate(tokens):
+        text_inputs[row, :t.shape[-1]] = t
+    
+    codes = gpt.generate(
+        cond_latents=torch.cat([item["latents"][0] for item in items]),
+        text_inputs=text_inputs,
+        input_tokens=None,
+        do_sample=True,
+        top_p=settings["top_p"],
+        top_k=settings["top_k"],
+        temperature=settings["temperature"],
+        num_return_sequences=1,
+        num_beams=1,
+        length_penalty=settings["length_penalty"],
+        repetition_penalty=settings["repetition_penalty"],
+        output_attentions=False
+    )
+    
+    wavs = []
+    for row, (item, t) in enumerate(zip(items, tokens)):
+        gpt_cond_latent, speaker_embedding = item["latents"]
+        seq = codes[row:row + 1]
+        stops = (seq[0] == gpt.stop_audio_token).nonzero()
+        if len(stops) > 0:
+            seq = seq[:, :int(stops[0]) + 1]
+        text_tokens = t.unsqueeze(0)
+        gpt_latents = gpt(
+            text_tokens,
+            torch.tensor([text_tokens.shape[-1]], device=xtts.device),
+            seq,
+            torch.tensor([seq.shape[-1] * gpt.code_stride_len], device=xtts.device),
+            cond_latents=gpt_cond_latent,
+            return_attentions=False,
+            return_latent=True
+        )
+        # Speed works like in Xtts.inference: stretch the latents before the vocoder
+        length_scale = 1.0 / max(item["speed"], 0.05)
+        if length_scale != 1.0:
+            gpt_latents = F.interpolate(
+                gpt_latents.transpose(1, 2), scale_factor=length_scale, mode="linear"
+            ).transpose(1, 2)
+        wav = xtts.hifigan_decoder(gpt_latents, g=speaker_embedding)
+        wavs.append(wav.cpu().numpy().astype(np.float32).squeeze())
+    return wavs
+
+def decode_one(model, item):
+    """Single-sentence fallback through Xtts.inference"""
+    gpt_cond_latent, speaker_embedding = item["latents"]
+    wav = model.synthesizer.tts_model.inference(
+        item["sentence"], item["language"], gpt_cond_latent, speaker_embedding,
+        speed=item["speed"], **inference_settings(model)
+    )["wav"]
+    if torch.is_tensor(wav):
+        wav = wav.cpu().numpy()
+    return np.asarray(wav, dtype=np.float32).squeeze()
+
+class InferenceLoop:
+    """
+    One GPU thread shared by every running job
+    
+    Jobs queue their sentences (each with its own speaker latents) and other GPU work
+    such as conditioning. The thread takes whatever is waiting, up to micro_batch_size()
+    sentences, and decodes it as one batch, so concurrent jobs fill the GPU together
+    instead of taking turns. Results come back through concurrent futures.
+    """
+    
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.histogram = {}
+    
+    def submit(self, kind, payload):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="tts-inference", daemon=True)
+                self.thread.start()
+        future = concurrent.futures.Future()
+        self.queue.put((kind, payload, future))
+        return future
+    
+    def call(self, fn, *args):
+        """Run fn(*args) on the inference thread"""
+        return self.submit("call", (fn, args))
+    
+    def decode(self, sentence, language, latents, speed):
+        """Queue one sentence for batched decoding, the future resolves to its waveform"""
+        return self.submit("decode", {"sentence": sentence, "language": language, "latents": latents, "speed": speed})
+    
+    def run(self):
+        while True:
+            batch = []
+            kind, payload, future = self.queue.get()
+            limit = micro_batch_size()
+            while True:
+                if kind == "call":
+                    self.run_call(payload, future)
+                else:
+                    batch.append((payload, future))
+                if len(batch) >= limit:
+                    break
+                try:
+                    kind, payload, future = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.run_batch(batch)
+    
+    def run_call(self, payload, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        fn, args = payload
+        try:
+            with inference_context():
+                future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+    
+    def run_batch(self, batch):
+        # Sentences of jobs that failed or were cancelled in the meantime are skipped
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self.batches += 1
+        self.histogram[len(batch)] = self.histogram.get(len(batch), 0) + 1
+        
+        with inference_context():
+            try:
+                wavs = batch_decode(tts_model, [item for item, _ in batch])
+            except Exception as e:
+                logger.warning(f"Batched decoding failed ({e}), falling back to per-sentence inference")
+                if device == "cuda":
+                    torch.cuda.empty_cache()
+                wavs = None
+            
+            for index, (item, future) in enumerate(batch):
+                try:
+                    future.set_result(wavs[index] if wavs is not None else decode_one(tts_model, item))
+                except Exception as e:
+                    future.set_exception(e)
+    
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.histogram.items())},
+            "waiting": self.queue.qsize()
+        }
+
+inference_loop = InferenceLoop()
+
+def write_wav(target, wav, sample_rate):
+    """
+    Peak-normalize (as tts_to_file does) and write 16-bit mono WAV to a file object
+    The frame count is set up front so the header is never patched, target only needs write() and flush()
     """
-    RunPod serverless handler
+    peak = max(0.01, float(np.abs(wav).max()) if len(wav) else 0.0)
+    
+    with wave.open(target, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.setnframes(len(wav))
+        for start in range(0, len(wav), ENCODE_BLOCK_SIZE):
+            block = wav[start:start + ENCODE_BLOCK_SIZE]
+            wav_file.writeframesraw((np.clip(block / peak, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+
+def parse_bitrate(bitrate):
+    """Validate a bitrate input in kbit/s (64, "64" or 64.0), returns an int or raises ValueError"""
+    if bitrate is None or bitrate == "":
+        return OUTPUT_BITRATE_KBPS
+    try:
+        value = float(bitrate)
+    except (TypeError, ValueError):
+        raise ValueError(f"bitrate must be a number of kbit/s, got '{bitrate}'")
+    if not value.is_integer() or not MIN_BITRATE_KBPS <= value <= MAX_BITRATE_KBPS:
+        raise ValueError(f"bitrate must be a whole number between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbit/s")
+    return int(value)
+
+def write_compressed(target, wav, sample_rate, output_format, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Peak-normalize like write_wav and encode MP3/Opus/AAC to a file object, block by block"""
+    from torchaudio.io import StreamWriter
+    
+    container, encoder, encoder_format, _, _ = OUTPUT_FORMATS[output_format]
+    peak = max(0.01, float(np.abs(wav).max()) if len(wav) else 0.0)
+    
+    writer = StreamWriter(target, format=container)
+    writer.add_audio_stream(
+        sample_rate, 1,
+        format="flt",
+        encoder=encoder,
+        encoder_format=encoder_format,
+        encoder_option={"b": str(int(bitrate_kbps) * 1000)}
+    )
+    with writer.open():
+        for start in range(0, len(wav), ENCODE_BLOCK_SIZE):
+            block = np.clip(wav[start:start + ENCODE_BLOCK_SIZE] / peak, -1.0, 1.0).astype(np.float32)
+            writer.write_audio_chunk(0, torch.from_numpy(block).unsqueeze(1))
+
+class EncodedChunks:
+    """Write target that hands encoded bytes over as soon as they are written"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+class StreamingEncoder:
+    """
+    Compressed encoder kept open across streamed chunks
+    write() returns the bytes encoded so far and close() flushes the rest, so the
+    chunks a client receives concatenate into one valid file
+    """
+    
+    def __init__(self, output_format, sample_rate, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+        from torchaudio.io import StreamWriter
+        
+        container, encoder, encoder_format, _, _ = OUTPUT_FORMATS[output_format]
+        self.sink = EncodedChunks()
+        self.writer = StreamWriter(self.sink, format=container)
+        self.writer.add_audio_stream(
+            sample_rate, 1,
+            format="flt",
+            encoder=encoder,
+            encoder_format=encoder_format,
+            encoder_option={"b": str(int(bitrate_kbps) * 1000)}
+        )
+        self.writer.open()
+    
+    def write(self, audio):
+        block = np.clip(audio, -1.0, 1.0).astype(np.float32)
+        self.writer.write_audio_chunk(0, torch.from_numpy(block).unsqueeze(1))
+        return self.sink.take()
+    
+    def close(self):
+        self.writer.flush()
+        self.writer.close()
+        return self.sink.take()
+
+def write_audio(target, wav, sample_rate, output_format="wav", bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    if output_format == "wav":
+        write_wav(target, wav, sample_rate)
+    else:
+        write_compressed(target, wav, sample_rate, output_format, bitrate_kbps)
+
+def encode_audio(wav, sample_rate, output_format="wav", bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Encoded output as bytes (inline base64 and presigned PUT)"""
+    buffer = io.BytesIO()
+    write_audio(buffer, wav, sample_rate, output_format, bitrate_kbps)
+    return buffer.getvalue()
+
+def estimated_size(num_samples, sample_rate, output_format, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Encoded size in bytes, known before encoding (used to decide inline vs object storage)"""
+    if output_format == "wav":
+        return 44 + num_samples * 2
+    return int(num_samples / sample_rate * bitrate_kbps * 1000 / 8)
+
+def get_s3():
+    """S3 client for S3_BUCKET, created on first use"""
+    global s3
+    
+    if s3 is None:
+        if boto3 is None:
+            raise RuntimeError("boto3 is required for object storage transfers")
+        if not S3_BUCKET:
+            raise RuntimeError("S3_BUCKET is not set")
+        s3 = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL)
+    return s3
+
+class MultipartUpload:
+    """
+    Write-only file object that streams into an S3 multipart upload
+    A part is sent as soon as UPLOAD_PART_SIZE bytes are buffered, so the encoder's
+    output never has to fit in memory as a whole
+    """
+    
+    def __init__(self, key, content_type):
+        self.key = key
+        self.upload_id = get_s3().create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=content_type
+        )["UploadId"]
+        self.parts = []
+        self.buffer = bytearray()
+        self.size = 0
+    
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= UPLOAD_PART_SIZE:
+            self.upload_part(bytes(self.buffer[:UPLOAD_PART_SIZE]))
+            del self.buffer[:UPLOAD_PART_SIZE]
+        return len(data)
+    
+    def flush(self):
+        # Parts only go out at UPLOAD_PART_SIZE (S3 minimum), the rest waits for complete()
+        pass
+    
+    def upload_part(self, data):
+        number = len(self.parts) + 1
+        response = get_s3().upload_part(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+    
+    def complete(self):
+        # The last part may be smaller than the minimum (or the only, empty part)
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        get_s3().complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+    
+    def abort(self):
+        get_s3().abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+
+def upload_audio(key, wav, sample_rate, output_format, bitrate_kbps=OUTPUT_BITRATE_KBPS):
+    """Encode straight into a multipart upload, returns the object size in bytes"""
+    upload = MultipartUpload(key, OUTPUT_FORMATS[output_format][3])
+    try:
+        write_audio(upload, wav, sample_rate, output_format, bitrate_kbps)
+        upload.complete()
+    except Exception:
+        upload.abort()
+        raise
+    return upload.size
+
+def check_url(url):
+    """
+    Raise ValueError unless url is http(s) to a host that resolves to public addresses
+    Keeps job input from reading local files (file://) or reaching internal and metadata hosts
+    """
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("Only http(s) URLs are accepted")
+    if ALLOW_PRIVATE_URLS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 443)}
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve {parsed.hostname}: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global:
+            raise ValueError(f"{parsed.hostname} resolves to a non-public address")
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Apply check_url to every redirect target too"""
+    
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+url_opener = urllib.request.build_opener(CheckedRedirectHandler)
+
+def put_presigned(url, data, content_type):
+    """Upload bytes to a presigned PUT URL (single request, presigned PUTs cannot be multipart)"""
+    check_url(url)
+    request = urllib.request.Request(
+        url, data=data, method="PUT",
+        headers={"Content-Type": content_type, "Content-Length": str(len(data))}
+    )
+    with url_opener.open(request, timeout=TRANSFER_TIMEOUT) as response:
+        response.read()
+
+def fetch_input(url=None, key=None):
+    """
+    Download an input by reference (presigned or plain URL, or a key in S3_BUCKET) into memory
+    Raises ValueError for a rejected URL or anything larger than INPUT_MAX_MB
+    """
+    too_large = ValueError(f"Input is larger than {INPUT_MAX_BYTES // (1024 * 1024)} MB")
+    buffer = io.BytesIO()
+    if url:
+        check_url(url)
+        with url_opener.open(url, timeout=TRANSFER_TIMEOUT) as response:
+            if int(response.headers.get("Content-Length") or 0) > INPUT_MAX_BYTES:
+                raise too_large
+            # Content-Length can be absent or wrong, so count what is actually read
+            while True:
+                block = response.read(1024 * 1024)
+                if not block:
+                    break
+                buffer.write(block)
+                if buffer.tell() > INPUT_MAX_BYTES:
+                    raise too_large
+    else:
+        s3 = get_s3()
+        if s3.head_object(Bucket=S3_BUCKET, Key=key)["ContentLength"] > INPUT_MAX_BYTES:
+            raise too_large
+        s3.download_fileobj(S3_BUCKET, key, buffer)
+    buffer.seek(0)
+    return buffer
+
+def deliver(event, wav, sample_rate, output_format, bitrate, output_url=None, output_key=None, inline=True):
+    """
+    Encode the finished waveform and hand it over: presigned PUT, multipart upload to
+    S3_BUCKET, or inline base64 (skipped when inline is False, e.g. after streaming)
+    Returns the fields to add to the job result
+    """
+    _, _, _, media_type, extension = OUTPUT_FORMATS[output_format]
+    result = {}
+    
+    # Too large to return inline: send it to the bucket when one is configured
+    if not (output_url or output_key) and inline and S3_BUCKET and \
+            estimated_size(len(wav), sample_rate, output_format, bitrate) > INLINE_AUDIO_MAX_BYTES:
+        output_key = f"{S3_OUTPUT_PREFIX}{event.get('id') or uuid.uuid4().hex}.{extension}"
+    
+    if output_url:
+        # Presigned PUT: one request with a known length, compressed output keeps it small
+        audio = encode_audio(wav, sample_rate, output_format, bitrate)
+        put_presigned(output_url, audio, media_type)
+        result.update({"audio_url": output_url.split("?", 1)[0], "bytes": len(audio)})
+    elif output_key:
+        # Encoder output streams into a multipart upload, part by part
+        size = upload_audio(output_key, wav, sample_rate, output_format, bitrate)
+        result.update({
+            "audio_key": output_key,
+            "bucket": S3_BUCKET,
+            "bytes": size,
+            "audio_url": get_s3().generate_presigned_url(
+                "get_object",
+                Params={"Bucket": S3_BUCKET, "Key": output_key},
+                ExpiresIn=PRESIGNED_URL_EXPIRY
+            )
+        })
+    elif inline:
+        # Small payloads: encode straight from the waveform to base64
+        result["audio_base64"] = base64.b64encode(
+            encode_audio(wav, sample_rate, output_format, bitrate)
+        ).decode("utf-8")
+    
+    if "bytes" in result:
+        logger.info(f"Audio uploaded: {result['bytes']} bytes ({output_format})")
+    return result
+
+async def handler(event):
+    """
+    RunPod serverless handler (async generator, several jobs run at once)
     
     Expected input format:
     {
         "input": {
             "text": "Text to synthesize",
-            "voice_file_base64": "base64_encoded_audio",  # Optional
+            "voice_file_base64": "base64_encoded_audio",  # Optional, small references only
+            "voice_file_url": "https://...",  # Optional, presigned GET URL instead of base64
+            "voice_file_key": "voices/narrator.wav",  # Optional, object in S3_BUCKET instead of base64
             "language": "en",  # Optional, default "en"
-            "speed": 1.0  # Optional, default 1.0
+            "speed": 1.0,  # Optional, default 1.0
+            "output_url": "https://...",  # Optional, presigned PUT URL for the result
+            "output_key": "chapters/12.mp3",  # Optional, object in S3_BUCKET (streamed multipart upload)
+            "output_format": "wav",  # Optional, "wav", "mp3", "opus" or "aac" (default "wav", "mp3" by reference)
+            "bitrate": 64,  # Optional, kbit/s for compressed formats (8-320)
+            "stream": false  # Optional, yield each sentence's audio as soon as it is decoded
         }
     }
+    
+    The last output is the result: audio_base64 inline, or audio_url/audio_key (and size
+    in bytes) when the output went to object storage. With stream enabled, earlier outputs
+    are chunks ({"chunk", "audio_base64", "format", "sample_rate"}) that concatenate into
+    one file (raw 16-bit PCM for wav), and the result carries no inline audio. Streamed
+    chunks are clipped, not peak-normalized, since the peak of the whole text is not known yet
     """
     try:
         # Load model if not already loaded
@@ -74,87 +819,115 @@ def handler(event):
         input_data = event.get("input", {})
         text = input_data.get("text")
         voice_file_base64 = input_data.get("voice_file_base64")
+        voice_file_url = input_data.get("voice_file_url")
+        voice_file_key = input_data.get("voice_file_key")
         language = input_data.get("language", "en")
         speed = input_data.get("speed", 1.0)
+        output_url = input_data.get("output_url")
+        output_key = input_data.get("output_key")
+        by_reference = bool(output_url or output_key)
+        output_format = str(input_data.get("output_format") or ("mp3" if by_reference else "wav")).lower()
+        bitrate = input_data.get("bitrate")
+        stream = bool(input_data.get("stream", False))
         
         if not text:
-            return {"error": "Text is required"}
+            yield {"error": "Text is required"}
+            return
         
-        logger.info(f"Generating TTS for text: {text[:50]}...")
+        if output_format not in OUTPUT_FORMATS:
+            yield {"error": f"Unsupported output_format '{output_format}' (use {', '.join(OUTPUT_FORMATS)})"}
+            return
         
-        # Handle voice reference if provided
-        speaker_wav = None
-        if voice_file_base64:
+        try:
+            bitrate = parse_bitrate(bitrate)
+        except ValueError as e:
+            yield {"error": str(e)}
+            return
+        
+        if output_url:
             try:
-                # Decode base64 audio
-                audio_bytes = base64.b64decode(voice_file_base64)
-                
-                # Save to temp file
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_voice:
-                    temp_voice.write(audio_bytes)
-                    speaker_wav = temp_voice.name
-                    
-                logger.info(f"Voice reference saved to {speaker_wav}")
-            except Exception as e:
-                logger.error(f"Error processing voice file: {e}")
-                return {"error": f"Invalid voice file: {str(e)}"}
+                check_url(output_url)
+            except ValueError as e:
+                yield {"error": f"Invalid output_url: {e}"}
+                return
         
-        # Generate audio
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_output:
-            output_path = temp_output.name
+        logger.info(f"Generating TTS for text: {text[:50]}...")
         
+        # Handle voice reference if provided (kept in memory, never written to disk)
+        speaker_wav = None
         try:
-            if speaker_wav:
-                # Clone voice
-                model.tts_to_file(
-                    text=text,
-                    speaker_wav=speaker_wav,
-                    language=language,
-                    file_path=output_path,
-                    speed=speed
-                )
-            else:
-                # Use default speaker (XTTS requires a speaker name for multi-speaker models)
-                model.tts_to_file(
-                    text=text,
-                    language=language,
-                    file_path=output_path,
-                    speed=speed,
-                    speaker="Claribel Dervla"  # Default female voice
-                )
-            
-            logger.info(f"Audio generated successfully: {output_path}")
+            if voice_file_url or voice_file_key:
+                speaker_wav = await asyncio.to_thread(fetch_input, url=voice_file_url, key=voice_file_key)
+                logger.info(f"Voice reference downloaded: {len(speaker_wav.getbuffer())} bytes")
+            elif voice_file_base64:
+                speaker_wav = io.BytesIO(base64.b64decode(voice_file_base64))
+                logger.info(f"Voice reference decoded: {len(speaker_wav.getbuffer())} bytes")
+        except Exception as e:
+            logger.error(f"Error processing voice file: {e}")
+            yield {"error": f"Invalid voice file: {str(e)}"}
+            return
+        
+        try:
+            # Clone voice, or use default speaker (XTTS requires a speaker name for multi-speaker models)
+            # All GPU work goes through the shared inference loop, batched with other running jobs
+            sample_rate = model.synthesizer.output_sample_rate
+            latents = await asyncio.wrap_future(inference_loop.call(speaker_latents, model, speaker_wav))
+            futures = [
+                inference_loop.decode(sentence, language, latents, speed)
+                for sentence in model.synthesizer.split_into_sentences(text)
+            ]
             
-            # Read generated audio and encode to base64
-            with open(output_path, "rb") as audio_file:
-                audio_base64 = base64.b64encode(audio_file.read()).decode("utf-8")
+            encoder = StreamingEncoder(output_format, sample_rate, bitrate) if stream and output_format != "wav" else None
+            pieces = []
+            silence = np.zeros(10000, dtype=np.float32)
+            try:
+                for index, future in enumerate(futures):
+                    pieces += [await asyncio.wrap_future(future), silence]
+                    if not stream:
+                        continue
+                    
+                    chunk = np.concatenate(pieces[-2:])
+                    if encoder:
+                        data = encoder.write(chunk)
+                        if index == len(futures) - 1:
+                            data += encoder.close()
+                    else:
+                        data = (np.clip(chunk, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+                    if data:
+                        yield {
+                            "chunk": index,
+                            "audio_base64": base64.b64encode(data).decode("utf-8"),
+                            "format": output_format if encoder else "pcm_s16le",
+                            "sample_rate": sample_rate
+                        }
+            finally:
+                # Failed or abandoned job: do not decode its remaining sentences
+                for future in futures:
+                    future.cancel()
             
-            # Clean up temp files
-            if speaker_wav and os.path.exists(speaker_wav):
-                os.remove(speaker_wav)
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            wav = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+            logger.info(f"Audio generated successfully: {len(wav) / sample_rate:.1f}s")
             
-            return {
-                "audio_base64": audio_base64,
-                "format": "wav",
-                "sample_rate": 24000,
+            result = {
+                "format": output_format,
+                "sample_rate": sample_rate,
                 "language": language
             }
+            if stream:
+                result["chunks"] = len(futures)
+            result.update(await asyncio.to_thread(
+                deliver, event, wav, sample_rate, output_format, bitrate,
+                output_url, output_key, not stream
+            ))
+            yield result
             
         except Exception as e:
             logger.error(f"TTS generation error: {e}")
-            # Clean up on error
-            if speaker_wav and os.path.exists(speaker_wav):
-                os.remove(speaker_wav)
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            return {"error": f"TTS generation failed: {str(e)}"}
+            yield {"error": f"TTS generation failed: {str(e)}"}
         
     except Exception as e:
         logger.error(f"Handler error: {e}")
-        return {"error": str(e)}
+        yield {"error": str(e)}
 
 # Health check handler
 def health_handler(event):
@@ -165,11 +938,28 @@ def health_handler(event):
         "status": "healthy",
         "model_loaded": tts_model is not None,
         "device": device if device else "not initialized",
-        "gpu_available": torch.cuda.is_available()
+        "gpu_available": torch.cuda.is_available(),
+        "cold_start": {phase: round(seconds, 3) for phase, seconds in cold_start_timings.items()},
+        "inference_loop": inference_loop.stats(),
+        "inference_mode": {"precision": PRECISION, "compile": TORCH_COMPILE}
     }
 
-# RunPod serverless entry point
-runpod.serverless.start({
-    "handler": handler,
-    "health": health_handler
-})
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prepare", action="store_true", help="Download and re-serialize the checkpoint, then exit")
+    args, _ = parser.parse_known_args()  # RunPod passes its own flags (--rp_serve_api etc.)
+    
+    if args.prepare:
+        prepare_checkpoint()
+    else:
+        # Load before taking jobs so the first request does not pay for the cold start
+        load_model()
+        
+        # RunPod serverless entry point
+        # Generator outputs are aggregated, so /runsync returns them as a list (result last)
+        runpod.serverless.start({
+            "handler": handler,
+            "health": health_handler,
+            "concurrency_modifier": concurrency_modifier,
+            "return_aggregate_stream": True
+        })
@@ -0,0 +1,67 @@
+"""
+Throughput benchmark: /generate-audio-batch vs sequential /generate-audio
+Run against a running coqui-server-production.py:
+
+    python scripts/bench-coqui-batch.py --url http://localhost:8000 --voice narrator-reference.wav --count 24
+"""
+
+import argparse
+import io
+import time
+import zipfile
+
+import requests
+
+SAMPLE_SENTENCES = [
+    "The rain had not stopped for three days.",
+    "She folded the letter twice and slid it under the door.",
+    "Nobody in the village remembered who built the old bridge.",
+    "He counted the steps to the cellar, just as his father had.",
+    "By morning the river had swallowed the road entirely.",
+    "A single lamp burned in the window of the lighthouse.",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--voice", default="narrator-reference.wav", help="Reference WAV for cloning")
+    parser.add_argument("--count", type=int, default=24, help="Number of texts to generate")
+    args = parser.parse_args()
+
+    texts = [SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)] for i in range(args.count)]
+    with open(args.voice, "rb") as f:
+        voice = f.read()
+
+    print("=" * 60)
+    print(f"Batch benchmark: {args.count} texts against {args.url}")
+    print("=" * 60)
+
+    # Sequential single requests
+    start = time.time()
+    for text in texts:
+        response = requests.post(
+            f"{args.url}/generate-audio",
+            data={"text": text},
+            files={"speaker_wav": ("voice.wav", voice, "audio/wav")},
+        )
+        response.raise_for_status()
+    sequential_time = time.time() - start
+    print(f"Sequential /generate-audio:  {sequential_time:7.2f}s  ({args.count / sequential_time:.2f} texts/s)")
+
+    # One batched request
+    start = time.time()
+    response = requests.post(
+        f"{args.url}/generate-audio-batch",
+        data={"texts": texts},
+        files={"speaker_wav": ("voice.wav", voice, "audio/wav")},
+    )
+    response.raise_for_status()
+    batch_time = time.time() - start
+    outputs = len([n for n in zipfile.ZipFile(io.BytesIO(response.content)).namelist() if n.endswith(".wav")])
+    print(f"Batched /generate-audio-batch: {batch_time:5.2f}s  ({args.count / batch_time:.2f} texts/s, {outputs} files)")
+
+    print(f"\nSpeedup: {sequential_time / batch_time:.2f}x")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+CPU real-time-factor benchmark for coqui-server.py's CPU fast path
+Each mode runs in a fresh process with CUDA hidden and the sentence cache disabled
+
+baseline: torch's default threads, fp32
+threads:  torch pinned to the physical cores
+int8:     threads + dynamic int8 quantization of the GPT decoder
+int8+onnx: int8 + the vocoder in ONNX Runtime (needs onnxruntime)
+
+Decoding is greedy (top_k=1) so the log-spectral distance to the baseline shows
+what quantization costs in quality. RTF is synthesis time / audio duration
+(below 1.0 is faster than real time). --max-rtf fails the run (exit status 1)
+when a mode is slower, so it can gate CI:
+
+    python scripts/bench-cpu-rtf.py
+    python scripts/bench-cpu-rtf.py --modes int8 --max-rtf 2.5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from scipy import signal
+
+SAMPLE_RATE = 24000
+TEXTS = [
+    "The rain had not stopped for three days.",
+    "She folded the letter twice and slid it under the door, then waited in the hall.",
+]
+
+MODES = {
+    "baseline": {"XTTS_CPU_THREADS": str(os.cpu_count() or 1), "XTTS_CPU_QUANTIZE": "false", "XTTS_CPU_ONNX_VOCODER": "false"},
+    "threads": {"XTTS_CPU_QUANTIZE": "false", "XTTS_CPU_ONNX_VOCODER": "false"},
+    "int8": {"XTTS_CPU_QUANTIZE": "true", "XTTS_CPU_ONNX_VOCODER": "false"},
+    "int8+onnx": {"XTTS_CPU_QUANTIZE": "true", "XTTS_CPU_ONNX_VOCODER": "true"},
+}
+
+CHILD = """
+import importlib.util, json, sys, time
+import numpy as np
+import torch
+
+spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(server)
+
+tts = server.get_tts_model()
+tts.synthesizer.tts_model.config.top_k = 1
+texts, out = json.loads(sys.argv[1]), sys.argv[2]
+
+def render(text):
+    return np.concatenate(list(server.synthesize_sentences(tts, text, "en", 1.0, speaker_name="Claribel Dervla")))
+
+render(texts[0])  # Warmup
+results = []
+for index, text in enumerate(texts):
+    start = time.time()
+    audio = render(text)
+    results.append({"seconds": time.time() - start, "duration": len(audio) / tts.synthesizer.output_sample_rate})
+    np.save(f"{out}/{index}.npy", audio)
+print("RESULT " + json.dumps({"threads": torch.get_num_threads(), "texts": results}))
+"""
+
+def run_mode(mode, out_dir):
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="", XTTS_SENTENCE_CACHE_MB="0", XTTS_PRECISION="fp32", **MODES[mode])
+    if mode != "baseline":
+        env.pop("XTTS_CPU_THREADS", None)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(TEXTS), out_dir],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+    ).stdout
+    line = next(l for l in output.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+def log_spectral_distance(reference, test):
+    """Mean over frames of the RMS difference of the log power spectra, in dB"""
+    n = min(len(reference), len(test))
+    _, _, ref = signal.stft(reference[:n], fs=SAMPLE_RATE, nperseg=1024)
+    _, _, tst = signal.stft(test[:n], fs=SAMPLE_RATE, nperseg=1024)
+    ref_db = 10 * np.log10(np.abs(ref) ** 2 + 1e-10)
+    tst_db = 10 * np.log10(np.abs(tst) ** 2 + 1e-10)
+    return float(np.mean(np.sqrt(np.mean((ref_db - tst_db) ** 2, axis=0))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated, from {', '.join(MODES)}")
+    parser.add_argument("--max-rtf", type=float, default=None, help="Exit with status 1 if any mode is slower")
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(",") if m]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(unknown)}")
+
+    print("=" * 60)
+    print(f"CPU real-time factor: {', '.join(modes)} ({os.cpu_count()} logical CPUs)")
+    print("=" * 60)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            out_dir = os.path.join(tmp, mode)
+            os.makedirs(out_dir)
+            result = run_mode(mode, out_dir)
+            texts = result["texts"]
+            rtf = sum(r["seconds"] for r in texts) / sum(r["duration"] for r in texts)
+
+            quality = ""
+            if mode != "baseline" and os.path.isdir(os.path.join(tmp, "baseline")):
+                lsd = max(
+                    log_spectral_distance(
+                        np.load(os.path.join(tmp, "baseline", f"{i}.npy")),
+                        np.load(os.path.join(out_dir, f"{i}.npy"))
+                    )
+                    for i in range(len(TEXTS))
+                )
+                quality = f"  LSD vs baseline {lsd:5.2f} dB"
+
+            print(f"{mode:<10} {result['threads']:3d} threads  RTF {rtf:6.2f}{quality}")
+            if args.max_rtf is not None and rtf > args.max_rtf:
+                failed = True
+
+    print("=" * 60)
+    if failed:
+        print(f"FAILED: real-time factor above {args.max_rtf}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Mastering benchmark: in-process NumPy/SciPy chain vs the old ffmpeg subprocess
+Also checks loudness accuracy against the -16 LUFS target
+
+Run from the repo root in the Coqui server environment (ffmpeg optional):
+
+    python scripts/bench-mastering.py --seconds 60
+"""
+
+import argparse
+import importlib.util
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 24000
+TARGET_LUFS = -16.0
+FFMPEG_FILTER = (
+    'highpass=f=120,'
+    'equalizer=f=4500:t=q:w=2:g=3,'
+    'acompressor=threshold=-20dB:ratio=1.5:attack=5:release=50,'
+    'loudnorm=I=-16:TP=-1.5:LRA=11'
+)
+
+def load_server():
+    spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def speech_like(seconds):
+    """Noise shaped into syllable-length bursts with pauses, roughly speech dynamics"""
+    rng = np.random.RandomState(0)
+    envelope = np.repeat(rng.rand(seconds * 10) ** 2, SAMPLE_RATE // 10)
+    return (rng.randn(len(envelope)) * envelope * 0.3).astype(np.float32)
+
+def write_wav(path, audio):
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        frames = wav_file.readframes(wav_file.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = load_server()
+    audio = speech_like(args.seconds)
+
+    print("=" * 60)
+    print(f"Mastering benchmark: {args.seconds}s of audio, {args.runs} runs")
+    print("=" * 60)
+
+    # Sanity check for the meter: a 997Hz sine at -20dBFS peak measures -23.01 LUFS
+    t = np.arange(SAMPLE_RATE * 5) / SAMPLE_RATE
+    sine = 0.1 * np.sin(2 * np.pi * 997 * t)
+    print(f"Meter check (997Hz, -20dBFS): {server.measure_loudness(sine, SAMPLE_RATE):.2f} LUFS (expected -23.01)")
+
+    start = time.time()
+    for _ in range(args.runs):
+        native = server.apply_mastering(audio.copy(), SAMPLE_RATE)
+    native_ms = (time.time() - start) / args.runs * 1000
+    native_lufs = server.measure_loudness(native, SAMPLE_RATE)
+    native_peak = 20 * np.log10(np.abs(native).max())
+
+    print(f"\nNative:  {native_ms:8.1f} ms/run  {native_lufs:6.2f} LUFS "
+          f"(error {native_lufs - TARGET_LUFS:+.2f} LU)  peak {native_peak:.2f} dBFS")
+
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        print("ffmpeg:  not found on PATH, skipped")
+        print("=" * 60)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "in.wav")
+        output = os.path.join(tmp, "out.wav")
+        write_wav(source, audio)
+
+        start = time.time()
+        for _ in range(args.runs):
+            subprocess.run(
+                [ffmpeg, '-i', source, '-af', FFMPEG_FILTER, '-ar', str(SAMPLE_RATE), '-y', output],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+            )
+            mastered = read_wav(output)
+        ffmpeg_ms = (time.time() - start) / args.runs * 1000
+
+    ffmpeg_lufs = server.measure_loudness(mastered, SAMPLE_RATE)
+    print(f"ffmpeg:  {ffmpeg_ms:8.1f} ms/run  {ffmpeg_lufs:6.2f} LUFS "
+          f"(error {ffmpeg_lufs - TARGET_LUFS:+.2f} LU)  (includes WAV write + process spawn)")
+    print(f"\nSpeedup: {ffmpeg_ms / native_ms:.1f}x")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
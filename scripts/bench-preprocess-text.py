@@ -0,0 +1,64 @@
+"""
+Text normalization benchmark: single-pass preprocess_text vs the old nine-pass version
+Uses the fine-tune transcripts repeated to book length. That both produce identical
+text is checked by scripts/test-preprocess-text.py.
+Run from the repo root in the Coqui server environment:
+
+    python scripts/bench-preprocess-text.py --chars 600000
+"""
+
+import argparse
+import glob
+import importlib.util
+import time
+
+def load_server():
+    spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_legacy():
+    """The old nine-pass preprocess_text, from the golden-output test"""
+    spec = importlib.util.spec_from_file_location("test_preprocess_text", "scripts/test-preprocess-text.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.legacy_preprocess_text
+
+def measure(name, fn, text, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(text)
+    elapsed_ms = (time.perf_counter() - start) / runs * 1000
+    print(f"{name:<18} {elapsed_ms:8.1f} ms/run")
+    return elapsed_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chars", type=int, default=600000, help="Approximate book length in characters")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = [open(path, encoding="utf-8").read() for path in sorted(glob.glob("fine-tune-data/transcripts/*.txt"))]
+    corpus.append(open("demo-content/reddit-launch-story.txt", encoding="utf-8").read())
+    chapter = "\n\n".join(corpus)
+    book = "\n\n".join([chapter] * max(1, args.chars // len(chapter)))
+
+    server = load_server()
+    legacy_preprocess_text = load_legacy()
+
+    print("=" * 60)
+    print(f"preprocess_text benchmark: {len(book):,} chars, {args.runs} runs")
+    print("=" * 60)
+
+    old_ms = measure("nine passes", legacy_preprocess_text, book, args.runs)
+    server._normalize_sentence.cache_clear()
+    cold_ms = measure("single pass", lambda text: (server._normalize_sentence.cache_clear(), server.preprocess_text(text)), book, args.runs)
+    warm_ms = measure("single pass, warm", server.preprocess_text, book, args.runs)
+
+    print(f"\nSpeedup: {old_ms / cold_ms:.1f}x cold, {old_ms / warm_ms:.1f}x with the sentence cache warm")
+    print(f"Sentence cache: {server.text_cache_stats()}")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
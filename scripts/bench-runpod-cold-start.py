@@ -0,0 +1,89 @@
+"""
+Cold-start benchmark for the RunPod handler: before vs after
+Each run is a fresh Python process, like a worker scaling up from zero
+
+before: full checkpoint reads, no warmup, model loaded by the first job
+after:  memory-mapped checkpoint, warmup inference, model loaded before the first job
+
+Reported per run: time until the worker is ready, and the first job's latency
+(ready + first job is what a listener waits for after a scale-from-zero).
+Run from the repo root in the RunPod image (python runpod-serverless/handler.py --prepare first):
+
+    python scripts/bench-runpod-cold-start.py --runs 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+CHILD = """
+import asyncio, json, time
+import handler
+
+async def run_job(job):
+    outputs = [output async for output in handler.handler(job)]
+    return outputs[-1]
+
+if {eager}:
+    handler.load_model()
+ready = time.time() - handler.PROCESS_START
+start = time.time()
+result = asyncio.run(run_job({{"input": {{"text": {text!r}}}}}))
+first_job = time.time() - start
+print("RESULT " + json.dumps({{
+    "ready": ready,
+    "first_job": first_job,
+    "phases": handler.cold_start_timings,
+    "error": result.get("error")
+}}))
+"""
+
+MODES = {
+    "before": ({"CHECKPOINT_MMAP": "0", "WARMUP": "0"}, False),
+    "after": ({"CHECKPOINT_MMAP": "1", "WARMUP": "1"}, True),
+}
+
+def run(mode, text):
+    env_overrides, eager = MODES[mode]
+    env = dict(os.environ, **env_overrides)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(eager=eager, text=text)],
+        cwd="runpod-serverless", env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        text=True, check=True
+    ).stdout
+    line = next(l for l in output.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--text", default="The rain had not stopped for three days.")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"RunPod cold-start benchmark: {args.runs} fresh process(es) per mode")
+    print("=" * 60)
+
+    totals = {}
+    for mode in MODES:
+        for i in range(args.runs):
+            result = run(mode, args.text)
+            if result["error"]:
+                print(f"{mode:<7} run {i + 1}: job failed: {result['error']}")
+                continue
+            total = result["ready"] + result["first_job"]
+            totals.setdefault(mode, []).append(total)
+            phases = ", ".join(f"{k} {v:.1f}s" for k, v in result["phases"].items())
+            print(f"{mode:<7} run {i + 1}: ready {result['ready']:6.1f}s  first job {result['first_job']:6.2f}s  "
+                  f"total {total:6.1f}s  [{phases}]")
+
+    if len(totals) == 2:
+        before = min(totals["before"])
+        after = min(totals["after"])
+        print(f"\nBest time to first audio: before {before:.1f}s, after {after:.1f}s ({before - after:+.1f}s saved)")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
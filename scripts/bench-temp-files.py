@@ -0,0 +1,107 @@
+"""
+Benchmark: old temp-file post-processing vs the in-memory pipeline
+Uses a synthetic waveform in place of model output, so no GPU is needed
+
+The old path is what /generate did before: save WAV to a temp file, re-read it,
+denoise and rewrite it, read it again, copy into a BytesIO. The new path
+post-processes the array and encodes straight into the response buffer.
+
+Run from the repo root in the Coqui server environment (Linux for syscall counts):
+
+    python scripts/bench-temp-files.py --seconds 120
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 24000
+DENOISER_STRENGTH = 0.02
+
+def load_server():
+    spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def io_counters():
+    """Read/write syscall counts for this process (Linux only)"""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["syscr"]), int(fields["syscw"])
+    except (OSError, KeyError):
+        return None
+
+def temp_file_pipeline(server, wav):
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+        path = tmp.name
+    try:
+        # tts_to_file: peak-normalized int16 WAV on disk
+        pcm = (wav * (32767 / max(0.01, np.abs(wav).max()))).astype(np.int16)
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
+
+        # Old apply_denoising: read, process, rewrite
+        with wave.open(path, "rb") as f:
+            audio = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+        denoised = server.apply_denoising(audio, SAMPLE_RATE, DENOISER_STRENGTH)
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((denoised * 32767).astype(np.int16).tobytes())
+
+        # Read back for the response
+        with open(path, "rb") as f:
+            return io.BytesIO(f.read())
+    finally:
+        os.unlink(path)
+
+def in_memory_pipeline(server, wav):
+    processed = server.postprocess_audio(wav.copy(), SAMPLE_RATE, DENOISER_STRENGTH)
+    return server.encode_wav(processed, SAMPLE_RATE)
+
+def measure(name, fn, runs):
+    before = io_counters()
+    start = time.time()
+    for _ in range(runs):
+        size = len(fn().getbuffer())
+    elapsed_ms = (time.time() - start) / runs * 1000
+    after = io_counters()
+
+    syscalls = ""
+    if before and after:
+        syscalls = f"  {(after[0] - before[0]) / runs:6.0f} read + {(after[1] - before[1]) / runs:6.0f} write syscalls/run"
+    print(f"{name:<12} {elapsed_ms:8.1f} ms/run  {size / 1e6:.1f} MB{syscalls}")
+    return elapsed_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = load_server()
+    rng = np.random.RandomState(0)
+    wav = (rng.randn(SAMPLE_RATE * args.seconds) * 0.2).astype(np.float32)
+
+    print("=" * 60)
+    print(f"Post-processing I/O benchmark: {args.seconds}s of audio, {args.runs} runs")
+    print("=" * 60)
+    old_ms = measure("temp files", lambda: temp_file_pipeline(server, wav), args.runs)
+    new_ms = measure("in memory", lambda: in_memory_pipeline(server, wav), args.runs)
+    print(f"\nSaved: {old_ms - new_ms:.1f} ms per request")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
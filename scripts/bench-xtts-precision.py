@@ -0,0 +1,128 @@
+"""
+XTTS inference mode benchmark: speed and quality of each mode against fp32
+Each mode runs in a fresh process with XTTS_PRECISION / XTTS_COMPILE set, through
+coqui-server.py's synthesize_sentences (sentence cache disabled)
+
+Decoding is made greedy (top_k=1) so the modes produce the same tokens and the
+spectral distance measures precision, not sampling. Reported per mode:
+real-time factor (synthesis time / audio duration, lower is faster) and the
+log-spectral distance to the fp32 output in dB (0 is identical).
+
+Runs on CPU too (fp32, bf16, compile), so regressions show up without a GPU:
+
+    python scripts/bench-xtts-precision.py --cpu
+    python scripts/bench-xtts-precision.py --modes fp32,fp16,bf16,fp16+compile
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from scipy import signal
+
+SAMPLE_RATE = 24000
+TEXTS = [
+    "The rain had not stopped for three days.",
+    "She folded the letter twice and slid it under the door, then waited in the hall.",
+    "Nobody in the village remembered who built the old bridge, or why it was never finished.",
+]
+
+CHILD = """
+import importlib.util, json, sys, time
+import numpy as np
+
+spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(server)
+
+tts = server.get_tts_model()
+tts.synthesizer.tts_model.config.top_k = 1
+texts, out = json.loads(sys.argv[1]), sys.argv[2]
+
+def render(text):
+    return np.concatenate(list(server.synthesize_sentences(tts, text, "en", 1.0, speaker_name="Claribel Dervla")))
+
+render(texts[0])  # Warmup (and compilation)
+results = []
+for index, text in enumerate(texts):
+    start = time.time()
+    audio = render(text)
+    results.append({"seconds": time.time() - start, "duration": len(audio) / tts.synthesizer.output_sample_rate})
+    np.save(f"{out}/{index}.npy", audio)
+print("RESULT " + json.dumps(results))
+"""
+
+def run_mode(mode, out_dir, cpu):
+    precision, _, compile_flag = mode.partition("+")
+    env = dict(
+        os.environ,
+        XTTS_PRECISION=precision,
+        XTTS_COMPILE="true" if compile_flag == "compile" else "false",
+        XTTS_SENTENCE_CACHE_MB="0",
+    )
+    if cpu:
+        env["CUDA_VISIBLE_DEVICES"] = ""
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(TEXTS), out_dir],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+    ).stdout
+    line = next(l for l in output.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+def log_spectral_distance(reference, test):
+    """Mean over frames of the RMS difference of the log power spectra, in dB"""
+    n = min(len(reference), len(test))
+    _, _, ref = signal.stft(reference[:n], fs=SAMPLE_RATE, nperseg=1024)
+    _, _, tst = signal.stft(test[:n], fs=SAMPLE_RATE, nperseg=1024)
+    ref_db = 10 * np.log10(np.abs(ref) ** 2 + 1e-10)
+    tst_db = 10 * np.log10(np.abs(tst) ** 2 + 1e-10)
+    return float(np.mean(np.sqrt(np.mean((ref_db - tst_db) ** 2, axis=0))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="fp32,bf16,fp32+compile",
+                        help="Comma-separated precision[+compile] modes, fp32 is always run first")
+    parser.add_argument("--cpu", action="store_true", help="Hide CUDA devices from the runs")
+    parser.add_argument("--max-lsd", type=float, default=None,
+                        help="Exit with status 1 if any mode is further than this from fp32 (dB)")
+    args = parser.parse_args()
+
+    modes = ["fp32"] + [m for m in args.modes.split(",") if m and m != "fp32"]
+
+    print("=" * 60)
+    print(f"XTTS inference modes: {', '.join(modes)} ({'CPU' if args.cpu else 'default device'})")
+    print("=" * 60)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            out_dir = os.path.join(tmp, mode)
+            os.makedirs(out_dir)
+            results = run_mode(mode, out_dir, args.cpu)
+            rtf = sum(r["seconds"] for r in results) / sum(r["duration"] for r in results)
+
+            distances = []
+            length_diffs = []
+            for index in range(len(TEXTS)):
+                reference = np.load(os.path.join(tmp, "fp32", f"{index}.npy"))
+                audio = np.load(os.path.join(out_dir, f"{index}.npy"))
+                distances.append(log_spectral_distance(reference, audio))
+                length_diffs.append(abs(len(audio) - len(reference)) / len(reference) * 100)
+            lsd = max(distances)
+
+            print(f"{mode:<14} RTF {rtf:6.3f}  LSD vs fp32 {lsd:5.2f} dB (worst text)  "
+                  f"length diff {max(length_diffs):4.1f}%")
+            if args.max_lsd is not None and lsd > args.max_lsd:
+                failed = True
+
+    print("=" * 60)
+    if failed:
+        print(f"FAILED: a mode is more than {args.max_lsd} dB from fp32")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Golden-output test for preprocess_text in coqui-server.py
+
+preprocess_text must produce exactly what the old nine-pass version did. Checks
+hand-picked cases (repeated "and"s, punctuation runs, unicode), the fine-tune
+transcripts, and randomized inputs. Exits non-zero on the first mismatch.
+Run from the repo root in the Coqui server environment:
+
+    python scripts/test-preprocess-text.py --cases 300000
+"""
+
+import argparse
+import glob
+import importlib.util
+import random
+import re
+
+CASES = [
+    "",
+    "salt and pepper and and more",
+    "a and b and c and d",
+    "a and and b",
+    "a and and and b",
+    "and and and",
+    "w and w and and w",
+    "x and y. and z and w",
+    "andy and band and and",
+    "one  and\tand \n two",
+    "rock and roll, and more",
+    "Wait... what?!  Really:  yes; no ,, maybe , ,",
+    "café and crème and and brûlée",
+    "snake_case and and x1 and 2",
+    "\"quoted\" and 'single' and - dash",
+    "Hello.World!How?Are:you;today,fine",
+    "  leading and trailing  ",
+]
+
+ALPHABET = ['a', 'b', 'and', 'and', 'and', 'And', 'x1', 'é', '_', ' ', ' ', ' ', '  ', '\n', '\t',
+            '.', '!', '?', ':', ';', ',', '"', '-', "'", '…', 'andy', 'band']
+
+def load_server():
+    spec = importlib.util.spec_from_file_location("coqui_server", "coqui-server.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def legacy_preprocess_text(text):
+    """preprocess_text as it was before the single-pass rewrite (the golden reference)"""
+    text = re.sub(r'\.(\s+)', r'., ', text)
+    text = re.sub(r'!(\s+)', r'!, ', text)
+    text = re.sub(r'\?(\s+)', r'?, ', text)
+    text = re.sub(r':(\s+)', r':, ', text)
+    text = re.sub(r';(\s+)', r';, ', text)
+    text = re.sub(r',(\s*)', r', ', text)
+    text = re.sub(r'(\w+)\s+and\s+(\w+)', r'\1, and \2', text)
+    text = re.sub(r',\s*,+', r',', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def random_cases(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 25)))
+
+def check(preprocess_text, inputs):
+    """Returns the number of inputs checked, raises SystemExit on the first mismatch"""
+    checked = 0
+    for text in inputs:
+        expected = legacy_preprocess_text(text)
+        actual = preprocess_text(text)
+        if actual != expected:
+            raise SystemExit(f"❌ Output mismatch for {text[:80]!r}:\n  old: {expected[:120]!r}\n  new: {actual[:120]!r}")
+        checked += 1
+    return checked
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=100000, help="Randomized inputs")
+    args = parser.parse_args()
+
+    corpus = [open(path, encoding="utf-8").read() for path in sorted(glob.glob("fine-tune-data/transcripts/*.txt"))]
+    server = load_server()
+
+    checked = check(server.preprocess_text, CASES + corpus)
+    checked += check(server.preprocess_text, random_cases(args.cases))
+    # Again with the sentence cache warm
+    checked += check(server.preprocess_text, random_cases(min(args.cases, 10000)))
+    print(f"✅ preprocess_text matches the old implementation on {checked} inputs")
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,27 @@ function formatDuration(seconds: number): string {
   return `${mins}m ${secs}s`;
 }
 
+// Audio from the handler's result: inline base64, or a (presigned) audio_url
+// when the output was too large to return inline and went to object storage
+async function readRunPodAudio(output: {
+  audio_base64?: string;
+  audio_url?: string;
+}): Promise<Buffer> {
+  if (output?.audio_base64) {
+    return Buffer.from(output.audio_base64, "base64");
+  }
+  if (output?.audio_url) {
+    const response = await fetch(output.audio_url);
+    if (!response.ok) {
+      throw new Error(
+        `Failed to download RunPod audio: ${response.status} ${response.statusText}`
+      );
+    }
+    return Buffer.from(await response.arrayBuffer());
+  }
+  throw new Error("RunPod response missing audio data");
+}
+
 export async function POST(request: NextRequest) {
   try {
     const { workId, userId, chapters, voiceSettings } = await request.json();
@@ -137,18 +158,24 @@ export async function POST(request: NextRequest) {
       // RunPod runsync wraps handler response in "output"
       // Handler returns: {audio_base64, format, sample_rate}
       // RunPod returns: {output: {audio_base64, format, sample_rate}} OR {error: ...}
-      const output = result.output || result;
+      // The generator handler's outputs are aggregated into a list, the result is last
+      const output = Array.isArray(result.output)
+        ? result.output[result.output.length - 1]
+        : result.output || result;
+
+      if (output?.error) {
+        throw new Error(`RunPod error: ${output.error}`);
+      }
 
       if (result.error) {
         throw new Error(`RunPod error: ${result.error}`);
       }
 
-      if (!output.audio_base64) {
+      if (!output?.audio_base64 && !output?.audio_url) {
         console.error(`   ❌ Missing audio data in response:`, result);
-        throw new Error("RunPod response missing audio data");
       }
 
-      const audioBuffer = Buffer.from(output.audio_base64, "base64");
+      const audioBuffer = await readRunPodAudio(output);
       const duration = calculateWavDuration(audioBuffer.buffer);
 
       console.log(`   ✅ Generated ${audioBuffer.byteLength} bytes`);
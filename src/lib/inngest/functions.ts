@@ -32,6 +32,27 @@ function formatDuration(seconds: number): string {
   return `${mins}m ${secs}s`;
 }
 
+// Audio from the handler's result: inline base64, or a (presigned) audio_url
+// when the output was too large to return inline and went to object storage
+async function readRunPodAudio(output: {
+  audio_base64?: string;
+  audio_url?: string;
+}): Promise<Buffer> {
+  if (output?.audio_base64) {
+    return Buffer.from(output.audio_base64, "base64");
+  }
+  if (output?.audio_url) {
+    const response = await fetch(output.audio_url);
+    if (!response.ok) {
+      throw new Error(
+        `Failed to download RunPod audio: ${response.status} ${response.statusText}`
+      );
+    }
+    return Buffer.from(await response.arrayBuffer());
+  }
+  throw new Error("RunPod response missing audio data");
+}
+
 export const processTTSJob = inngest.createFunction(
   { id: "process-tts-job", name: "Process TTS Job" },
   { event: "tts/job.created" },
@@ -99,12 +120,22 @@ export const processTTSJob = inngest.createFunction(
 
         const result = await response.json();
 
-        // RunPod returns audio as base64 in result.output.audio_base64
-        if (!result.output || !result.output.audio_base64) {
-          throw new Error("RunPod response missing audio data");
+        // RunPod returns audio as base64 in result.output.audio_base64, or as
+        // audio_url when the handler sent a large output to object storage
+        // (a list of outputs from the generator handler, the result is last)
+        const output = Array.isArray(result.output)
+          ? result.output[result.output.length - 1]
+          : result.output;
+
+        if (output?.error) {
+          throw new Error(`RunPod error: ${output.error}`);
+        }
+
+        if (result.error) {
+          throw new Error(`RunPod error: ${result.error}`);
         }
 
-        const audioBuffer = Buffer.from(result.output.audio_base64, "base64");
+        const audioBuffer = await readRunPodAudio(output);
         const duration = calculateWavDuration(audioBuffer.buffer);
 
         console.log(`   ✅ Generated ${audioBuffer.byteLength} bytes`);